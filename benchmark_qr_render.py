@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Compara el render de códigos QR en PNG (PIL) y SVG (path vectorial):
+tiempo medio por imagen y tamaño de la salida, sin pasar por la caché.
+
+    python benchmark_qr_render.py [repeticiones]
+"""
+import sys
+import os
+import time
+import uuid
+sys.path.insert(0, os.path.dirname(__file__))
+
+from src.utils.qr_cache import render_qr, ERROR_CORRECTION_LEVELS
+
+# URLs representativas: QR de dispositivo (enlace corto y por UUID) y de marca (token de 43 caracteres)
+PAYLOADS = {
+    "dispositivo": "https://sello.example.cl/d/9ISD1T4KBef",
+    "uuid": f"https://sello.example.cl/public_device.html?uid={uuid.uuid4()}",
+    "marca": "https://sello.example.cl/index.html?brand=Samsung&token=" + "x" * 43
+}
+
+# (formato, box_size, border, nivel de corrección)
+CASES = [
+    ("png", 10, 4, "L"),
+    ("svg", 10, 4, "L"),
+    ("png", 10, 4, "M"),
+    ("svg", 10, 4, "M"),
+    ("png", 4, 2, "L"),
+    ("svg", 4, 2, "L"),
+]
+
+
+def benchmark(payload, image_format, box_size, border, level, repeats):
+    options = dict(
+        error_correction=ERROR_CORRECTION_LEVELS[level],
+        box_size=box_size,
+        border=border,
+        image_format=image_format
+    )
+    render_qr(payload, **options)  # Calentamiento
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        data = render_qr(payload, **options)
+    elapsed = time.perf_counter() - start
+    return elapsed / repeats * 1000, len(data)
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    print(f"Render de QR ({repeats} repeticiones por caso)\n")
+    print(f"{'QR':<12} {'formato':<8} {'size':>4} {'borde':>5} {'ec':>3} {'ms/imagen':>10} {'bytes':>8}")
+    for name, payload in PAYLOADS.items():
+        for image_format, box_size, border, level in CASES:
+            ms, size = benchmark(payload, image_format, box_size, border, level, repeats)
+            print(f"{name:<12} {image_format:<8} {box_size:>4} {border:>5} {level:>3} {ms:>10.2f} {size:>8}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
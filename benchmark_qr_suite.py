@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks del camino de generación de QR, con línea base versionada.
+
+Mide operaciones por segundo y tamaño de la salida de cada etapa:
+- matriz: qrcode.QRCode(version=1, fit=True) + add_data + make, por longitud
+  de URL, nombre de marca y nivel de corrección de errores
+- png / svg: codificación de la imagen a partir de la matriz
+- base64: envoltura data URI del PNG (lo que devolvían los endpoints JSON antes
+  de servir la imagen binaria)
+- caché: lectura de una imagen ya renderizada
+- endpoints: las rutas de src/routes/qr_routes.py con el cliente de pruebas de
+  Flask, sobre una base de datos temporal
+
+Compara con benchmark_qr_baseline.json y termina con código 1 si algún caso
+baja de ops/s más que el umbral o genera más bytes que la línea base. Para
+que la línea base sirva en otras máquinas (y con otros procesos compitiendo
+por la CPU) se comparan las ops/s relativas a una carga de referencia medida
+justo antes de cada ronda; las ops/s absolutas se guardan solo como dato.
+
+    python benchmark_qr_suite.py                     # comparar con la línea base
+    python benchmark_qr_suite.py --update-baseline   # guardar los resultados como línea base
+    python benchmark_qr_suite.py --threshold 0.4 --filter endpoint
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime
+from importlib.metadata import version
+
+# Base de datos, cachés y subidas temporales: el benchmark no toca los datos reales
+TEMP_DIR = tempfile.mkdtemp(prefix="qr_bench_")
+os.environ["DATABASE_URL"] = f"sqlite:///{TEMP_DIR}/bench.db"
+os.environ["UPLOAD_FOLDER"] = os.path.join(TEMP_DIR, "uploads")
+os.environ["PUBLIC_CACHE_PATH"] = os.path.join(TEMP_DIR, "public_cache.db")
+os.environ["QR_CACHE_FOLDER"] = os.path.join(TEMP_DIR, "qr_cache")
+os.environ["QR_PRERENDER"] = "0"
+sys.path.insert(0, os.path.dirname(__file__))
+
+import qrcode
+
+from src.main import app
+from src.models.user import db
+from src.models.brand import Brand
+from src.models.device import Device
+from src.models.qr_token import QrToken
+from src.utils.qr_cache import render_svg_path, qr_render_cache, ERROR_CORRECTION_LEVELS
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_qr_baseline.json")
+DEFAULT_THRESHOLD = 0.3   # Caída máxima de ops/s aceptada frente a la línea base
+BYTES_TOLERANCE = 0.02    # Crecimiento máximo de la salida (cambios de versión de Pillow/zlib)
+ROUND_SECONDS = 0.1       # Duración aproximada de cada ronda de medición
+ROUNDS = 5                # Se conserva la mejor ronda (reduce el ruido de la máquina)
+
+HOST = "https://sello.example.cl/"
+# Contenidos representativos: longitud de URL y nombre de marca
+PAYLOADS = {
+    "corta": HOST + "d/9ISD1T4KBef",
+    "uuid": HOST + f"public_device.html?uid={uuid.UUID(int=0x1234567890abcdef1234567890abcdef)}",
+    "marca": HOST + "index.html?brand=Acme&token=" + "x" * 43,
+    "marca-larga": HOST + "index.html?brand=Compañía Electrónica del Pacífico Sur&token=" + "x" * 43,
+    "larga": HOST + "public_device.html?" + "&".join(f"p{i}=valor{i}" for i in range(12)),
+}
+
+
+def build_qr(payload, level):
+    qr = qrcode.QRCode(version=1, error_correction=ERROR_CORRECTION_LEVELS[level], box_size=10, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+def encode_png(qr):
+    buffer = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def render_cases():
+    """Casos sin aplicación: (nombre, función que devuelve bytes o None)"""
+    cases = []
+    for name, payload in PAYLOADS.items():
+        for level in ERROR_CORRECTION_LEVELS:
+            cases.append((f"matriz/{name}/{level}", lambda p=payload, l=level: build_qr(p, l) and None))
+
+        for level in ("L", "H"):
+            qr = build_qr(payload, level)
+            png = encode_png(qr)
+            cases.append((f"png/{name}/{level}", lambda qr=qr: encode_png(qr)))
+            cases.append((f"svg/{name}/{level}", lambda qr=qr: render_svg_path(qr.modules, 10, 4)))
+            cases.append((f"base64/{name}/{level}", lambda png=png: ("data:image/png;base64," + base64.b64encode(png).decode()).encode()))
+
+        qr_render_cache.get_or_render(payload)
+        cases.append((f"cache/{name}", lambda p=payload: qr_render_cache.get(p)))
+    return cases
+
+
+def endpoint_cases():
+    """Casos de las rutas de QR con el cliente de pruebas (sesión de administrador)"""
+    client = app.test_client()
+    response = client.post("/api/auth/login", json={"email": "admin@carmona.net", "password": "admin123"})
+    if response.status_code != 200:
+        raise RuntimeError(f"No se pudo iniciar sesión: {response.status_code}")
+
+    with app.app_context():
+        device = Device(
+            marca="Acme", nombre_catalogo="Benchmark", modelo_comercial="B1", modelo_tecnico="B1",
+            ano_lanzamiento=2024, fecha_vigencia=date(2030, 1, 1), categoria="Otros",
+            subcategoria="Otros", grupo="2024", short_code="BenchQR0001"
+        )
+        db.session.add(device)
+        if not Brand.query.filter_by(name="Acme").first():
+            db.session.add(Brand(name="Acme"))
+        # Código corto y token fijos: el tamaño de las respuestas es reproducible entre ejecuciones
+        db.session.add(QrToken(
+            token="x" * 43, brand_name="Acme", token_type="brand",
+            expires_at=datetime(2099, 1, 1)
+        ))
+        db.session.commit()
+        device_id, short_code = device.id, device.short_code
+
+    def get(url, expected=200, **headers):
+        def request():
+            response = client.get(url, headers=headers)
+            if response.status_code != expected:
+                raise RuntimeError(f"{url}: {response.status_code} (se esperaba {expected})")
+            return response.get_data()
+        return request
+
+    etag = client.get(f"/api/devices/{device_id}/qr.png").headers["ETag"]
+    client.get("/api/brands/Acme/qr.png")
+    return [
+        ("endpoint/dispositivo-json", get(f"/api/devices/{device_id}/qr")),
+        ("endpoint/dispositivo-png", get(f"/api/devices/{device_id}/qr.png")),
+        ("endpoint/dispositivo-svg", get(f"/api/devices/{device_id}/qr.svg")),
+        ("endpoint/dispositivo-304", get(f"/api/devices/{device_id}/qr.png", 304, **{"If-None-Match": etag})),
+        ("endpoint/enlace-corto", get(f"/d/{short_code}", 302)),
+        ("endpoint/marca-json", get("/api/brands/Acme/qr-with-token")),
+        ("endpoint/marca-png", get("/api/brands/Acme/qr.png")),
+    ]
+
+
+def reference_work():
+    """Carga fija de CPU en Python puro, independiente del código medido"""
+    return sorted(str(i * 7919 % 10007) for i in range(2000))
+
+
+def ops_per_second(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return iterations / (time.perf_counter() - start)
+
+
+def calibrate(function):
+    """Iteraciones para que una ronda dure ~ROUND_SECONDS"""
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= ROUND_SECONDS / 4:
+            return max(1, int(iterations * ROUND_SECONDS / elapsed))
+        iterations *= 2
+
+
+def measure(function, reference_iterations):
+    """
+    (ops/s, ops/s relativas, bytes de la salida). Cada ronda del caso va precedida
+    de una ronda de reference_work(): la relación entre ambas descuenta la
+    velocidad de la máquina y la carga de otros procesos en ese momento, así que
+    la comparación con la línea base usa la mediana de esa relación.
+    """
+    output = function()
+    iterations = calibrate(function)
+
+    absolute, relative = [], []
+    for _ in range(ROUNDS):
+        reference = ops_per_second(reference_work, reference_iterations)
+        ops = ops_per_second(function, iterations)
+        absolute.append(ops)
+        relative.append(ops / reference)
+    return max(absolute), statistics.median(relative), len(output) if output is not None else None
+
+
+def compare(name, result, baseline, threshold):
+    """Lista de regresiones del caso frente a la línea base"""
+    reference = baseline.get(name)
+    if reference is None:
+        return []
+    problems = []
+    if result["relative"] < reference["relative"] * (1 - threshold):
+        drop = 1 - result["relative"] / reference["relative"]
+        problems.append(f"ops/s relativas {drop:.0%} por debajo de la línea base")
+    if result["bytes"] is not None and reference.get("bytes") is not None \
+            and result["bytes"] > reference["bytes"] * (1 + BYTES_TOLERANCE):
+        problems.append(f"bytes {result['bytes']} > {reference['bytes']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de generación de QR")
+    parser.add_argument("--update-baseline", action="store_true", help="guardar los resultados como línea base")
+    parser.add_argument("--threshold", type=float, default=None, help="caída máxima de ops/s (0.3 = 30%%)")
+    parser.add_argument("--filter", default="", help="ejecutar solo los casos cuyo nombre contenga este texto")
+    args = parser.parse_args()
+
+    baseline_file = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline_file = json.load(f)
+    baseline = baseline_file.get("cases", {})
+    threshold = args.threshold if args.threshold is not None else baseline_file.get("threshold", DEFAULT_THRESHOLD)
+
+    cases = [case for case in render_cases() + endpoint_cases() if args.filter in case[0]]
+    reference_iterations = calibrate(reference_work)
+    results = {}
+    regressions = 0
+    print(f"{'caso':<32} {'ops/s':>10} {'relativo':>10} {'base':>10} {'bytes':>7}")
+    for name, function in cases:
+        ops_per_sec, relative, size = measure(function, reference_iterations)
+        results[name] = {"ops_per_sec": round(ops_per_sec, 1), "relative": round(relative, 5), "bytes": size}
+        reference = baseline.get(name, {}).get("relative")
+        problems = [] if args.update_baseline else compare(name, results[name], baseline, threshold)
+        status = "  REGRESIÓN: " + "; ".join(problems) if problems else ""
+        print(f"{name:<32} {ops_per_sec:>10.0f} {relative:>10.4f} {reference or '-':>10} "
+              f"{size if size is not None else '-':>7}{status}")
+        regressions += bool(problems)
+
+    if args.update_baseline:
+        # Al filtrar solo se reemplazan los casos ejecutados
+        baseline.update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump({
+                "threshold": threshold,
+                "machine": f"{platform.machine()} / Python {platform.python_version()} / qrcode {version('qrcode')} / Pillow {version('pillow')}",
+                "cases": dict(sorted(baseline.items()))
+            }, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\nLínea base guardada en {BASELINE_PATH}")
+        return 0
+
+    if not baseline:
+        print("\nSin línea base: ejecutar con --update-baseline para crearla.")
+        return 0
+    if regressions:
+        print(f"\n{regressions} caso(s) con regresión (umbral {threshold:.0%}).")
+        return 1
+    print(f"\nSin regresiones (umbral {threshold:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Comprobar las cabeceras de las descargas en cada modo de DOWNLOAD_OFFLOAD sin
+un nginx real (ver src/utils/file_delivery.py).
+
+Sube un archivo público y uno privado con contraseña a una base de datos
+temporal y descarga ambos con el cliente de pruebas de Flask por
+/api/files/<id> y /api/download-protected-file/<id>:
+- sin offload: cuerpo completo, ETag = SHA-256, Range (206 / 416) y 304
+- x-accel: sin cuerpo, X-Accel-Redirect a la ubicación interna
+- x-sendfile: sin cuerpo, X-Sendfile con la ruta absoluta
+- /api/download-protected-file-by-path/<ruta>: carpetas y rutas fuera de
+  UPLOAD_FOLDER (también una carpeta hermana con el mismo prefijo) dan 404
+En todos: Content-Type, Content-Disposition y Cache-Control (público con
+max-age, privado con 'private, no-cache'), y sin cabecera de offload cuando
+la petición no está autorizada.
+
+    python check_download_offload.py
+"""
+import io
+import os
+import sys
+import tempfile
+
+# Base de datos y subidas temporales: la comprobación no toca los datos reales
+TEMP_DIR = tempfile.mkdtemp(prefix="download_check_")
+os.environ["DATABASE_URL"] = f"sqlite:///{TEMP_DIR}/check.db"
+os.environ["UPLOAD_FOLDER"] = os.path.join(TEMP_DIR, "uploads")
+os.environ["PUBLIC_CACHE_PATH"] = os.path.join(TEMP_DIR, "public_cache.db")
+os.environ["QR_CACHE_FOLDER"] = os.path.join(TEMP_DIR, "qr_cache")
+os.environ["QR_PRERENDER"] = "0"
+sys.path.insert(0, os.path.dirname(__file__))
+
+from werkzeug.http import parse_options_header
+
+from src.main import app
+from src.password_protected_downloads import DOWNLOAD_PASSWORD
+from src.utils.file_delivery import file_delivery
+
+CONTENT = bytes(range(256)) * 400  # ~100 KB
+PDF_NAME = "Manual de usuario.pdf"
+
+failures = []
+
+
+def check(condition, message):
+    print(f"    [{'OK' if condition else 'FALLO'}] {message}")
+    if not condition:
+        failures.append(message)
+
+
+def create_files(client):
+    """Dispositivo con un archivo público y otro privado con contraseña (mismo contenido)"""
+    client.post("/api/auth/login", json={"email": "admin@carmona.net", "password": "admin123"})
+    response = client.post("/api/devices", json={
+        "marca": "Descargas", "nombre_catalogo": "Equipo", "modelo_comercial": "M", "modelo_tecnico": "T",
+        "ano_lanzamiento": "2024", "fecha_vigencia": "2030-01-01", "categoria": "c", "subcategoria": "s", "grupo": "g"
+    })
+    device_id = response.get_json()["id"]
+
+    files = {}
+    for name, visibility, requires_password in (("public", "public", "false"), ("private", "private", "true")):
+        response = client.post("/api/files/upload", content_type="multipart/form-data", data={
+            "device_id": str(device_id), "file_type": "manual", "visibility": visibility,
+            "requires_password": requires_password, "file": (io.BytesIO(CONTENT), PDF_NAME)
+        })
+        files[name] = response.get_json()
+    client.post("/api/auth/logout")
+    return files
+
+
+def check_common(response, device_file, private):
+    check(response.mimetype == "application/pdf", f"Content-Type: {response.mimetype}")
+    disposition, options = parse_options_header(response.headers.get("Content-Disposition", ""))
+    check(disposition == "attachment" and options.get("filename") == device_file["file_name"],
+          f"Content-Disposition: {response.headers.get('Content-Disposition')}")
+    cache_control = response.cache_control
+    if private:
+        check(cache_control.private and cache_control.no_cache and not cache_control.public,
+              f"Cache-Control privado: {response.headers.get('Cache-Control')}")
+    else:
+        check(cache_control.public and cache_control.max_age == file_delivery.max_age,
+              f"Cache-Control público: {response.headers.get('Cache-Control')}")
+
+
+def check_worker_mode(client, files):
+    url = f"/api/files/{files['public']['id']}"
+    response = client.get(url)
+    check(response.status_code == 200 and response.data == CONTENT, f"GET {url}: {response.status_code}, cuerpo completo")
+    check_common(response, files["public"], private=False)
+    check(response.headers.get("Accept-Ranges") == "bytes", "Accept-Ranges: bytes")
+    etag, _ = response.get_etag()
+    check(etag == files["public"]["sha256"], f"ETag = SHA-256 del contenido ({etag})")
+
+    response = client.get(url, headers={"Range": "bytes=100-199"})
+    check(response.status_code == 206 and response.data == CONTENT[100:200],
+          f"Range bytes=100-199: {response.status_code}, {response.headers.get('Content-Range')}")
+    response = client.get(url, headers={"Range": f"bytes={len(CONTENT)}-"})
+    check(response.status_code == 416, f"Range fuera del archivo: {response.status_code}")
+    response = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+    check(response.status_code == 304 and not response.data, f"If-None-Match: {response.status_code}")
+    response = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"otro"'})
+    check(response.status_code == 200 and response.data == CONTENT, f"If-Range con otro ETag: {response.status_code}")
+
+    url = f"/api/download-protected-file/{files['private']['id']}?password={DOWNLOAD_PASSWORD}"
+    response = client.get(url)
+    check(response.status_code == 200 and response.data == CONTENT, f"GET descarga con contraseña: {response.status_code}")
+    check_common(response, files["private"], private=True)
+    response = client.get(url, headers={"Range": "bytes=-10"})
+    check(response.status_code == 206 and response.data == CONTENT[-10:], f"Range bytes=-10: {response.status_code}")
+
+
+def check_offload_mode(client, files, header, expected_path):
+    for name, url in (
+        ("public", f"/api/files/{files['public']['id']}"),
+        ("private", f"/api/download-protected-file/{files['private']['id']}?password={DOWNLOAD_PASSWORD}"),
+    ):
+        response = client.get(url, headers={"Range": "bytes=0-9"})
+        check(response.status_code == 200 and not response.data,
+              f"GET {url.split('?')[0]}: {response.status_code}, sin cuerpo (Range lo resuelve el servidor web)")
+        value = response.headers.get(header)
+        check(value == expected_path(files[name]), f"{header}: {value}")
+        other = "X-Sendfile" if header == "X-Accel-Redirect" else "X-Accel-Redirect"
+        check(other not in response.headers, f"sin {other}")
+        check("ETag" not in response.headers, "sin ETag propio (lo genera el servidor web)")
+        check_common(response, files[name], private=name == "private")
+
+    response = client.get(f"/api/download-protected-file/{files['private']['id']}?password=mala")
+    check(response.status_code == 401 and header not in response.headers, f"Contraseña incorrecta: {response.status_code}, sin {header}")
+    response = client.get(f"/api/files/{files['private']['id']}")
+    check(response.status_code == 403 and header not in response.headers, f"Archivo privado sin sesión: {response.status_code}, sin {header}")
+
+    # Por ruta: solo archivos dentro de UPLOAD_FOLDER
+    by_path = f"/api/download-protected-file-by-path/{{}}?password={DOWNLOAD_PASSWORD}"
+    response = client.get(by_path.format(files["public"]["file_path"]))
+    check(response.status_code == 200 and header in response.headers, f"Por ruta: {response.status_code}, con {header}")
+    root = os.path.abspath(app.config["UPLOAD_FOLDER"])
+    sibling = root + "_x"
+    os.makedirs(sibling, exist_ok=True)
+    with open(os.path.join(sibling, "secreto.txt"), "w") as secret_file:
+        secret_file.write("secreto")
+    for name, path in (("carpeta", "blobs"), ("carpeta hermana", "../uploads_x/secreto.txt")):
+        response = client.get(by_path.format(path))
+        check(response.status_code == 404 and header not in response.headers, f"Por ruta, {name}: {response.status_code}, sin {header}")
+    # Una ruta absoluta no llega a la vista por URL (//), pero resolve() también debe rechazarla
+    check(file_delivery.resolve(os.path.join(sibling, "secreto.txt")) is None, "resolve() rechaza la carpeta hermana por ruta absoluta")
+
+
+def main():
+    client = app.test_client()
+    with app.app_context():
+        files = create_files(client)
+    root = app.config["UPLOAD_FOLDER"]
+
+    print("Sin offload (el worker envía el archivo)")
+    file_delivery.mode = ""
+    check_worker_mode(client, files)
+
+    print("DOWNLOAD_OFFLOAD=x-accel")
+    file_delivery.mode = "x-accel"
+    check_offload_mode(client, files, "X-Accel-Redirect",
+                       lambda device_file: file_delivery.accel_prefix + device_file["file_path"].replace(os.sep, "/"))
+
+    print("DOWNLOAD_OFFLOAD=x-sendfile")
+    file_delivery.mode = "x-sendfile"
+    check_offload_mode(client, files, "X-Sendfile",
+                       lambda device_file: os.path.join(os.path.abspath(root), device_file["file_path"]))
+
+    if failures:
+        print(f"\n{len(failures)} comprobación(es) fallida(s).")
+        return 1
+    print("\nTodas las cabeceras son correctas.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Verifica que las consultas más frecuentes de las rutas usen índices.
+
+Ejecuta EXPLAIN QUERY PLAN (SQLite) o EXPLAIN (PostgreSQL) sobre cada consulta
+y termina con código 1 si alguna recorre una tabla completa. Usa la base de
+datos configurada en DATABASE_URL (o src/database/app.db).
+
+    python check_query_plans.py
+"""
+import re
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+from src.main import app
+from src.models.user import db, User
+from src.models.device import Device, DeviceFile
+from src.models.device_doc import DeviceDoc
+from src.models.qr_token import QrToken
+from src.models.qr_render_job import QrRenderJob
+from datetime import date, datetime
+from sqlalchemy import select, func, text, tuple_, or_, and_
+
+TEMP_DEVICE = "Dispositivo Temporal"
+
+
+def hot_queries():
+    """Consultas de las rutas (mismos filtros y orden que en src/routes/)"""
+    today = date.today()
+    listed = select(Device).where(Device.nombre_catalogo != TEMP_DEVICE)
+    return {
+        "Listado por marca (GET /devices?marca=)":
+            listed.where(Device.marca == "Samsung").order_by(Device.marca, Device.id).limit(51),
+        "Listado vigentes ordenado por marca (auditor, página siguiente)":
+            listed.where(Device.fecha_vigencia <= today, tuple_(Device.marca, Device.id) > ("Samsung", 10))
+            .order_by(Device.marca, Device.id).limit(51),
+        "Listado ordenado por vigencia (GET /devices?order=vigencia)":
+            listed.where(tuple_(Device.fecha_vigencia, Device.id) > (today, 10))
+            .order_by(Device.fecha_vigencia, Device.id).limit(51),
+        "Dispositivo temporal de una marca":
+            select(Device).where(Device.marca == "Samsung", Device.nombre_catalogo == TEMP_DEVICE),
+        "Dispositivo público por uuid":
+            select(Device).where(Device.uuid == "00000000-0000-0000-0000-000000000000"),
+        "Enlace corto del QR (/d/<código>)":
+            select(Device.uuid).where(Device.short_code == "9ISD1T4KBef"),
+        "Dispositivos por fabricante":
+            select(Device).where(Device.fabricante == "Samsung"),
+        "Archivos de varios dispositivos (selectinload)":
+            select(DeviceFile).where(DeviceFile.device_id.in_([1, 2, 3])),
+        "Imagen de marca (device_id + file_type)":
+            select(DeviceFile).where(DeviceFile.device_id == 1, DeviceFile.file_type == "imagen_marca"),
+        "Versión de archivos para el ETag público":
+            select(func.count(DeviceFile.id), func.max(DeviceFile.created_at)).where(DeviceFile.device_id == 1),
+        "DeviceDoc por clave normalizada":
+            select(DeviceDoc).where(DeviceDoc.lookup_key == DeviceDoc.build_lookup_key("a", "b", "c", "d")),
+        "Usuarios de una marca":
+            select(User).where(User.brand_name == "Samsung"),
+        "Token QR vigente de una marca":
+            select(QrToken).where(
+                QrToken.brand_name == "Samsung", QrToken.token_type == "brand", QrToken.used == False,
+                or_(QrToken.expires_at.is_(None), QrToken.expires_at > datetime(2030, 1, 1))
+            ).order_by(QrToken.expires_at.desc(), QrToken.id.desc()).limit(1),
+        "Tokens QR de una marca (eliminar marca)":
+            select(QrToken).where(QrToken.brand_name == "Samsung"),
+        "Token QR por valor":
+            select(QrToken).where(QrToken.token == "abc"),
+        "Trabajos de QR pendientes (al arrancar)":
+            select(QrRenderJob.id).where(QrRenderJob.status == "pending"),
+        "Trabajos de QR terminados (purga)":
+            select(QrRenderJob).where(or_(
+                and_(QrRenderJob.status == "done", QrRenderJob.updated_at < datetime(2030, 1, 1)),
+                and_(QrRenderJob.status == "failed", QrRenderJob.updated_at < datetime(2030, 1, 1))
+            )),
+        "Bytes de un dispositivo (cambio de marca)":
+            select(func.coalesce(func.sum(DeviceFile.file_size), 0), func.count(DeviceFile.id))
+            .where(DeviceFile.device_id == 1, DeviceFile.file_path.isnot(None)),
+        "Uso de almacenamiento por dispositivo de una marca":
+            select(Device.id, Device.storage_bytes).where(Device.marca == "Samsung", Device.storage_bytes > 0)
+            .order_by(Device.storage_bytes.desc(), Device.id).limit(100),
+    }
+
+
+def full_scans(connection, statement):
+    """Devuelve (plan, tablas recorridas completas) para la consulta"""
+    sql = str(statement.compile(connection, compile_kwargs={"literal_binds": True}))
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        plan = [row[-1] for row in rows]
+        scans = [match.group(1) for line in plan for match in [re.fullmatch(r"SCAN (\w+)", line)] if match]
+    else:
+        rows = connection.execute(text(f"EXPLAIN {sql}")).all()
+        plan = [row[0] for row in rows]
+        scans = [match.group(1) for line in plan for match in [re.search(r"Seq Scan on (\w+)", line)] if match]
+    return plan, scans
+
+
+def check_query_plans():
+    with app.app_context():
+        failures = 0
+        with db.engine.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                # Con tablas pequeñas el planificador prefiere Seq Scan aunque exista el índice
+                connection.execute(text("SET enable_seqscan = off"))
+
+            for name, statement in hot_queries().items():
+                plan, scans = full_scans(connection, statement)
+                status = "FALLO" if scans else "OK"
+                print(f"[{status}] {name}")
+                for line in plan:
+                    print(f"        {line}")
+                if scans:
+                    failures += 1
+                    print(f"        -> recorrido completo de: {', '.join(scans)}")
+
+        if failures:
+            print(f"\n{failures} consulta(s) sin índice.")
+            return 1
+        print("\nTodas las consultas usan índices.")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(check_query_plans())
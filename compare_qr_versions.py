@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Compara la versión (tamaño en módulos) del QR de un dispositivo con la URL
+por UUID y con el enlace corto /d/<código>, para cada nivel de corrección.
+Termina con código 1 si el enlace corto no reduce la versión.
+
+    python compare_qr_versions.py [url_base]
+"""
+import sys
+import os
+import uuid
+sys.path.insert(0, os.path.dirname(__file__))
+
+import qrcode
+from src.models.device import generate_short_code
+from src.utils.qr_cache import ERROR_CORRECTION_LEVELS
+
+
+def qr_version(payload, error_correction):
+    qr = qrcode.QRCode(error_correction=error_correction)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr.version
+
+
+def main():
+    base_url = sys.argv[1] if len(sys.argv) > 1 else "https://sello.example.cl/"
+    uuid_url = f"{base_url}public_device.html?uid={uuid.uuid4()}"
+    # El código más largo posible (11 caracteres) es el peor caso
+    short_code = max((generate_short_code() for _ in range(1000)), key=len)
+    short_url = f"{base_url}d/{short_code}"
+
+    print(f"UUID:  {uuid_url} ({len(uuid_url)} caracteres)")
+    print(f"Corto: {short_url} ({len(short_url)} caracteres)\n")
+    print(f"{'ec':>3} {'versión UUID':>13} {'versión corta':>14} {'módulos':>12}")
+
+    regressions = 0
+    for level, error_correction in ERROR_CORRECTION_LEVELS.items():
+        long_version = qr_version(uuid_url, error_correction)
+        short_version = qr_version(short_url, error_correction)
+        modules = f"{17 + 4 * long_version}->{17 + 4 * short_version}"
+        print(f"{level:>3} {long_version:>13} {short_version:>14} {modules:>12}")
+        if short_version >= long_version:
+            regressions += 1
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
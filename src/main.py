@@ -9,6 +9,9 @@ from src.models.user import db
 from src.models.device import Device, DeviceFile  # Importar modelos para crear tablas
 from src.models.brand import Brand  # Importar modelo Brand
 from src.models.device_doc import DeviceDoc # Importar nuevo modelo device_doc
+from src.models.qr_render_job import QrRenderJob  # Cola de pre-render de QR
+from src.models.file_blob import FileBlob  # Contenidos del almacén de archivos
+from src.models.brand_storage import BrandStorage  # Uso de almacenamiento por marca
 from src.routes.user import user_bp
 from src.routes.auth import auth_bp
 from src.routes.devices import devices_bp
@@ -17,6 +20,18 @@ from src.routes.qr_routes import qr_bp
 from src.routes.files import files_bp
 from src.password_protected_downloads import password_protected_downloads_bp
 from src.utils.migrations import run_migrations
+from src.utils.public_cache import public_device_cache
+from src.utils.qr_cache import qr_render_cache
+from src.utils.qr_batch import qr_batch_renderer
+from src.utils.search import setup_search_index
+from src.utils.maintenance import register_maintenance
+from src.utils.signed_tokens import signed_qr_tokens
+from src.utils.token_cache import qr_token_cache
+from src.utils.chunked_uploads import chunked_uploads
+from src.utils.blob_store import blob_store
+from src.utils.file_delivery import file_delivery
+from src.utils.storage_usage import backfill_storage_usage
+from src.utils.qr_jobs import qr_render_queue
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -29,6 +44,46 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB máximo
 UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(os.path.dirname(__file__), 'static', 'uploads'))
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Caché en disco del JSON público de dispositivos (compartida por todos los workers)
+app.config['PUBLIC_CACHE_PATH'] = os.environ.get('PUBLIC_CACHE_PATH', os.path.join(os.path.dirname(__file__), 'database', 'public_cache.db'))
+public_device_cache.init_app(app)
+
+# Caché de imágenes QR renderizadas (memoria + disco fuera de la carpeta estática, acotado en bytes)
+app.config['QR_CACHE_FOLDER'] = os.environ.get('QR_CACHE_FOLDER', os.path.join(os.path.dirname(__file__), 'database', 'qr_cache'))
+app.config['QR_CACHE_MAX_BYTES'] = int(os.environ.get('QR_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+qr_render_cache.init_app(app)
+app.config['QR_RENDER_PROCESSES'] = int(os.environ.get('QR_RENDER_PROCESSES', 2))  # Por worker; 1 = sin pool
+qr_batch_renderer.init_app(app)
+
+# Subidas reanudables por partes (estado en UPLOAD_FOLDER/.chunked; se eliminan tras 24h sin actividad)
+app.config['CHUNKED_UPLOAD_STALE_AFTER'] = int(os.environ.get('CHUNKED_UPLOAD_STALE_AFTER', 24 * 3600))
+chunked_uploads.init_app(app)
+
+# Almacén de archivos por contenido (UPLOAD_FOLDER/blobs, deduplicado por SHA-256)
+blob_store.init_app(app)
+
+# Descargas: '' = las envía el worker; 'x-accel' (nginx) o 'x-sendfile' = las envía el servidor web
+# (ver utils/file_delivery.py para la ubicación interna de nginx)
+app.config['DOWNLOAD_OFFLOAD'] = os.environ.get('DOWNLOAD_OFFLOAD', '').lower()
+app.config['DOWNLOAD_ACCEL_PREFIX'] = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-uploads/')
+app.config['DOWNLOAD_CACHE_MAX_AGE'] = int(os.environ.get('DOWNLOAD_CACHE_MAX_AGE', 3600))  # Solo archivos públicos
+file_delivery.init_app(app)
+
+# Pre-render de QR en segundo plano al crear dispositivos y marcas
+app.config['QR_PRERENDER'] = os.environ.get('QR_PRERENDER', '1').lower() not in ('0', 'false', 'no')
+app.config['QR_JOB_THREADS'] = int(os.environ.get('QR_JOB_THREADS', 2))
+qr_render_queue.init_app(app)
+
+# Tokens QR de marca firmados con HMAC (verificación sin consultar la base de datos)
+app.config['QR_SIGNED_TOKENS'] = os.environ.get('QR_SIGNED_TOKENS', '').lower() in ('1', 'true', 'yes')
+app.config['QR_TOKEN_REFRESH_INTERVAL'] = int(os.environ.get('QR_TOKEN_REFRESH_INTERVAL', 60))
+signed_qr_tokens.init_app(app)
+
+# Caché por worker de la validación de tokens QR de marca (segundos; 0 = sin caché)
+app.config['QR_TOKEN_CACHE_TTL'] = int(os.environ.get('QR_TOKEN_CACHE_TTL', 300))
+app.config['QR_TOKEN_CACHE_NEGATIVE_TTL'] = int(os.environ.get('QR_TOKEN_CACHE_NEGATIVE_TTL', 60))
+qr_token_cache.init_app(app)
+
 # Configurar CORS para permitir requests del frontend
 CORS(app, supports_credentials=True)
 
@@ -58,6 +113,7 @@ db.init_app(app)
 with app.app_context():
     run_migrations(app)
     db.create_all()
+    setup_search_index(app, db)
     
     # Crear usuario administrador por defecto si no existe
     from src.models.user import User
@@ -69,6 +125,16 @@ with app.app_context():
         db.session.commit()
         print("Usuario administrador creado: admin@carmona.net / admin123")
 
+    backfill_storage_usage(UPLOAD_FOLDER)
+    qr_render_queue.resume_pending()
+
+# Mantenimiento periódico: comandos de Flask y, con MAINTENANCE_BACKGROUND=1, tareas en
+# segundo plano en un solo proceso (el que toma el lock de MAINTENANCE_LOCK_PATH)
+app.config['MAINTENANCE_BACKGROUND'] = os.environ.get('MAINTENANCE_BACKGROUND', '').lower() in ('1', 'true', 'yes')
+app.config['MAINTENANCE_LOCK_PATH'] = os.environ.get('MAINTENANCE_LOCK_PATH', os.path.join(os.path.dirname(__file__), 'database', 'maintenance.lock'))
+app.config['QR_TOKEN_PURGE_INTERVAL'] = int(os.environ.get('QR_TOKEN_PURGE_INTERVAL', 6 * 3600))  # 0 = desactivada
+register_maintenance(app)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -0,0 +1,22 @@
+from src.models.user import db
+from datetime import datetime
+
+class BrandStorage(db.Model):
+    """Uso de almacenamiento de una marca, mantenido junto con los DeviceFile (ver utils/storage_usage.py)"""
+    __tablename__ = 'brand_storage'
+
+    brand_name = db.Column(db.String(100), primary_key=True)
+    storage_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'brand_name': self.brand_name,
+            'storage_bytes': self.storage_bytes,
+            'file_count': self.file_count,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+    def __repr__(self):
+        return f'<BrandStorage {self.brand_name} {self.storage_bytes}>'
@@ -1,11 +1,28 @@
 from src.models.user import db
 from src.models.device_doc import DeviceDoc
-from datetime import datetime
+from datetime import datetime, date
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import set_committed_value
+import secrets
 import uuid
 
+BASE62_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+def generate_short_code():
+    """Código corto del dispositivo: base62 de un valor aleatorio de 64 bits (hasta 11 caracteres)"""
+    value = secrets.randbits(64)
+    code = ''
+    while True:
+        value, remainder = divmod(value, 62)
+        code = BASE62_ALPHABET[remainder] + code
+        if not value:
+            return code
+
 class Device(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
+    # Código corto para la URL del QR (/d/<short_code>); más corto que el UUID, el QR es de menor versión
+    short_code = db.Column(db.String(16), unique=True, index=True, default=generate_short_code)
     marca = db.Column(db.String(100), nullable=False)
     nombre_catalogo = db.Column(db.String(200), nullable=False)
     modelo_comercial = db.Column(db.String(100), nullable=False)
@@ -25,8 +42,20 @@ class Device(db.Model):
     ganancia_antena = db.Column(db.String(255))
     pire_dbm = db.Column(db.Numeric(10, 2))
     pire_mw = db.Column(db.Numeric(10, 2))
+    fabricante = db.Column(db.String(100), index=True)  # Columna añadida por migración (ver utils/migrations.py)
+    # Bytes de los archivos subidos del dispositivo, mantenido al insertar/eliminar DeviceFile (ver utils/storage_usage.py)
+    storage_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # marca: filtro por marca y orden (marca, id) del listado paginado
+        db.Index('ix_device_marca', 'marca'),
+        # fecha_vigencia: filtro de vigentes y orden (fecha_vigencia, id)
+        db.Index('ix_device_fecha_vigencia', 'fecha_vigencia'),
+        # Búsqueda del "Dispositivo Temporal" de una marca y de sus dispositivos por catálogo
+        db.Index('ix_device_marca_nombre_catalogo', 'marca', 'nombre_catalogo'),
+    )
     
     # Relación con archivos
     files = db.relationship('DeviceFile', backref='device', lazy=True, cascade='all, delete-orphan')
@@ -34,50 +63,122 @@ class Device(db.Model):
     def __repr__(self):
         return f'<Device {self.marca} {self.modelo_comercial}>'
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'uuid': self.uuid,
-            'marca': self.marca,
-            'nombre_catalogo': self.nombre_catalogo,
-            'modelo_comercial': self.modelo_comercial,
-            'modelo_tecnico': self.modelo_tecnico,
-            'ano_lanzamiento': self.ano_lanzamiento,
-            'comentarios': self.comentarios,
-            'fecha_vigencia': self.fecha_vigencia.isoformat() if self.fecha_vigencia else None,
-            'importador_representante': self.importador_representante,
-            'domicilio': self.domicilio,
-            'correo_contacto': self.correo_contacto,
-            'tecnologia_modulacion': self.tecnologia_modulacion,
-            'frecuencias': self.frecuencias,
-            'ganancia_antena': self.ganancia_antena,
-            'pire_dbm': float(self.pire_dbm) if self.pire_dbm is not None else 0.0,
-            'pire_mw': float(self.pire_mw) if self.pire_mw is not None else 0.0,
-            'categoria': self.categoria,
-            'subcategoria': self.subcategoria,
-            'grupo': self.grupo,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'files': [file.to_dict() for file in self.files],
-            'device_doc': self.get_device_doc()
+    # Campos de to_dict() que salen de columnas propias del dispositivo
+    COLUMN_FIELDS = (
+        'id', 'uuid', 'marca', 'nombre_catalogo', 'modelo_comercial', 'modelo_tecnico',
+        'ano_lanzamiento', 'comentarios', 'fecha_vigencia', 'importador_representante',
+        'domicilio', 'correo_contacto', 'tecnologia_modulacion', 'frecuencias',
+        'ganancia_antena', 'pire_dbm', 'pire_mw', 'categoria', 'subcategoria', 'grupo',
+        'created_at', 'updated_at'
+    )
+    # Campos de to_dict() que requieren consultas adicionales
+    RELATION_FIELDS = ('files', 'device_doc')
+    # Columnas con las que se calcula doc_key()
+    DOC_KEY_FIELDS = ('marca', 'nombre_catalogo', 'modelo_comercial', 'modelo_tecnico')
+
+    def to_dict(self, docs_by_key=None, fields=None):
+        """Serializar el dispositivo.
+
+        `docs_by_key` permite pasar los DeviceDoc ya cargados (ver to_dict_batch)
+        para no consultar la base de datos por cada dispositivo. `fields` limita la
+        salida a un subconjunto de campos (None = todos); los archivos y el DeviceDoc
+        solo se consultan si se solicitan.
+        """
+        data = {
+            name: self.serialize_column(name)
+            for name in self.COLUMN_FIELDS
+            if fields is None or name in fields
         }
 
+        if fields is None or 'files' in fields:
+            data['files'] = [file.to_dict() for file in self.files]
+
+        if fields is None or 'device_doc' in fields:
+            if docs_by_key is None:
+                data['device_doc'] = self.get_device_doc()
+            else:
+                data['device_doc'] = DeviceDoc.to_summary(docs_by_key.get(self.doc_key()))
+
+        return data
+
+    def serialize_column(self, name):
+        """Valor JSON de una columna tal como aparece en to_dict()"""
+        value = getattr(self, name)
+        if name in ('pire_dbm', 'pire_mw'):
+            return float(value) if value is not None else 0.0
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        return value
+
+    @classmethod
+    def parse_fields(cls, raw_fields, extra_fields=()):
+        """Interpretar el parámetro ?fields=a,b,c (None = todos los campos)"""
+        if not raw_fields:
+            return None
+        fields = {name.strip() for name in raw_fields.split(',') if name.strip()}
+        unknown = fields - set(cls.COLUMN_FIELDS) - set(cls.RELATION_FIELDS) - set(extra_fields)
+        if unknown:
+            raise ValueError(f"Campos no soportados: {', '.join(sorted(unknown))}")
+        return fields
+
+    @classmethod
+    def load_only_columns(cls, fields, required=()):
+        """Columnas que hay que leer de la base de datos para servir `fields`"""
+        names = {name for name in fields if name in cls.COLUMN_FIELDS} | set(required)
+        if 'device_doc' in fields:
+            names |= set(cls.DOC_KEY_FIELDS)
+        return [getattr(cls, name) for name in sorted(names)]
+
+    def doc_key(self):
+        """Clave normalizada que relaciona el dispositivo con su DeviceDoc"""
+        return DeviceDoc.build_lookup_key(
+            self.marca, self.nombre_catalogo, self.modelo_comercial, self.modelo_tecnico
+        )
+
+    def find_device_doc(self):
+        """Obtener el DeviceDoc del dispositivo con una búsqueda indexada"""
+        return DeviceDoc.query.filter_by(lookup_key=self.doc_key()).first()
+
     def get_device_doc(self):
-        doc = DeviceDoc.query.filter_by(
-            marca=self.marca,
-            nombre_catalogo=self.nombre_catalogo,
-            modelo_comercial=self.modelo_comercial,
-            modelo_tecnico=self.modelo_tecnico
-        ).first()
-        if doc:
-            return {
-                'tecnologia_modulacion_doc': doc.tecnologia_modulacion_doc,
-                'frecuencias_doc': doc.frecuencias_doc,
-                'ganancia_antena_doc': doc.ganancia_antena_doc,
-                'pire_dbm_doc': doc.pire_dbm_doc,
-                'pire_mw_doc': doc.pire_mw_doc
+        return DeviceDoc.to_summary(self.find_device_doc())
+
+    @classmethod
+    def to_dict_batch(cls, devices, fields=None):
+        """Serializar una lista de dispositivos con un número constante de consultas.
+
+        Los archivos se cargan con una sola consulta para todos los dispositivos que
+        aún no los tengan en memoria (p. ej. si el listado ya usó selectinload) y los
+        DeviceDoc con una única consulta sobre la clave normalizada. Con `fields`
+        se omiten las consultas de las relaciones que no se soliciten.
+        """
+        devices = list(devices)
+        if not devices:
+            return []
+
+        # 1. Archivos: una consulta para todos los dispositivos sin la relación cargada
+        pending = []
+        if fields is None or 'files' in fields:
+            pending = [device for device in devices if 'files' in inspect(device).unloaded]
+        if pending:
+            files_by_device = {device.id: [] for device in pending}
+            pending_files = DeviceFile.query.filter(
+                DeviceFile.device_id.in_(list(files_by_device))
+            ).order_by(DeviceFile.id).all()
+            for device_file in pending_files:
+                files_by_device[device_file.device_id].append(device_file)
+            for device in pending:
+                set_committed_value(device, 'files', files_by_device[device.id])
+
+        # 2. DeviceDoc: una consulta indexada para todas las claves del listado
+        docs_by_key = {}
+        if fields is None or 'device_doc' in fields:
+            keys = list({device.doc_key() for device in devices})
+            docs_by_key = {
+                doc.lookup_key: doc
+                for doc in DeviceDoc.query.filter(DeviceDoc.lookup_key.in_(keys)).all()
             }
-        return None
+
+        return [device.to_dict(docs_by_key=docs_by_key, fields=fields) for device in devices]
 
 class DeviceFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -88,9 +189,15 @@ class DeviceFile(db.Model):
     visibility = db.Column(db.String(10), nullable=False, default='public')  # 'public' o 'private'
     external_url = db.Column(db.String(500))
     file_size = db.Column(db.Integer)
+    sha256 = db.Column(db.String(64))  # Hash del contenido, calculado al recibir la subida
     requires_password = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Archivos de un dispositivo (selectinload, ETag) y su imagen de marca por tipo
+        db.Index('ix_device_file_device_id_file_type', 'device_id', 'file_type'),
+    )
+
     def __repr__(self):
         return f'<DeviceFile {self.file_name}>'
 
@@ -104,6 +211,7 @@ class DeviceFile(db.Model):
             'visibility': self.visibility,
             'external_url': self.external_url,
             'file_size': self.file_size,
+            'sha256': self.sha256,
             'requires_password': self.requires_password,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
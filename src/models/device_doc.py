@@ -1,4 +1,9 @@
 from src.models.user import db
+from datetime import datetime
+from sqlalchemy import event
+
+# Separador de la clave compuesta (carácter de control que no aparece en los nombres)
+LOOKUP_KEY_SEPARATOR = '\x1f'
 
 class DeviceDoc(db.Model):
     __tablename__ = 'device_doc'
@@ -13,6 +18,43 @@ class DeviceDoc(db.Model):
     ganancia_antena_doc = db.Column(db.String(255))
     pire_dbm_doc = db.Column(db.String(255))
     pire_mw_doc = db.Column(db.String(255))
+    # Clave normalizada de (marca, nombre_catalogo, modelo_comercial, modelo_tecnico) con índice único
+    lookup_key = db.Column(db.String(1100), unique=True, index=True)
+    # Versión de la documentación (forma parte del ETag de las APIs públicas)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @staticmethod
+    def build_lookup_key(marca, nombre_catalogo, modelo_comercial, modelo_tecnico):
+        """Clave de búsqueda insensible a mayúsculas/minúsculas y espacios extremos"""
+        return LOOKUP_KEY_SEPARATOR.join(
+            (value or '').strip().lower()
+            for value in (marca, nombre_catalogo, modelo_comercial, modelo_tecnico)
+        )
+
+    # Campos del sub-objeto 'device_doc' de Device.to_dict()
+    SUMMARY_FIELDS = (
+        'tecnologia_modulacion_doc',
+        'frecuencias_doc',
+        'ganancia_antena_doc',
+        'pire_dbm_doc',
+        'pire_mw_doc'
+    )
+
+    @staticmethod
+    def to_summary(doc):
+        """Sub-objeto 'device_doc' que se incluye en Device.to_dict()"""
+        if doc:
+            return {name: getattr(doc, name) for name in DeviceDoc.SUMMARY_FIELDS}
+        return None
 
     def __repr__(self):
-        return f'<DeviceDoc {self.nombre_catalogo}>'
\ No newline at end of file
+        return f'<DeviceDoc {self.nombre_catalogo}>'
+
+
+@event.listens_for(DeviceDoc, 'before_insert')
+@event.listens_for(DeviceDoc, 'before_update')
+def refresh_lookup_key(mapper, connection, doc):
+    """La clave se recalcula en cada escritura: editar marca o modelos nunca la deja desactualizada"""
+    doc.lookup_key = DeviceDoc.build_lookup_key(
+        doc.marca, doc.nombre_catalogo, doc.modelo_comercial, doc.modelo_tecnico
+    )
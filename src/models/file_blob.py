@@ -0,0 +1,14 @@
+from src.models.user import db
+from datetime import datetime
+
+class FileBlob(db.Model):
+    """Contenido de un archivo en el almacén direccionado por SHA-256 (ver utils/blob_store.py)"""
+    __tablename__ = 'file_blob'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # DeviceFile que apuntan a este contenido
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<FileBlob {self.sha256[:12]} ({self.ref_count} refs)>'
@@ -0,0 +1,23 @@
+from src.models.user import db
+from datetime import datetime
+
+class QrRenderJob(db.Model):
+    """Trabajo de pre-render de un QR (cola en segundo plano, ver utils/qr_jobs.py)"""
+    __tablename__ = 'qr_render_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'device' o 'brand'
+    target = db.Column(db.String(100), nullable=False)  # id del dispositivo o nombre de la marca
+    payload = db.Column(db.String(500), nullable=False)  # URL que codifica el QR
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'running', 'done' o 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_qr_render_job_status_updated_at', 'status', 'updated_at'),
+    )
+
+    def __repr__(self):
+        return f'<QrRenderJob {self.kind} {self.target} ({self.status})>'
@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta
 from src.models.user import db
+from src.utils.token_cache import qr_token_cache
 import secrets
 
 class QrToken(db.Model):
@@ -14,6 +15,14 @@ class QrToken(db.Model):
 
     user = db.relationship('User', backref='qr_tokens')
 
+    __table_args__ = (
+        # Búsqueda del token vigente de una marca (y de todos sus tokens por el prefijo brand_name)
+        db.Index('ix_qr_token_brand_lookup', 'brand_name', 'token_type', 'used', 'expires_at'),
+    )
+
+    # Duración de los tokens de marca impresos en los QR (50 años)
+    BRAND_TOKEN_EXPIRES_HOURS = 438000
+
     def is_valid(self):
         """Verificar si el token es válido"""
         if self.used:
@@ -30,6 +39,7 @@ class QrToken(db.Model):
         """Marcar token como usado"""
         self.used = True
         db.session.commit()
+        qr_token_cache.invalidate_token(self.token)
 
     @classmethod
     def create_brand_token(cls, brand_name, expires_hours=24):
@@ -49,6 +59,32 @@ class QrToken(db.Model):
         
         return qr_token
 
+    @classmethod
+    def find_valid_brand_token(cls, brand_name):
+        """Token de marca vigente más reciente (no usado y sin expirar), o None"""
+        now = datetime.utcnow()
+        return cls.query.filter(
+            cls.brand_name == brand_name,
+            cls.token_type == 'brand',
+            cls.used == False,
+            db.or_(cls.expires_at.is_(None), cls.expires_at > now)
+        ).order_by(cls.expires_at.desc(), cls.id.desc()).first()
+
+    @classmethod
+    def get_or_create_brand_token(cls, brand_name, expires_hours=BRAND_TOKEN_EXPIRES_HOURS):
+        """Reutilizar el token vigente de la marca; solo se crea uno nuevo si no hay ninguno"""
+        return cls.find_valid_brand_token(brand_name) or cls.create_brand_token(brand_name, expires_hours=expires_hours)
+
+    @classmethod
+    def purge_invalid(cls, now=None):
+        """Eliminar los tokens usados o expirados. Devuelve cuántos se eliminaron"""
+        now = now or datetime.utcnow()
+        deleted = cls.query.filter(
+            db.or_(cls.used == True, cls.expires_at <= now)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
     @classmethod
     def create_user_token(cls, user_id, expires_minutes=5):
         """Crear un token para usuario específico"""
@@ -9,7 +9,7 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='auditor')  # 'admin', 'auditor' o 'public'
-    brand_name = db.Column(db.String(100), nullable=True)  # Marca asociada para usuarios 'public'
+    brand_name = db.Column(db.String(100), nullable=True, index=True)  # Marca asociada para usuarios 'public'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def set_password(self, password):
@@ -1,8 +1,8 @@
-from flask import Blueprint, request, send_from_directory, jsonify, abort
+from flask import Blueprint, request, jsonify, abort
 import os
 from src.models.device import DeviceFile
 from src.models.user import db
-from flask import current_app
+from src.utils.file_delivery import file_delivery
 
 password_protected_downloads_bp = Blueprint("password_protected_downloads", __name__)
 
@@ -38,38 +38,23 @@ def download_protected_file(file_id):
         if not file_path:
             abort(404, description="Ruta del archivo no disponible.")
         
-        # Normalizar las barras de la ruta
-        file_path = file_path.replace('\\', '/')
-        
-        # Construir la ruta completa al archivo
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        full_file_path = os.path.join(upload_folder, file_path)
-        full_file_path = os.path.normpath(full_file_path)
+        # Ruta completa al archivo (dentro de UPLOAD_FOLDER)
+        full_file_path = file_delivery.resolve(file_path)
+        etag = device_file.sha256
         
         # Verificar si el archivo existe
-        if not os.path.exists(full_file_path):
+        if not full_file_path:
             # Intentar rutas alternativas
-            filename_only = os.path.basename(file_path)
-            alt_path = os.path.join(upload_folder, filename_only)
-            alt_path = os.path.normpath(alt_path)
-            if os.path.exists(alt_path):
-                full_file_path = alt_path
-            else:
+            filename_only = os.path.basename(file_path.replace('\\', '/'))
+            full_file_path = file_delivery.resolve(filename_only)
+            etag = None
+            if not full_file_path:
                 abort(404, description="Archivo físico no encontrado.")
         
-        # Obtener el directorio y nombre del archivo
-        file_directory = os.path.dirname(full_file_path)
-        filename = os.path.basename(full_file_path)
-        
         # Usar el nombre original del archivo si está disponible
-        download_name = device_file.file_name if device_file.file_name else filename
+        download_name = device_file.file_name if device_file.file_name else os.path.basename(full_file_path)
         
-        return send_from_directory(
-            file_directory, 
-            filename, 
-            as_attachment=True,
-            download_name=download_name
-        )
+        return file_delivery.send(full_file_path, download_name=download_name, private=True, etag=etag)
         
     except Exception as e:
         if hasattr(e, 'code'):
@@ -87,23 +72,12 @@ def download_protected_file_by_path(filename):
         abort(401, description="Contraseña incorrecta o no proporcionada.")
 
     try:
-        filename = filename.replace('\\', '/')
-        safe_filename = filename.replace('..', '').replace('//', '/')
-        
-        upload_folder = current_app.config['UPLOAD_FOLDER']
-        full_file_path = os.path.join(upload_folder, safe_filename)
-        full_file_path = os.path.normpath(full_file_path)
-        
-        if not full_file_path.startswith(os.path.abspath(current_app.config['UPLOAD_FOLDER'])):
-            abort(403, description="Acceso denegado.")
-        
-        if not os.path.exists(full_file_path):
+        # Solo archivos (no carpetas) dentro de UPLOAD_FOLDER
+        full_file_path = file_delivery.resolve(filename)
+        if not full_file_path:
             abort(404, description="Archivo no encontrado.")
         
-        file_directory = os.path.dirname(full_file_path)
-        basename = os.path.basename(full_file_path)
-        
-        return send_from_directory(file_directory, basename, as_attachment=True)
+        return file_delivery.send(full_file_path, private=True)
         
     except Exception as e:
         if hasattr(e, 'code'):
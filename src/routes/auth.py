@@ -1,6 +1,8 @@
 from flask import Blueprint, jsonify, request, session
 from src.models.user import User, db
 from src.models.qr_token import QrToken
+from src.utils.signed_tokens import signed_qr_tokens, is_signed_token
+from src.utils.token_cache import qr_token_cache, TokenValidation
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -58,6 +60,22 @@ def profile():
     
     return jsonify(user.to_dict()), 200
 
+def lookup_qr_token(token, brand_name):
+    """Validar un token de marca contra la base de datos"""
+    qr_token = QrToken.query.filter_by(token=token, token_type='brand').first()
+    
+    if not qr_token:
+        return TokenValidation(None, None, None, 'Token inválido')
+    
+    if not qr_token.is_valid():
+        return TokenValidation(None, qr_token.brand_name, None, 'Token expirado o ya usado')
+    
+    # Verificar que el token corresponde a la marca solicitada
+    if qr_token.brand_name != brand_name:
+        return TokenValidation(None, qr_token.brand_name, None, 'Token no válido para esta marca')
+    
+    return TokenValidation(qr_token.id, qr_token.brand_name, qr_token.expires_at, None)
+
 @auth_bp.route('/auth/validate-qr-token', methods=['POST'])
 def validate_qr_token():
     """Validar token QR y establecer sesión temporal"""
@@ -68,23 +86,24 @@ def validate_qr_token():
     if not token:
         return jsonify({'error': 'Token requerido'}), 400
     
-    # Buscar el token en la base de datos
-    qr_token = QrToken.query.filter_by(token=token, token_type='brand').first()
-    
-    if not qr_token:
-        return jsonify({'error': 'Token inválido'}), 401
-    
-    if not qr_token.is_valid():
-        return jsonify({'error': 'Token expirado o ya usado'}), 401
-    
-    # Verificar que el token corresponde a la marca solicitada
-    if qr_token.brand_name != brand_name:
-        return jsonify({'error': 'Token no válido para esta marca'}), 401
+    if is_signed_token(token):
+        # Token firmado: se verifica la firma sin consultar la base de datos
+        qr_token_id = signed_qr_tokens.verify(token, brand_name)
+        if qr_token_id is None:
+            return jsonify({'error': 'Token inválido, expirado o revocado'}), 401
+    else:
+        # Los QR impresos se escanean con el mismo token una y otra vez: se cachea el resultado
+        validation = qr_token_cache.get(token, brand_name)
+        if validation is None:
+            validation = qr_token_cache.set(token, brand_name, lookup_qr_token(token, brand_name))
+        if validation.error:
+            return jsonify({'error': validation.error}), 401
+        qr_token_id = validation.token_id
     
     # Establecer sesión temporal para acceso a la marca
     session['qr_access'] = True
     session['qr_brand'] = brand_name
-    session['qr_token_id'] = qr_token.id
+    session['qr_token_id'] = qr_token_id
     session['user_role'] = 'qr_guest'  # Rol especial para acceso por QR
     
     # Opcional: marcar token como usado si se desea uso único
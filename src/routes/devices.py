@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, request, session, send_from_directory
+from flask import Blueprint, jsonify, request, session, send_from_directory, Response, stream_with_context
 from src.models.user import db, User # Importar User
 from src.models.device import Device, DeviceFile
 from src.models.device_doc import DeviceDoc
@@ -7,18 +7,37 @@ from src.models.qr_token import QrToken # Importar QrToken
 from datetime import datetime, date
 import os
 import shutil # Importar shutil para eliminar directorios no vacíos
+import csv
+import io
+import json
+from urllib.parse import quote
 from werkzeug.utils import secure_filename
+from sqlalchemy import select, func, case
+from sqlalchemy.orm import selectinload, load_only
+from src.utils.public_cache import public_device_cache
+from src.utils.signed_tokens import signed_qr_tokens
+from src.utils.token_cache import qr_token_cache
+from src.utils.qr_jobs import qr_render_queue
+from src.utils.search import search_terms, apply_search
+from src.utils.pagination import parse_limit, encode_cursor, decode_cursor, keyset_filter, InvalidCursor
 
 from flask import current_app # Añadir esta importación
 # UPLOAD_FOLDER se obtendrá de current_app.config['UPLOAD_FOLDER'] en las funciones.
 # La subcarpeta 'brands' se añadirá dentro de las funciones.
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
+EXPORT_BATCH_SIZE = 500  # Filas leídas por lote en la exportación del catálogo
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 devices_bp = Blueprint("devices", __name__)
 
+# Columnas por las que se puede paginar el listado de dispositivos (siempre desempatando por id)
+DEVICE_ORDER_COLUMNS = {
+    "marca": Device.marca,
+    "vigencia": Device.fecha_vigencia
+}
+
 def require_auth():
     """Middleware para verificar autenticación"""
     user_id = session.get("user_id")
@@ -39,10 +58,97 @@ def require_admin():
 
 @devices_bp.route("/devices", methods=["GET"])
 def get_devices():
-    """Obtener lista de dispositivos"""
+    """Obtener lista paginada de dispositivos (paginación por cursor)"""
+    order = request.args.get("order", "marca")
+    limit = parse_limit(request.args.get("limit"))
+    cursor = request.args.get("cursor")
+
+    if order not in DEVICE_ORDER_COLUMNS:
+        return jsonify({"error": f"Orden no soportado. Use: {', '.join(DEVICE_ORDER_COLUMNS)}"}), 400
+    order_column = DEVICE_ORDER_COLUMNS[order]
+
+    try:
+        fields = Device.parse_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = listed_devices_query()
+
+    # Continuar después de la última fila de la página anterior
+    if cursor:
+        try:
+            cursor_value, cursor_id = decode_cursor(cursor, order)
+            if order == "vigencia":
+                cursor_value = datetime.strptime(cursor_value, "%Y-%m-%d").date()
+        except (InvalidCursor, TypeError, ValueError):
+            return jsonify({"error": "Cursor inválido"}), 400
+        query = query.filter(keyset_filter(order_column, Device.id, cursor_value, cursor_id))
+
+    query = with_field_options(query, fields, required=[order_column.key])
+
+    # Se pide una fila extra para saber si existe una página siguiente
+    devices = query.order_by(order_column, Device.id).limit(limit + 1).all()
+    has_more = len(devices) > limit
+    devices = devices[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = devices[-1]
+        next_cursor = encode_cursor(order, getattr(last, order_column.key), last.id)
+
+    return jsonify({
+        "devices": Device.to_dict_batch(devices, fields=fields),
+        "next_cursor": next_cursor,
+        "limit": limit
+    })
+
+@devices_bp.route("/devices/search", methods=["GET"])
+def search_devices():
+    """Búsqueda de texto completo en el catálogo, ordenada por relevancia y paginada"""
+    terms = search_terms(request.args.get("q"))
+    limit = parse_limit(request.args.get("limit"))
+    cursor = request.args.get("cursor")
+
+    if not terms:
+        return jsonify({"error": "Parámetro requerido: q"}), 400
+
+    try:
+        fields = Device.parse_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # El orden por relevancia no admite keyset: el cursor guarda la posición dentro de esta búsqueda
+    normalized_query = " ".join(terms).lower()
+    offset = 0
+    if cursor:
+        try:
+            cursor_query, offset = decode_cursor(cursor, "search")
+        except InvalidCursor:
+            return jsonify({"error": "Cursor inválido"}), 400
+        if cursor_query != normalized_query or offset < 0:
+            return jsonify({"error": "Cursor inválido"}), 400
+
+    backend = current_app.config.get("SEARCH_BACKEND", "like")
+    query = apply_search(listed_devices_query(), Device, backend, terms)
+    query = with_field_options(query, fields)
+
+    # Se pide una fila extra para saber si existe una página siguiente
+    devices = query.offset(offset).limit(limit + 1).all()
+    has_more = len(devices) > limit
+    devices = devices[:limit]
+
+    return jsonify({
+        "devices": Device.to_dict_batch(devices, fields=fields),
+        "next_cursor": encode_cursor("search", normalized_query, offset + limit) if has_more else None,
+        "limit": limit
+    })
+
+def listed_devices_query():
+    """Dispositivos visibles en los listados para el usuario actual (filtros comunes)"""
     user_role = session.get("user_role")
     current_date = date.today()
     marca_filter = request.args.get("marca")
+    categoria_filter = request.args.get("categoria")
 
     query = Device.query
 
@@ -56,14 +162,87 @@ def get_devices():
     if marca_filter:
         query = query.filter(Device.marca == marca_filter)
 
-    devices = query.all()
-    
-    return jsonify([device.to_dict() for device in devices])
+    if categoria_filter:
+        query = query.filter(Device.categoria == categoria_filter)
+
+    return query
+
+def with_field_options(query, fields, required=()):
+    """Con ?fields= solo se leen las columnas pedidas y los archivos únicamente si se solicitan"""
+    if fields is not None:
+        query = query.options(load_only(*Device.load_only_columns(fields, required=required)))
+    if fields is None or "files" in fields:
+        query = query.options(selectinload(Device.files))
+    return query
+
+@devices_bp.route("/devices/export", methods=["GET"])
+def export_devices():
+    """Exportar el catálogo completo en streaming (NDJSON o CSV, solo admin)"""
+    admin_error = require_admin()
+    if admin_error:
+        return admin_error
+
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"error": "Formato no soportado. Use: ndjson, csv"}), 400
+
+    marca_filter = request.args.get("marca")
+    export_fields = set(Device.COLUMN_FIELDS) | {"device_doc"}
+
+    statement = select(Device).where(Device.nombre_catalogo != "Dispositivo Temporal")
+    if marca_filter:
+        statement = statement.where(Device.marca == marca_filter)
+    # yield_per lee las filas por lotes (cursor del servidor en PostgreSQL) en lugar de cargar todo el catálogo
+    statement = statement.order_by(Device.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    def generate():
+        if export_format == "csv":
+            header = list(Device.COLUMN_FIELDS) + list(DeviceDoc.SUMMARY_FIELDS)
+            yield csv_line(header)
+
+        for batch in db.session.execute(statement).scalars().partitions():
+            # Una consulta de DeviceDoc por lote; el mapa de identidad guarda referencias débiles,
+            # así que cada lote se libera al pasar al siguiente
+            rows = Device.to_dict_batch(batch, fields=export_fields)
+            if export_format == "csv":
+                chunk = "".join(
+                    csv_line(
+                        [row[name] for name in Device.COLUMN_FIELDS]
+                        + [(row["device_doc"] or {}).get(name) for name in DeviceDoc.SUMMARY_FIELDS]
+                    )
+                    for row in rows
+                )
+            else:
+                chunk = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+            yield chunk
+
+    filename = f"dispositivos_{date.today().strftime('%Y%m%d')}.{export_format}"
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+def csv_line(values):
+    """Serializar una fila CSV"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(["" if value is None else value for value in values])
+    return buffer.getvalue()
 
 @devices_bp.route("/devices/<int:device_id>", methods=["GET"])
 def get_device(device_id):
     """Obtener dispositivo específico"""
-    device = Device.query.get_or_404(device_id)
+    try:
+        fields = Device.parse_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = Device.query
+    if fields is not None:
+        query = query.options(load_only(*Device.load_only_columns(fields, required=["fecha_vigencia"])))
+
+    device = query.get_or_404(device_id)
     user_role = session.get("user_role")
     current_date = date.today()
     
@@ -71,7 +250,7 @@ def get_device(device_id):
     if user_role != "admin" and device.fecha_vigencia > current_date:
         return jsonify({"error": "Dispositivo no encontrado"}), 404
     
-    return jsonify(device.to_dict())
+    return jsonify(device.to_dict(fields=fields))
 
 @devices_bp.route("/devices", methods=["POST"])
 def create_device():
@@ -125,6 +304,8 @@ def create_device():
         device_folder = os.path.join(brand_folder, secure_filename(device.nombre_catalogo))
         os.makedirs(device_folder, exist_ok=True)
 
+        # El QR se renderiza en segundo plano; la primera petición ya lo encuentra en caché
+        qr_render_queue.enqueue_device(device)
         
         return jsonify(device.to_dict()), 201
         
@@ -181,6 +362,7 @@ def update_device(device_id):
         device.updated_at = datetime.utcnow()
         
         db.session.commit()
+        public_device_cache.invalidate(device.uuid)
         
         return jsonify(device.to_dict())
         
@@ -200,20 +382,17 @@ def delete_device(device_id):
     # Obtener la marca y el nombre del catálogo del dispositivo antes de eliminarlo
     device_marca = device.marca
     device_nombre_catalogo = device.nombre_catalogo
+    device_uuid = device.uuid
 
     # Buscar y eliminar el registro asociado en DeviceDoc
-    device_doc = DeviceDoc.query.filter_by(
-        marca=device.marca,
-        nombre_catalogo=device.nombre_catalogo,
-        modelo_comercial=device.modelo_comercial,
-        modelo_tecnico=device.modelo_tecnico
-    ).first()
+    device_doc = device.find_device_doc()
     
     if device_doc:
         db.session.delete(device_doc)
 
     db.session.delete(device)
     db.session.commit()
+    public_device_cache.invalidate(device_uuid)
 
     # Eliminar la carpeta del dispositivo si existe y está vacía
     base_upload_folder = current_app.config['UPLOAD_FOLDER']
@@ -273,7 +452,10 @@ def get_groups(category, subcategory):
 
 @devices_bp.route("/brands", methods=["GET"])
 def get_brands():
-    """Obtener lista de marcas únicas"""
+    """Obtener lista de marcas únicas (con ?full=1, los registros completos con sus contadores)"""
+    if request.args.get("full") in ("1", "true"):
+        return get_brands_full()
+
     try:
         # Obtener marcas únicas de la base de datos
         brands = db.session.query(Device.marca).distinct().all()
@@ -284,6 +466,40 @@ def get_brands():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def get_brands_full():
+    """
+    Todas las marcas con url, imagen y número de dispositivos (total y vigentes)
+    en una sola consulta, para no pedir /brands/<marca>/info por cada una.
+    """
+    try:
+        real_device = Device.nombre_catalogo != "Dispositivo Temporal"
+        # Agrupar por Device.marca conserva las marcas antiguas que no tienen fila en Brand
+        counts = select(
+            Device.marca.label("marca"),
+            func.count(case((real_device, Device.id))).label("device_count"),
+            func.count(case((real_device & (Device.fecha_vigencia <= date.today()), Device.id))).label("vigente_count")
+        ).where(Device.marca.isnot(None)).group_by(Device.marca).subquery()
+
+        rows = db.session.execute(
+            select(counts, Brand.url, Brand.image_path, Brand.updated_at)
+            .outerjoin(Brand, Brand.name == counts.c.marca)
+            .order_by(counts.c.marca)
+        ).all()
+
+        return jsonify([
+            {
+                "name": row.marca,
+                "url": row.url,
+                "image_url": f"/api/brands/{quote(row.marca, safe='')}/image" if row.image_path else None,
+                "device_count": row.device_count,
+                "vigente_count": row.vigente_count,
+                "updated_at": row.updated_at.isoformat() if row.updated_at else None
+            }
+            for row in rows
+        ])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @devices_bp.route("/brands", methods=["POST"])
 def create_brand():
     """Crear nueva marca (solo admin)"""
@@ -388,6 +604,8 @@ def create_brand():
         
         db.session.commit()
         
+        qr_render_queue.enqueue_brand(marca)
+        
         return jsonify({"message": "Marca y usuario creados exitosamente", "marca": marca, "usuario": user}), 201
         
     except Exception as e:
@@ -459,6 +677,7 @@ def update_brand(brand_name):
         
         # Actualizar la marca en la tabla Device (para todos los dispositivos, incluyendo el temporal)
         devices_to_update = Device.query.filter(Device.marca == brand_name).all()
+        renamed_uuids = [device.uuid for device in devices_to_update]
         for device in devices_to_update:
             device.marca = new_marca
             device.updated_at = datetime.utcnow()
@@ -508,6 +727,10 @@ def update_brand(brand_name):
                     db.session.add(new_device_file)
 
         db.session.commit()
+        public_device_cache.invalidate(*renamed_uuids)
+        if new_marca != brand_name:
+            # La URL del QR de la marca incluye su nombre
+            qr_render_queue.enqueue_brand(new_marca)
         
         return jsonify({"message": "Marca actualizada exitosamente", "marca": new_marca}), 200
         
@@ -525,6 +748,7 @@ def delete_brand(brand_name):
     try:
         # 1. Buscar todos los dispositivos de la marca (incluyendo el temporal)
         devices_to_delete = Device.query.filter(Device.marca == brand_name).all()
+        deleted_uuids = [device.uuid for device in devices_to_delete]
         
         if not devices_to_delete:
             # Si no hay dispositivos, verificar si existe en la tabla Brand
@@ -564,6 +788,10 @@ def delete_brand(brand_name):
             db.session.delete(brand_to_delete)
         
         db.session.commit()
+        public_device_cache.invalidate(*deleted_uuids)
+        # Los tokens firmados de la marca dejan de aceptarse en este worker de inmediato
+        signed_qr_tokens.invalidate()
+        qr_token_cache.invalidate_brand(brand_name)
 
         # 5. Eliminar la carpeta de la marca (incluyendo su contenido)
         base_upload_folder = current_app.config['UPLOAD_FOLDER']
@@ -628,12 +856,7 @@ def update_device_doc(device_id):
     
     # 2. Buscar si ya existe una entrada en DeviceDoc para este dispositivo
     # Asumimos que la combinación de los campos de identificación es única para el dispositivo
-    device_doc = DeviceDoc.query.filter_by(
-        marca=device.marca,
-        nombre_catalogo=device.nombre_catalogo,
-        modelo_comercial=device.modelo_comercial,
-        modelo_tecnico=device.modelo_tecnico
-    ).first()
+    device_doc = device.find_device_doc()
     
     try:
         if device_doc:
@@ -659,6 +882,8 @@ def update_device_doc(device_id):
             db.session.add(device_doc)
             
         db.session.commit()
+        # El DeviceDoc se comparte entre todos los dispositivos con la misma clave normalizada
+        public_device_cache.clear()
         
         return jsonify({"message": "Información de documentación actualizada exitosamente"}), 200
         
@@ -1,9 +1,16 @@
 
 import os
-from flask import Blueprint, jsonify, request, session, send_file
+from datetime import datetime
+from flask import Blueprint, jsonify, request, session
 from werkzeug.utils import secure_filename
 from src.models.user import db
 from src.models.device import Device, DeviceFile
+from src.utils.public_cache import public_device_cache
+from src.utils.uploads import receive_multipart_upload, UploadError
+from src.utils.chunked_uploads import chunked_uploads, MAX_CHUNK_SIZE, SUGGESTED_CHUNK_SIZE
+from src.utils.blob_store import blob_store
+from src.utils.file_delivery import file_delivery
+from src.utils.storage_usage import brand_usage, device_usage, total_usage
 
 files_bp = Blueprint('files', __name__)
 
@@ -24,10 +31,6 @@ MAX_TOTAL_SIZE = 150 * 1024 * 1024  # 150MB
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_device_upload_folder_relative(brand_name, device_name):
-    """Obtener la ruta de subida relativa para archivos de un dispositivo específico"""
-    return os.path.join(UPLOAD_FOLDER_DEVICES, secure_filename(brand_name), secure_filename(device_name))
-
 def require_admin():
     """Middleware para verificar rol de administrador"""
     user_id = session.get('user_id')
@@ -93,100 +96,131 @@ def upload_brand_logo():
         traceback.print_exc()
         return jsonify({"error": f"Error interno del servidor al guardar archivo: {str(e)}"}), 500
 
-@files_bp.route('/files/upload-device-files', methods=['POST'])
-def upload_device_files():
-    """Subir archivos para un dispositivo específico"""
-    admin_error = require_admin()
-    if admin_error:
-        return admin_error
-    
-    device_id = request.form.get('device_id')
-    file_type = request.form.get('file_type')
-    visibility = request.form.get('visibility', 'public')
-    requires_password = request.form.get('requires_password') == 'true'
-    external_url = request.form.get('external_url')
-    
-    if not device_id or not file_type:
-        return jsonify({'error': 'device_id y file_type son requeridos'}), 400
-    
-    # Verificar que el dispositivo existe
-    device = Device.query.get(device_id)
-    if not device:
-        return jsonify({'error': 'Dispositivo no encontrado'}), 404
-    
-    # Si se proporciona URL externa, no necesitamos archivo
-    if external_url:
-        device_file = DeviceFile(
-            device_id=device_id,
-            file_name=request.form.get('file_name', 'Documento externo'),
-            file_type=file_type,
-            visibility=visibility,
-            requires_password=requires_password,
-            external_url=external_url
-        )
-        
-        db.session.add(device_file)
-        db.session.commit()
-        
-        return jsonify(device_file.to_dict()), 201
+def upload_limit(device):
+    """(límite en bytes, mensaje) del próximo archivo del dispositivo: el menor entre MAX_FILE_SIZE y la cuota restante"""
+    remaining = MAX_TOTAL_SIZE - device.storage_bytes
+    if remaining < MAX_FILE_SIZE:
+        return max(remaining, 0), f'Tamaño total de archivos excede el límite de {MAX_TOTAL_SIZE // (1024*1024)}MB'
+    return MAX_FILE_SIZE, f'Archivo muy grande. Máximo {MAX_FILE_SIZE // (1024*1024)}MB'
+
+def save_device_file(device, incoming, file_type, visibility, requires_password):
+    """Guardar un archivo ya recibido en el almacén por contenido y registrarlo como DeviceFile"""
+    device_file = DeviceFile(
+        device_id=device.id,
+        file_name=secure_filename(incoming.filename),
+        file_path=blob_store.store(incoming), # Ruta relativa del contenido (compartido entre dispositivos)
+        file_type=file_type,
+        visibility=visibility,
+        requires_password=requires_password,
+        file_size=incoming.size,
+        sha256=incoming.sha256
+    )
+    
+    db.session.add(device_file)
+    device.updated_at = datetime.utcnow()  # Cambia el ETag de las APIs públicas
+    db.session.commit()
+    public_device_cache.invalidate(device.uuid)
+    return device_file
+
+def receive_device_upload():
+    """
+    Subir un archivo (o registrar una URL externa) para un dispositivo.
+
+    El formulario se lee en streaming: el archivo se escribe en un temporal junto
+    al almacén por contenido calculando tamaño y SHA-256, la subida se corta en
+    cuanto supera MAX_FILE_SIZE o la cuota del dispositivo y termina con un rename
+    atómico (o sin escribir nada si el contenido ya estaba guardado). Si el archivo
+    llega antes que device_id, los límites se comprueban al final.
+    """
+    devices_by_id = {}
+
+    def load_device(device_id):
+        if device_id not in devices_by_id:
+            devices_by_id[device_id] = db.session.get(Device, int(device_id)) if device_id.isdigit() else None
+        return devices_by_id[device_id]
+
+    def prepare_file(fields, filename):
+        if fields.get('external_url'):
+            # Con URL externa el archivo se ignora: se descarta sin escribirlo
+            return None
+        if not allowed_file(filename):
+            raise UploadError(f"Tipo de archivo no permitido. Extensiones permitidas: {', '.join(ALLOWED_EXTENSIONS)}")
+        device_id = fields.get('device_id')
+        if not device_id:
+            return blob_store.staging_folder, MAX_FILE_SIZE, f'Archivo muy grande. Máximo {MAX_FILE_SIZE // (1024*1024)}MB'
+        device = load_device(device_id)
+        if not device:
+            raise UploadError('Dispositivo no encontrado', 404)
+        limit, message = upload_limit(device)
+        return blob_store.staging_folder, limit, message
 
-    # Si no hay URL externa, se requiere un archivo
-    if 'file' not in request.files:
-        return jsonify({'error': 'No se encontró archivo ni URL externa'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No se seleccionó archivo'}), 400
-    
-    if not allowed_file(file.filename):
-        return jsonify({"error": f"Tipo de archivo no permitido. Extensiones permitidas: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
-    
-    # Verificar tamaño del archivo
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'error': f'Archivo muy grande. Máximo {MAX_FILE_SIZE // (1024*1024)}MB'}), 400
-    
-    # Verificar tamaño total de archivos del dispositivo
-    total_size = sum([f.file_size or 0 for f in device.files if f.file_size])
-    if total_size + file_size > MAX_TOTAL_SIZE:
-        return jsonify({'error': f'Tamaño total de archivos excede el límite de {MAX_TOTAL_SIZE // (1024*1024)}MB'}), 400
-    
-    # Crear directorio de marca y dispositivo si no existen usando la nueva función
-    device_folder_relative = get_device_upload_folder_relative(device.marca, device.nombre_catalogo)
-    base_upload_folder = current_app.config['UPLOAD_FOLDER']
-    device_folder_absolute = os.path.join(base_upload_folder, device_folder_relative)
-    os.makedirs(device_folder_absolute, exist_ok=True)
-    
-    # Generar nombre único para el archivo
-    filename = secure_filename(file.filename)
-    file_path_absolute = os.path.join(device_folder_absolute, filename)
-    file_path_relative = os.path.join(device_folder_relative, filename)
-    
     try:
-        file.save(file_path_absolute)
+        fields, incoming = receive_multipart_upload(prepare_file)
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status_code
+
+    try:
+        device_id = fields.get('device_id')
+        file_type = fields.get('file_type')
+        visibility = fields.get('visibility', 'public')
+        requires_password = fields.get('requires_password') == 'true'
+        external_url = fields.get('external_url')
         
-        device_file = DeviceFile(
-            device_id=device_id,
-            file_name=filename,
-            file_path=file_path_relative, # Almacenar ruta relativa
-            file_type=file_type,
-            visibility=visibility,
-            requires_password=requires_password,
-            file_size=file_size
-        )
+        if not device_id or not file_type:
+            return jsonify({'error': 'device_id y file_type son requeridos'}), 400
         
-        db.session.add(device_file)
-        db.session.commit()
+        # Verificar que el dispositivo existe
+        device = load_device(device_id)
+        if not device:
+            return jsonify({'error': 'Dispositivo no encontrado'}), 404
+        
+        # Si se proporciona URL externa, no necesitamos archivo
+        if external_url:
+            device_file = DeviceFile(
+                device_id=device.id,
+                file_name=fields.get('file_name', 'Documento externo'),
+                file_type=file_type,
+                visibility=visibility,
+                requires_password=requires_password,
+                external_url=external_url
+            )
+            
+            db.session.add(device_file)
+            device.updated_at = datetime.utcnow()  # Cambia el ETag de las APIs públicas
+            db.session.commit()
+            public_device_cache.invalidate(device.uuid)
+            
+            return jsonify(device_file.to_dict()), 201
+
+        # Si no hay URL externa, se requiere un archivo
+        if incoming is None:
+            return jsonify({'error': 'No se encontró archivo ni URL externa'}), 400
+        
+        # Límites de un archivo recibido antes que device_id (en el caso normal ya se aplicaron al leerlo)
+        limit, message = upload_limit(device)
+        if incoming.size > limit:
+            return jsonify({'error': message}), 400
         
+        device_file = save_device_file(device, incoming, file_type, visibility, requires_password)
         return jsonify(device_file.to_dict()), 201
         
     except Exception as e:
+        db.session.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Error interno del servidor al guardar archivo: {str(e)}"}), 500
+    finally:
+        if incoming is not None:
+            incoming.discard()
+
+@files_bp.route('/files/upload-device-files', methods=['POST'])
+def upload_device_files():
+    """Subir archivos para un dispositivo específico"""
+    admin_error = require_admin()
+    if admin_error:
+        return admin_error
+    
+    return receive_device_upload()
 
 @files_bp.route('/files/upload', methods=['POST'])
 def upload_file():
@@ -195,92 +229,176 @@ def upload_file():
     if admin_error:
         return admin_error
     
-    device_id = request.form.get('device_id')
-    file_type = request.form.get('file_type')
-    visibility = request.form.get('visibility', 'public')
-    requires_password = request.form.get('requires_password') == 'true'
-    external_url = request.form.get('external_url')
+    return receive_device_upload()
+
+@files_bp.route('/files/uploads', methods=['POST'])
+def start_chunked_upload():
+    """
+    Iniciar una subida reanudable por partes (archivos grandes o conexiones inestables).
+    Body JSON: device_id, file_type, file_name, size y opcionalmente visibility,
+    requires_password y sha256 (si el contenido ya está guardado, la subida termina aquí).
+    """
+    admin_error = require_admin()
+    if admin_error:
+        return admin_error
     
-    if not device_id or not file_type:
-        return jsonify({'error': 'device_id y file_type son requeridos'}), 400
+    data = request.get_json(silent=True) or {}
+    device_id = data.get('device_id')
+    file_type = data.get('file_type')
+    file_name = data.get('file_name')
+    size = data.get('size')
+    
+    if not device_id or not file_type or not file_name or size is None:
+        return jsonify({'error': 'device_id, file_type, file_name y size son requeridos'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'size debe ser un entero positivo'}), 400
+    if not allowed_file(file_name):
+        return jsonify({"error": f"Tipo de archivo no permitido. Extensiones permitidas: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
     
-    # Verificar que el dispositivo existe
-    device = Device.query.get(device_id)
+    device = db.session.get(Device, int(device_id)) if str(device_id).isdigit() else None
     if not device:
         return jsonify({'error': 'Dispositivo no encontrado'}), 404
     
-    # Si se proporciona URL externa, no necesitamos archivo
-    if external_url:
+    # Por partes no se aplica MAX_FILE_SIZE: el límite es la cuota del dispositivo
+    if device.storage_bytes + size > MAX_TOTAL_SIZE:
+        return jsonify({'error': f'Tamaño total de archivos excede el límite de {MAX_TOTAL_SIZE // (1024*1024)}MB'}), 400
+    
+    # Contenido ya guardado (el cliente envía su sha256): se registra sin transferir ningún byte
+    sha256 = (data.get('sha256') or '').lower()
+    if sha256 and blob_store.reference_existing(sha256, size):
         device_file = DeviceFile(
-            device_id=device_id,
-            file_name=request.form.get('file_name', 'Documento externo'),
+            device_id=device.id,
+            file_name=secure_filename(file_name),
+            file_path=blob_store.relative_path(sha256),
             file_type=file_type,
-            visibility=visibility,
-            requires_password=requires_password,
-            external_url=external_url
+            visibility=data.get('visibility', 'public'),
+            requires_password=bool(data.get('requires_password')),
+            file_size=size,
+            sha256=sha256
         )
-        
         db.session.add(device_file)
+        device.updated_at = datetime.utcnow()  # Cambia el ETag de las APIs públicas
         db.session.commit()
-        
-        return jsonify(device_file.to_dict()), 201
+        public_device_cache.invalidate(device.uuid)
+        return jsonify({'complete': True, 'file': device_file.to_dict()}), 201
+    
+    upload = chunked_uploads.create(
+        device_id=device.id,
+        file_type=file_type,
+        file_name=file_name,
+        size=size,
+        visibility=data.get('visibility', 'public'),
+        requires_password=bool(data.get('requires_password'))
+    )
+    return jsonify({
+        'complete': False,
+        'upload_id': upload['upload_id'],
+        'offset': 0,
+        'size': size,
+        'chunk_size': SUGGESTED_CHUNK_SIZE,
+        'max_chunk_size': MAX_CHUNK_SIZE
+    }), 201
 
-    # Si no hay URL externa, se requiere un archivo
-    if 'file' not in request.files:
-        return jsonify({'error': 'No se encontró archivo ni URL externa'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No se seleccionó archivo'}), 400
+@files_bp.route('/files/uploads/<upload_id>', methods=['GET'])
+def get_chunked_upload(upload_id):
+    """Estado de una subida por partes: offset desde el que continuar"""
+    admin_error = require_admin()
+    if admin_error:
+        return admin_error
     
-    if not allowed_file(file.filename):
-        return jsonify({"error": f"Tipo de archivo no permitido. Extensiones permitidas: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
+    try:
+        upload = chunked_uploads.load(upload_id)
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status_code
+    return jsonify({'upload_id': upload_id, 'offset': upload['offset'], 'size': upload['size']})
+
+@files_bp.route('/files/uploads/<upload_id>', methods=['PUT'])
+def put_upload_chunk(upload_id):
+    """
+    Enviar una parte (cuerpo binario) que empieza en ?offset=. Repetir una parte
+    ya recibida no tiene efecto, así que tras un corte basta con reenviarla.
+    """
+    admin_error = require_admin()
+    if admin_error:
+        return admin_error
     
-    # Verificar tamaño del archivo
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
+    offset = request.args.get('offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({'error': 'offset es requerido'}), 400
     
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'error': f'Archivo muy grande. Máximo {MAX_FILE_SIZE // (1024*1024)}MB'}), 400
+    try:
+        new_offset = chunked_uploads.write_chunk(upload_id, offset, request.stream)
+        upload = chunked_uploads.load(upload_id)
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status_code
+    return jsonify({'upload_id': upload_id, 'offset': new_offset, 'size': upload['size']})
+
+@files_bp.route('/files/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    """
+    Terminar la subida: crear el DeviceFile. Acepta opcionalmente el sha256 esperado.
+    Repetirlo (reintento tras un timeout) devuelve el mismo archivo con 200.
+    """
+    admin_error = require_admin()
+    if admin_error:
+        return admin_error
     
-    # Verificar tamaño total de archivos del dispositivo
-    total_size = sum([f.file_size or 0 for f in device.files if f.file_size])
-    if total_size + file_size > MAX_TOTAL_SIZE:
+    try:
+        # Un complete a la vez por subida: un reintento espera y encuentra el archivo ya creado
+        with chunked_uploads.finishing(upload_id):
+            return finish_chunked_upload(upload_id)
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status_code
+
+def finish_chunked_upload(upload_id):
+    """Crear el DeviceFile de una subida por partes (con el lock de finishing() tomado)"""
+    upload, incoming = chunked_uploads.complete(upload_id)
+    if incoming is None:
+        device_file = db.session.get(DeviceFile, upload['file_id'])
+        if not device_file:
+            return jsonify({'error': 'Archivo no encontrado'}), 404
+        return jsonify(device_file.to_dict()), 200
+    
+    expected_sha256 = (request.get_json(silent=True) or {}).get('sha256')
+    if expected_sha256 and expected_sha256.lower() != incoming.sha256:
+        chunked_uploads.discard(upload_id)
+        return jsonify({'error': 'El contenido recibido no coincide con el sha256 indicado'}), 400
+    
+    device = db.session.get(Device, upload['device_id'])
+    if not device:
+        chunked_uploads.discard(upload_id)
+        return jsonify({'error': 'Dispositivo no encontrado'}), 404
+    if device.storage_bytes + incoming.size > MAX_TOTAL_SIZE:
+        chunked_uploads.discard(upload_id)
         return jsonify({'error': f'Tamaño total de archivos excede el límite de {MAX_TOTAL_SIZE // (1024*1024)}MB'}), 400
     
-    # Crear directorio de marca y dispositivo si no existen
-    device_folder_relative = get_device_upload_folder_relative(device.marca, device.nombre_catalogo)
-    base_upload_folder = current_app.config['UPLOAD_FOLDER']
-    device_folder_absolute = os.path.join(base_upload_folder, device_folder_relative)
-    os.makedirs(device_folder_absolute, exist_ok=True)
-    
-    # Generar nombre único para el archivo
-    filename = secure_filename(file.filename)
-    file_path_absolute = os.path.join(device_folder_absolute, filename)
-    file_path_relative = os.path.join(device_folder_relative, filename)
     try:
-        file.save(file_path_absolute)
-        
-        device_file = DeviceFile(
-            device_id=device_id,
-            file_name=filename,
-            file_path=file_path_relative, # Almacenar ruta relativa
-            file_type=file_type,
-            visibility=visibility,
-            requires_password=requires_password,
-            file_size=file_size
+        device_file = save_device_file(
+            device, incoming, upload['file_type'], upload['visibility'], upload['requires_password']
         )
-        
-        db.session.add(device_file)
-        db.session.commit()
-        
-        return jsonify(device_file.to_dict()), 201
-        
     except Exception as e:
+        db.session.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Error interno del servidor al guardar archivo: {str(e)}"}), 500
+    
+    # La carpeta se conserva (solo meta.json) para responder a los reintentos; purge_stale la elimina
+    chunked_uploads.finish(upload_id, device_file.id)
+    return jsonify(device_file.to_dict()), 201
+
+@files_bp.route('/files/uploads/<upload_id>', methods=['DELETE'])
+def cancel_chunked_upload(upload_id):
+    """Cancelar una subida por partes y liberar su espacio"""
+    admin_error = require_admin()
+    if admin_error:
+        return admin_error
+    
+    try:
+        chunked_uploads.load(upload_id)
+    except UploadError as e:
+        return jsonify({'error': e.message}), e.status_code
+    chunked_uploads.discard(upload_id)
+    return '', 204
 
 @files_bp.route('/files/<int:file_id>', methods=['GET'])
 def download_file(file_id):
@@ -296,14 +414,16 @@ def download_file(file_id):
     if device_file.external_url:
         return jsonify({'external_url': device_file.external_url})
     
-    # Construir la ruta absoluta para servir el archivo
-    base_upload_folder = current_app.config['UPLOAD_FOLDER']
-    file_path_absolute = os.path.join(base_upload_folder, device_file.file_path)
-
-    if not device_file.file_path or not os.path.exists(file_path_absolute):
+    file_path_absolute = file_delivery.resolve(device_file.file_path)
+    if not file_path_absolute:
         return jsonify({'error': 'Archivo no encontrado'}), 404
     
-    return send_file(file_path_absolute, as_attachment=True, download_name=device_file.file_name)
+    return file_delivery.send(
+        file_path_absolute,
+        download_name=device_file.file_name,
+        private=device_file.visibility == 'private' or device_file.requires_password,
+        etag=device_file.sha256
+    )
 
 @files_bp.route('/files/<int:file_id>', methods=['DELETE'])
 def delete_file(file_id):
@@ -313,9 +433,11 @@ def delete_file(file_id):
         return admin_error
     
     device_file = DeviceFile.query.get_or_404(file_id)
+    device = device_file.device
+    device_uuid = device.uuid
     
-    # Eliminar archivo físico si existe
-    if device_file.file_path:
+    # Eliminar archivo físico si existe (el contenido del almacén se elimina al quedar sin referencias)
+    if device_file.file_path and not blob_store.is_blob_path(device_file.file_path):
         base_upload_folder = current_app.config['UPLOAD_FOLDER']
         file_path_absolute = os.path.join(base_upload_folder, device_file.file_path)
         if os.path.exists(file_path_absolute):
@@ -325,7 +447,9 @@ def delete_file(file_id):
                 print(f"Error al eliminar archivo físico: {e}")
     
     db.session.delete(device_file)
+    device.updated_at = datetime.utcnow()  # Cambia el ETag de las APIs públicas
     db.session.commit()
+    public_device_cache.invalidate(device_uuid)
     
     return '', 204
 
@@ -343,11 +467,28 @@ def update_file(file_id):
     device_file.visibility = data.get('visibility', device_file.visibility)
     device_file.requires_password = data.get('requires_password', device_file.requires_password)
     device_file.external_url = data.get('external_url', device_file.external_url)
+    device_file.device.updated_at = datetime.utcnow()  # Cambia el ETag de las APIs públicas
     
     db.session.commit()
+    public_device_cache.invalidate(device_file.device.uuid)
     
     return jsonify(device_file.to_dict())
 
+@files_bp.route('/files/storage-usage', methods=['GET'])
+def get_storage_usage():
+    """Uso de almacenamiento por marca (solo admin); con ?brand= también por dispositivo"""
+    admin_error = require_admin()
+    if admin_error:
+        return admin_error
+    
+    usage = total_usage()
+    usage['device_quota_bytes'] = MAX_TOTAL_SIZE
+    usage['brands'] = brand_usage()
+    brand_name = request.args.get('brand')
+    if brand_name:
+        usage['devices'] = device_usage(brand_name)
+    return jsonify(usage)
+
 @files_bp.route('/file-types', methods=['GET'])
 def get_file_types():
     """Obtener tipos de archivo disponibles"""
@@ -1,6 +1,12 @@
-from flask import Blueprint, render_template_string, jsonify, request, send_from_directory
-from src.models.device import Device
+from flask import Blueprint, render_template_string, jsonify, request, send_from_directory, current_app
+from src.models.user import db
+from src.models.device import Device, DeviceFile
 from src.models.device_doc import DeviceDoc
+from src.utils.public_cache import public_device_cache, CachedResponse
+from sqlalchemy import func
+from sqlalchemy.orm import load_only
+from datetime import timezone
+import hashlib
 import os
 
 public_bp = Blueprint('public', __name__)
@@ -299,10 +305,115 @@ def view_device(device_id):
     
     return render_template_string(DEVICE_PUBLIC_TEMPLATE, device=device)
 
+# Campos de documentación que las APIs públicas exponen al nivel superior del JSON
+PUBLIC_DOC_FIELDS = DeviceDoc.SUMMARY_FIELDS
+
+def parse_public_fields():
+    """Leer ?fields= de la petición (None = todos los campos)"""
+    return Device.parse_fields(request.args.get('fields'), extra_fields=PUBLIC_DOC_FIELDS)
+
+def public_fields_need_doc(fields):
+    """Indica si los campos pedidos requieren buscar el DeviceDoc"""
+    return fields is None or 'device_doc' in fields or any(name in fields for name in PUBLIC_DOC_FIELDS)
+
+def public_device_query(fields):
+    """Consulta de dispositivos que solo lee las columnas necesarias para `fields`"""
+    query = Device.query
+    if fields is not None:
+        required = ['fecha_vigencia', 'updated_at']  # Vigencia y validadores ETag/Last-Modified
+        if public_fields_need_doc(fields):
+            required += Device.DOC_KEY_FIELDS
+        query = query.options(load_only(*Device.load_only_columns(fields, required=required)))
+    return query
+
+def build_public_device_data(device, fields=None):
+    """Datos públicos del dispositivo: campos del modelo, documentación aplanada y solo archivos públicos"""
+    # Buscar la información de documentación por su clave normalizada
+    # (insensible a mayúsculas/minúsculas y espacios, resuelta con el índice único)
+    device_doc = device.find_device_doc() if public_fields_need_doc(fields) else None
+    
+    # Usar el método to_dict() del modelo con los campos solicitados
+    device_data = device.to_dict(docs_by_key={device.doc_key(): device_doc} if device_doc else {}, fields=fields)
+    
+    # Agregar los campos de device_doc a device_data (vacíos si no existe)
+    for name in PUBLIC_DOC_FIELDS:
+        if fields is None or name in fields:
+            device_data[name] = getattr(device_doc, name) if device_doc else None
+    
+    # Filtrar solo archivos públicos
+    if 'files' in device_data:
+        device_data['files'] = [file.to_dict() for file in device.files if file.visibility == 'public']
+    
+    return device_data
+
+def public_device_validators(device, fields=None):
+    """
+    ETag fuerte y Last-Modified del JSON público, calculados sin serializarlo.
+    Combinan device.updated_at, el último DeviceFile.created_at (y el número de
+    archivos) y la versión del DeviceDoc, según los campos solicitados.
+    """
+    parts = [str(device.id), device.updated_at.isoformat() if device.updated_at else '']
+    timestamps = [device.updated_at]
+    
+    if fields is None or 'files' in fields:
+        file_count, latest_file = db.session.query(
+            func.count(DeviceFile.id), func.max(DeviceFile.created_at)
+        ).filter(DeviceFile.device_id == device.id).one()
+        parts += [str(file_count), latest_file.isoformat() if latest_file else '']
+        timestamps.append(latest_file)
+    
+    if public_fields_need_doc(fields):
+        doc_version = db.session.query(DeviceDoc.id, DeviceDoc.updated_at).filter_by(
+            lookup_key=device.doc_key()
+        ).first()
+        if doc_version:
+            parts += [str(doc_version.id), doc_version.updated_at.isoformat() if doc_version.updated_at else '']
+            timestamps.append(doc_version.updated_at)
+    
+    if fields is not None:
+        parts.append(','.join(sorted(fields)))
+    
+    etag = hashlib.sha256('|'.join(parts).encode()).hexdigest()[:32]
+    timestamps = [timestamp for timestamp in timestamps if timestamp]
+    return etag, max(timestamps) if timestamps else None
+
+def request_not_modified(etag, last_modified):
+    """Evaluar If-None-Match (prioritario) o If-Modified-Since contra los validadores"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    return False
+
+def public_device_response(payload, etag, last_modified):
+    """Respuesta JSON (o 304) con los validadores para que el navegador revalide"""
+    if request_not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(payload, mimetype='application/json')
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # El navegador puede guardar la respuesta, pero debe revalidarla en cada escaneo
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response
+
 @public_bp.route('/api/device/by-uuid/<string:device_uuid>')
 def get_device_by_uuid_api(device_uuid):
     """API pública para obtener información del dispositivo por UUID"""
-    device = Device.query.filter_by(uuid=device_uuid).first_or_404()
+    try:
+        fields = parse_public_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Sin ?fields= se sirve el JSON ya renderizado desde la caché, sin tocar el ORM
+    cache_generation = None
+    if fields is None:
+        entry, cache_generation = public_device_cache.get(device_uuid)
+        if entry is not None:
+            return public_device_response(entry.payload, entry.etag, entry.last_modified)
+    
+    device = public_device_query(fields).filter_by(uuid=device_uuid).first_or_404()
     
     # Verificar si el dispositivo está vigente
     from datetime import datetime
@@ -311,48 +422,27 @@ def get_device_by_uuid_api(device_uuid):
             'error': 'Dispositivo no disponible',
             'message': 'Este dispositivo aún no está vigente para consulta pública.'
         }), 404
-        
-    # Usar el método to_dict() del modelo que incluye todos los campos
-    device_data = device.to_dict()
     
-    # Importar DeviceDoc para buscar la información de documentación
-    from src.models.device_doc import DeviceDoc
+    # Si el cliente ya tiene la versión actual, responder 304 sin serializar
+    etag, last_modified = public_device_validators(device, fields)
+    if request_not_modified(etag, last_modified):
+        return public_device_response(None, etag, last_modified)
     
-    # Buscar la información de documentación (insensible a mayúsculas/minúsculas y espacios)
-    from sqlalchemy import func
-    device_doc = DeviceDoc.query.filter(
-        func.lower(func.trim(DeviceDoc.marca)) == func.lower(func.trim(device.marca)),
-        func.lower(func.trim(DeviceDoc.nombre_catalogo)) == func.lower(func.trim(device.nombre_catalogo)),
-        func.lower(func.trim(DeviceDoc.modelo_comercial)) == func.lower(func.trim(device.modelo_comercial)),
-        func.lower(func.trim(DeviceDoc.modelo_tecnico)) == func.lower(func.trim(device.modelo_tecnico))
-    ).first()
-    
-    # Agregar los campos de device_doc a device_data si existen
-    if device_doc:
-        device_data['tecnologia_modulacion_doc'] = device_doc.tecnologia_modulacion_doc
-        device_data['frecuencias_doc'] = device_doc.frecuencias_doc
-        device_data['ganancia_antena_doc'] = device_doc.ganancia_antena_doc
-        device_data['pire_dbm_doc'] = device_doc.pire_dbm_doc
-        device_data['pire_mw_doc'] = device_doc.pire_mw_doc
-    else:
-        # Asegurar que los campos existen aunque estén vacíos
-        device_data['tecnologia_modulacion_doc'] = None
-        device_data['frecuencias_doc'] = None
-        device_data['ganancia_antena_doc'] = None
-        device_data['pire_dbm_doc'] = None
-        device_data['pire_mw_doc'] = None
-    
-    # Filtrar solo archivos públicos
-    device_data['files'] = [file.to_dict() for file in device.files if file.visibility == 'public']
+    payload = jsonify(build_public_device_data(device, fields)).get_data()
+    if fields is None:
+        public_device_cache.set(device_uuid, CachedResponse(payload, etag, last_modified), cache_generation)
     
-    return jsonify(device_data)
+    return public_device_response(payload, etag, last_modified)
 
 @public_bp.route('/api/device/<int:device_id>')
 def get_device_api(device_id):
     """API pública para obtener información del dispositivo en formato JSON"""
-    from flask import make_response
+    try:
+        fields = parse_public_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    device = Device.query.get_or_404(device_id)
+    device = public_device_query(fields).get_or_404(device_id)
     
     # Verificar si el dispositivo está vigente
     from datetime import datetime
@@ -362,47 +452,13 @@ def get_device_api(device_id):
             'message': 'Este dispositivo aún no está vigente para consulta pública.'
         }), 404
     
-    # Usar el método to_dict() del modelo que incluye todos los campos
-    device_data = device.to_dict()
-    
-    # Importar DeviceDoc para buscar la información de documentación
-    from src.models.device_doc import DeviceDoc
-    
-    # Buscar la información de documentación (insensible a mayúsculas/minúsculas y espacios)
-    from sqlalchemy import func
-    device_doc = DeviceDoc.query.filter(
-        func.lower(func.trim(DeviceDoc.marca)) == func.lower(func.trim(device.marca)),
-        func.lower(func.trim(DeviceDoc.nombre_catalogo)) == func.lower(func.trim(device.nombre_catalogo)),
-        func.lower(func.trim(DeviceDoc.modelo_comercial)) == func.lower(func.trim(device.modelo_comercial)),
-        func.lower(func.trim(DeviceDoc.modelo_tecnico)) == func.lower(func.trim(device.modelo_tecnico))
-    ).first()
-    
-    # Agregar los campos de device_doc a device_data si existen
-    if device_doc:
-        device_data['tecnologia_modulacion_doc'] = device_doc.tecnologia_modulacion_doc
-        device_data['frecuencias_doc'] = device_doc.frecuencias_doc
-        device_data['ganancia_antena_doc'] = device_doc.ganancia_antena_doc
-        device_data['pire_dbm_doc'] = device_doc.pire_dbm_doc
-        device_data['pire_mw_doc'] = device_doc.pire_mw_doc
-    else:
-        # Asegurar que los campos existen aunque estén vacíos
-        device_data['tecnologia_modulacion_doc'] = None
-        device_data['frecuencias_doc'] = None
-        device_data['ganancia_antena_doc'] = None
-        device_data['pire_dbm_doc'] = None
-        device_data['pire_mw_doc'] = None
+    # Si el cliente ya tiene la versión actual, responder 304 sin serializar
+    etag, last_modified = public_device_validators(device, fields)
+    if request_not_modified(etag, last_modified):
+        return public_device_response(None, etag, last_modified)
     
-    # Filtrar solo archivos públicos
-    device_data['files'] = [file.to_dict() for file in device.files if file.visibility == 'public']
-    
-    # Crear respuesta con headers anti-caché
-    response = make_response(jsonify(device_data))
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '0'
-    response.headers['Last-Modified'] = device.updated_at.strftime('%a, %d %b %Y %H:%M:%S GMT') if device.updated_at else datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
-    
-    return response
+    payload = jsonify(build_public_device_data(device, fields)).get_data()
+    return public_device_response(payload, etag, last_modified)
 
 
 
@@ -1,10 +1,13 @@
-from flask import Blueprint, request, jsonify, session, render_template_string
+from flask import Blueprint, request, jsonify, session, render_template_string, Response, url_for, stream_with_context, redirect
+from markupsafe import escape
+from werkzeug.utils import secure_filename
 from src.models.user import db
 from src.models.device import Device
-from src.models.qr_token import QrToken
-import qrcode
-import io
-import base64
+from src.utils.qr_cache import qr_render_cache, parse_render_options, QR_FORMATS
+from src.utils.qr_batch import qr_batch_renderer
+from src.utils.qr_urls import device_public_url, brand_qr_url
+from datetime import date
+import zipfile
 from urllib.parse import urljoin
 
 qr_bp = Blueprint("qr", __name__)
@@ -16,45 +19,77 @@ def require_auth():
         return jsonify({"error": "No autenticado"}), 401
     return None
 
+# Tiempo que el navegador puede reutilizar una imagen QR sin revalidarla
+DEVICE_QR_MAX_AGE = 30 * 24 * 3600  # La URL de un dispositivo (su código corto / UUID) no cambia
+BRAND_QR_MAX_AGE = 3600  # El token de la marca puede renovarse
+SHORT_LINK_MAX_AGE = 24 * 3600
+
+@qr_bp.route("/d/<short_code>", methods=["GET"])
+def device_short_link(short_code):
+    """Enlace corto de los QR: redirige a la página pública del dispositivo"""
+    device_uuid = db.session.query(Device.uuid).filter(Device.short_code == short_code).scalar()
+    if device_uuid is None:
+        return jsonify({"error": "Dispositivo no encontrado"}), 404
+    
+    response = redirect(urljoin(request.url_root, f"public_device.html?uid={device_uuid}"))
+    response.headers["Cache-Control"] = f"public, max-age={SHORT_LINK_MAX_AGE}"
+    return response
+
+def qr_image_response(payload, image_format, max_age):
+    """
+    Imagen QR binaria con ETag (la clave de la caché de renders) y Cache-Control.
+    Acepta ?size=, ?border= y ?ec= (L, M, Q, H). Si el navegador ya tiene esa
+    versión se responde 304 sin renderizar.
+    """
+    try:
+        options = parse_render_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    etag = qr_render_cache.cache_key(payload, image_format=image_format, **options)
+    cache_control = f"private, max-age={max_age}"
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(
+            qr_render_cache.get_or_render(payload, image_format=image_format, **options),
+            mimetype=QR_FORMATS[image_format]
+        )
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
 @qr_bp.route("/api/devices/<int:device_id>/qr", methods=["GET"])
 def generate_device_qr(device_id):
-    """Generar código QR para un dispositivo específico"""
+    """URL pública del dispositivo y de sus imágenes QR (PNG / SVG)"""
     auth_error = require_auth()
     if auth_error:
         return auth_error
     
-    device = Device.query.get_or_404(device_id)
-    
-    # Crear la URL para la página de datos del dispositivo
-    base_url = request.url_root
-    # USAR UUID EN LA URL
-    device_url = urljoin(base_url, f"public_device.html?uid={device.uuid}")
-    
-    # Generar código QR
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(device_url)
-    qr.make(fit=True)
-    
-    # Crear imagen QR
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Convertir a base64 para enviar como respuesta
-    img_buffer = io.BytesIO()
-    img.save(img_buffer, format='PNG')
-    img_buffer.seek(0)
-    img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+    device = db.session.query(Device.uuid, Device.short_code).filter(Device.id == device_id).first()
+    if device is None:
+        return jsonify({"error": "Dispositivo no encontrado"}), 404
     
     return jsonify({
-        "qr_code": f"data:image/png;base64,{img_base64}",
-        "device_url": device_url,
-        "device": device.to_dict()
+        "device_url": device_public_url(device.uuid, device.short_code),
+        "qr_png_url": url_for("qr.device_qr_image", device_id=device_id, image_format="png"),
+        "qr_svg_url": url_for("qr.device_qr_image", device_id=device_id, image_format="svg")
     })
 
+@qr_bp.route("/api/devices/<int:device_id>/qr.<any(png, svg):image_format>", methods=["GET"])
+def device_qr_image(device_id, image_format):
+    """Imagen QR de un dispositivo (image/png o image/svg+xml)"""
+    auth_error = require_auth()
+    if auth_error:
+        return auth_error
+    
+    device = db.session.query(Device.uuid, Device.short_code).filter(Device.id == device_id).first()
+    if device is None:
+        return jsonify({"error": "Dispositivo no encontrado"}), 404
+    
+    return qr_image_response(device_public_url(device.uuid, device.short_code), image_format, DEVICE_QR_MAX_AGE)
+
 @qr_bp.route("/device-info/<int:device_id>", methods=["GET"])
 def device_info_page(device_id):
     """Página pública con información completa del dispositivo"""
@@ -364,15 +399,11 @@ def generate_brand_qr_token(brand_name):
         return jsonify({"error": "Sin permisos para generar tokens QR"}), 403
     
     try:
-        # Crear token para la marca
-        qr_token = QrToken.create_brand_token(brand_name, expires_hours=438000)
-        
-        # Generar URL con token
-        base_url = request.url_root
-        brand_url = f"{base_url}index.html?brand={brand_name}&token={qr_token.token}"
+        # Reutilizar el token vigente de la marca (o crear uno si no hay)
+        qr_token, access_token, brand_url = brand_qr_url(brand_name)
         
         return jsonify({
-            "token": qr_token.token,
+            "token": access_token,
             "brand_url": brand_url,
             "expires_at": qr_token.expires_at.isoformat(),
             "brand_name": brand_name
@@ -381,62 +412,164 @@ def generate_brand_qr_token(brand_name):
     except Exception as e:
         return jsonify({"error": f"Error generando token: {str(e)}"}), 500
 
-@qr_bp.route("/api/brands/<brand_name>/qr-with-token", methods=["GET"])
-def get_brand_qr_with_token(brand_name):
-    """Obtener código QR con token para acceso directo a marca"""
+def require_brand_qr_permission():
+    """Solo admin y auditor pueden obtener QR con token de una marca"""
     auth_error = require_auth()
     if auth_error:
         return auth_error
     
-    # Verificar permisos
     user_role = session.get('user_role')
     if user_role not in ['admin', 'auditor']:
         return jsonify({"error": "Sin permisos para generar QR con token"}), 403
+    return None
+
+@qr_bp.route("/api/brands/<brand_name>/qr-with-token", methods=["GET"])
+def get_brand_qr_with_token(brand_name):
+    """URL con token para acceso directo a marca y URLs de sus imágenes QR"""
+    permission_error = require_brand_qr_permission()
+    if permission_error:
+        return permission_error
     
     try:
-        # Buscar token existente válido o crear uno nuevo
-        existing_token = QrToken.query.filter_by(
-            brand_name=brand_name, 
-            token_type='brand',
-            used=False
-        ).first()
-        
-        if existing_token and existing_token.is_valid():
-            qr_token = existing_token
-        else:
-            # Crear nuevo token
-            qr_token = QrToken.create_brand_token(brand_name, expires_hours=438000)
-        
-        # Generar URL con token
-        base_url = request.url_root
-        brand_url = f"{base_url}index.html?brand={brand_name}&token={qr_token.token}"
-        
-        # Generar código QR
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(brand_url)
-        qr.make(fit=True)
-        
-        # Crear imagen QR
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Convertir a base64
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
+        qr_token, access_token, brand_url = brand_qr_url(brand_name)
         
         return jsonify({
-            "qr_code": f"data:image/png;base64,{img_base64}",
             "brand_url": brand_url,
-            "token": qr_token.token,
+            "qr_png_url": url_for("qr.brand_qr_image", brand_name=brand_name, image_format="png"),
+            "qr_svg_url": url_for("qr.brand_qr_image", brand_name=brand_name, image_format="svg"),
+            "token": access_token,
             "expires_at": qr_token.expires_at.isoformat(),
             "brand_name": brand_name
         }), 200
         
     except Exception as e:
         return jsonify({"error": f"Error generando QR: {str(e)}"}), 500
+
+@qr_bp.route("/api/brands/<brand_name>/qr.<any(png, svg):image_format>", methods=["GET"])
+def brand_qr_image(brand_name, image_format):
+    """Imagen QR con token de una marca (image/png o image/svg+xml)"""
+    permission_error = require_brand_qr_permission()
+    if permission_error:
+        return permission_error
+    
+    try:
+        _, _, brand_url = brand_qr_url(brand_name)
+        return qr_image_response(brand_url, image_format, BRAND_QR_MAX_AGE)
+    except Exception as e:
+        return jsonify({"error": f"Error generando QR: {str(e)}"}), 500
+
+class ZipStream:
+    """Destino de escritura de zipfile que acumula los bytes hasta que el generador los envía"""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+LABEL_SHEET_HEADER = """<!DOCTYPE html>
+<html lang="es">
+<head>
+    <meta charset="UTF-8">
+    <title>Etiquetas QR - {brand}</title>
+    <style>
+        @page {{ size: A4; margin: 10mm; }}
+        body {{ font-family: Arial, sans-serif; margin: 0; }}
+        .sheet {{ display: grid; grid-template-columns: repeat(3, 63mm); grid-auto-rows: 38mm; gap: 2mm; }}
+        .label {{ display: flex; align-items: center; gap: 2mm; padding: 1mm; border: 1px dashed #ccc; break-inside: avoid; overflow: hidden; }}
+        .label svg {{ width: 34mm; height: 34mm; flex-shrink: 0; }}
+        .label-text {{ font-size: 8pt; line-height: 1.2; }}
+        .label-text strong {{ display: block; font-size: 9pt; }}
+        @media print {{ .label {{ border: none; }} }}
+    </style>
+</head>
+<body>
+<div class="sheet">
+"""
+
+@qr_bp.route("/api/brands/<brand_name>/qr-labels", methods=["GET"])
+def brand_qr_labels(brand_name):
+    """
+    QR de todos los dispositivos de una marca (solo admin), en streaming:
+    ?format=zip (imágenes, ?image=png|svg) o ?format=sheet (hoja HTML imprimible).
+    Filtros opcionales: ?categoria= y ?vigente=1|0. Acepta ?size=, ?border= y ?ec=.
+    """
+    auth_error = require_auth()
+    if auth_error:
+        return auth_error
+    if session.get('user_role') != 'admin':
+        return jsonify({"error": "Acceso denegado. Se requiere rol de administrador"}), 403
+    
+    output_format = request.args.get("format", "zip")
+    if output_format not in ("zip", "sheet"):
+        return jsonify({"error": "Formato no soportado. Use: zip, sheet"}), 400
+    # La hoja de etiquetas incrusta los QR como SVG
+    image_format = "svg" if output_format == "sheet" else request.args.get("image", "png")
+    if image_format not in QR_FORMATS:
+        return jsonify({"error": "Imagen no soportada. Use: png, svg"}), 400
+    try:
+        options = parse_render_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    query = db.session.query(
+        Device.uuid, Device.short_code, Device.nombre_catalogo, Device.modelo_comercial, Device.modelo_tecnico
+    ).filter(Device.marca == brand_name, Device.nombre_catalogo != "Dispositivo Temporal")
+    
+    categoria = request.args.get("categoria")
+    if categoria:
+        query = query.filter(Device.categoria == categoria)
+    vigente = request.args.get("vigente")
+    if vigente == "1":
+        query = query.filter(Device.fecha_vigencia <= date.today())
+    elif vigente == "0":
+        query = query.filter(Device.fecha_vigencia > date.today())
+    
+    devices = query.order_by(Device.id).all()
+    if not devices:
+        return jsonify({"error": "No hay dispositivos de esta marca con esos filtros"}), 404
+    
+    devices_by_url = {device_public_url(device.uuid, device.short_code): device for device in devices}
+    images = qr_batch_renderer.render(devices_by_url.keys(), image_format=image_format, **options)
+    
+    def generate_zip():
+        stream = ZipStream()
+        compression = zipfile.ZIP_STORED if image_format == "png" else zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(stream, mode="w", compression=compression) as archive:
+            for url, data in images:
+                device = devices_by_url[url]
+                filename = secure_filename(f"{device.modelo_comercial}_{device.uuid[:8]}.{image_format}")
+                archive.writestr(filename, data)
+                yield stream.drain()
+        yield stream.drain()
+    
+    def generate_sheet():
+        yield LABEL_SHEET_HEADER.format(brand=escape(brand_name))
+        for url, data in images:
+            device = devices_by_url[url]
+            # Sin la declaración XML para poder incrustar el SVG en el HTML
+            svg = data.decode("utf-8").split("?>", 1)[-1].strip()
+            yield (
+                f'<div class="label">{svg}<div class="label-text">'
+                f'<strong>{escape(brand_name)}</strong>{escape(device.nombre_catalogo)}<br>'
+                f'{escape(device.modelo_comercial)}<br>{escape(device.modelo_tecnico)}</div></div>\n'
+            )
+        yield "</div>\n</body>\n</html>\n"
+    
+    if output_format == "sheet":
+        return Response(stream_with_context(generate_sheet()), mimetype="text/html")
+    
+    filename = secure_filename(f"qr_{brand_name}_{date.today().strftime('%Y%m%d')}.zip")
+    return Response(
+        stream_with_context(generate_zip()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
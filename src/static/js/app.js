@@ -4,10 +4,23 @@ let devices = [];
 let categories = [];
 let isEditing = false;
 let editingDeviceId = null;
+let currentBrandFilter = '';
 
 // API Base URL
 const API_BASE = '/api';
 
+// Archivos mayores que esto se suben por partes (reanudable; sin el límite de 15MB por petición)
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+
+// Campos que necesita la grilla de dispositivos (?fields= evita cargar device_doc)
+const DEVICE_LIST_FIELDS = 'id,uuid,marca,nombre_catalogo,modelo_comercial,modelo_tecnico,categoria,subcategoria,fecha_vigencia,files';
+
+// Listado paginado del panel: filas por página y estado de la lista mostrada
+const DEVICE_PAGE_SIZE = 50;
+let devicesQuery = null;        // Endpoint y filtros de la lista mostrada (sin cursor)
+let devicesNextCursor = null;   // Cursor de la página siguiente, null si no hay más
+let devicesRequestId = 0;       // Para descartar respuestas de peticiones anteriores
+
 // Initialize app
 document.addEventListener('DOMContentLoaded', function() {
     checkAuthStatus();
@@ -232,9 +245,7 @@ function showDashboard() {
     const urlParams = new URLSearchParams(window.location.search);
     const selectedBrand = urlParams.get('brand') || sessionStorage.getItem('selectedBrand');
     
-
-                document.getElementById("categoryFilter").value = ""; // Asegura que la opción por defecto esté seleccionada
-                filterDevices();
+    document.getElementById("categoryFilter").value = ""; // Asegura que la opción por defecto esté seleccionada
 
     if (selectedBrand) {
         // Mostrar indicador de marca seleccionada
@@ -251,6 +262,8 @@ function showDashboard() {
         // Esto evita que se muestren todos los dispositivos al entrar a index.html directamente
         console.log("No hay marca seleccionada, esperando selección.");
         document.getElementById("devicesGrid").innerHTML = "";
+        document.getElementById("loadMoreDevices").style.display = "none";
+        devicesQuery = null;
     }
 }
 
@@ -299,18 +312,11 @@ function goToBrandSelection() {
 // Device management functions
 async function loadDevices(brandFilter = '') {
     showLoading(true);
+    currentBrandFilter = brandFilter;
     
     try {
-        const response = await fetch(`${API_BASE}/devices${brandFilter ? `?marca=${encodeURIComponent(brandFilter)}` : ''}`, {
-            credentials: 'include'
-        });
-        
-        if (response.ok) {
-            const data = await response.json();
-            devices = Array.isArray(data) ? data : [];
-        } else {
-            showToast('Error al cargar dispositivos', 'error');
-        }
+        // Solo la primera página; las siguientes se piden con "Cargar más" (loadMoreDevices)
+        await fetchDevicePage(deviceListQuery());
     } catch (error) {
         console.error('Error loading devices:', error);
         showToast('Error de conexión al cargar dispositivos', 'error');
@@ -319,6 +325,68 @@ async function loadDevices(brandFilter = '') {
     }
 }
 
+function deviceListQuery() {
+    // Endpoint y parámetros de la lista para los filtros actuales (marca, categoría y texto)
+    const params = new URLSearchParams({ fields: DEVICE_LIST_FIELDS, limit: DEVICE_PAGE_SIZE });
+    if (currentBrandFilter) params.set('marca', currentBrandFilter);
+    
+    const categoryFilter = document.getElementById('categoryFilter').value;
+    if (categoryFilter) params.set('categoria', categoryFilter);
+    
+    const searchFilter = document.getElementById('searchFilter').value.trim();
+    if (searchFilter) params.set('q', searchFilter);
+    
+    return `${searchFilter ? 'devices/search' : 'devices'}?${params.toString()}`;
+}
+
+async function fetchDevicePage(query, cursor = null) {
+    // Con cursor se añade la página siguiente a la lista; sin él se reemplaza la lista
+    const requestId = ++devicesRequestId;
+    const url = `${API_BASE}/${query}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`;
+    
+    const response = await fetch(url, {
+        credentials: 'include'
+    });
+    
+    if (!response.ok) {
+        showToast('Error al cargar dispositivos', 'error');
+        return false;
+    }
+    
+    const data = await response.json();
+    
+    // Ignorar respuestas de peticiones que ya no corresponden a los filtros actuales
+    if (requestId !== devicesRequestId) return false;
+    
+    const page = Array.isArray(data.devices) ? data.devices : [];
+    devices = cursor ? devices.concat(page) : page;
+    devicesQuery = query;
+    devicesNextCursor = data.next_cursor || null;
+    return true;
+}
+
+async function loadMoreDevices() {
+    if (!devicesNextCursor) return;
+    
+    showLoading(true);
+    
+    try {
+        if (await fetchDevicePage(devicesQuery, devicesNextCursor)) {
+            renderDevicesPage();
+        }
+    } catch (error) {
+        console.error('Error loading more devices:', error);
+        showToast('Error de conexión al cargar dispositivos', 'error');
+    } finally {
+        showLoading(false);
+    }
+}
+
+function renderDevicesPage() {
+    renderFilteredDevices(devices);
+    document.getElementById('loadMoreDevices').style.display = devicesNextCursor ? 'inline-flex' : 'none';
+}
+
 function filterDevices() {
     const categoryFilter = document.getElementById("categoryFilter").value;
     const searchFilter = document.getElementById("searchFilter").value.toLowerCase();
@@ -676,6 +744,16 @@ async function uploadDeviceFiles(deviceId, formData) {
             continue;
         }
         
+        if (file && file.size > CHUNKED_UPLOAD_THRESHOLD && !externalUrl) {
+            try {
+                await uploadFileInChunks(deviceId, file, fileType, visibility, requiresPassword);
+            } catch (error) {
+                console.error(`Error uploading file ${fileType}:`, error);
+                showToast(`Error al subir archivo ${fileType}: ${error.message}`, 'warning');
+            }
+            continue;
+        }
+        
         const uploadFormData = new FormData();
         uploadFormData.append('device_id', deviceId);
         uploadFormData.append('file_type', fileType);
@@ -726,6 +804,85 @@ async function uploadDeviceFiles(deviceId, formData) {
     }
 }
 
+// Subida reanudable por partes: si una parte falla se consulta el offset confirmado por el servidor y se continúa desde ahí
+async function uploadFileInChunks(deviceId, file, fileType, visibility, requiresPassword) {
+    // Con el hash, un contenido que ya está en el servidor (p. ej. la misma guía en otra variante) no se vuelve a enviar
+    let sha256 = null;
+    if (window.crypto && window.crypto.subtle) {
+        const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        sha256 = Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+    }
+    
+    const startResponse = await fetch(`${API_BASE}/files/uploads`, {
+        method: 'POST',
+        credentials: 'include',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            device_id: deviceId,
+            file_type: fileType,
+            file_name: file.name,
+            size: file.size,
+            visibility: visibility,
+            requires_password: requiresPassword,
+            sha256: sha256
+        })
+    });
+    const upload = await startResponse.json();
+    if (!startResponse.ok) {
+        throw new Error(upload.error);
+    }
+    if (upload.complete) {
+        return;
+    }
+    
+    const uploadUrl = `${API_BASE}/files/uploads/${upload.upload_id}`;
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+        try {
+            const response = await fetch(`${uploadUrl}?offset=${offset}`, {
+                method: 'PUT',
+                credentials: 'include',
+                body: file.slice(offset, offset + upload.chunk_size)
+            });
+            const result = await response.json();
+            if (response.ok) {
+                offset = result.offset;
+                failures = 0;
+                continue;
+            }
+            if (response.status !== 409) {
+                throw new Error(result.error);
+            }
+        } catch (error) {
+            if (++failures > 5) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+        }
+        
+        // Retomar desde lo que el servidor ya tiene
+        try {
+            const statusResponse = await fetch(uploadUrl, { credentials: 'include' });
+            if (statusResponse.ok) {
+                offset = (await statusResponse.json()).offset;
+            }
+        } catch (error) {
+            console.warn('No se pudo consultar el estado de la subida:', error);
+        }
+    }
+    
+    const completeResponse = await fetch(`${uploadUrl}/complete`, {
+        method: 'POST',
+        credentials: 'include',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ sha256: sha256 })
+    });
+    if (!completeResponse.ok) {
+        throw new Error((await completeResponse.json()).error);
+    }
+}
+
 async function loadDeviceForEdit(deviceId) {
     showLoading(true);
     
@@ -1029,7 +1186,7 @@ function addFileInput() {
             </div>
             <div class="file-input-row">
                 <div class="form-group">
-                    <label>Archivo (PDF/ZIP/Imágenes, máx 15MB)</label>
+                    <label>Archivo (PDF/ZIP/Imágenes, máx 150MB por dispositivo)</label>
                     <input type="file" name="file_${fileIndex}" accept=".pdf,.zip,.jpg,.jpeg,.png,.gif,.webp,.bmp">
                 </div>
                 <div class="form-group">
@@ -1051,26 +1208,31 @@ function removeFileInput(index) {
 }
 
 // Filter functions
+let searchTimeout = null;
+
 function filterDevices() {
-    const categoryFilter = document.getElementById('categoryFilter').value;
-    const searchFilter = document.getElementById('searchFilter').value.toLowerCase();
-    
-    let filteredDevices = [...devices];
+    const query = deviceListQuery();
     
-    if (categoryFilter === "") {
-        // Muestra todos los dispositivos si se selecciona 'Todas las Categorías' (valor vacío)
-    } else if (categoryFilter) {
-        filteredDevices = filteredDevices.filter(device => device.categoria === categoryFilter);
+    clearTimeout(searchTimeout);
+    if (query === devicesQuery) {
+        renderDevicesPage();
+        return;
     }
     
-    if (searchFilter) {
-        filteredDevices = filteredDevices.filter(device => 
-            device.modelo_tecnico.toLowerCase().includes(searchFilter) ||
-            device.modelo_comercial.toLowerCase().includes(searchFilter)
-        );
+    // Los filtros se aplican en el servidor; el texto se busca (índice de texto completo) tras una breve pausa al escribir
+    const delay = document.getElementById('searchFilter').value.trim() ? 300 : 0;
+    searchTimeout = setTimeout(() => reloadDevices(query), delay);
+}
+
+async function reloadDevices(query) {
+    try {
+        if (await fetchDevicePage(query)) {
+            renderDevicesPage();
+        }
+    } catch (error) {
+        console.error('Error filtering devices:', error);
+        showToast('Error de conexión al cargar dispositivos', 'error');
     }
-    
-    renderFilteredDevices(filteredDevices);
 }
 
 // Utility functions
@@ -1123,6 +1285,7 @@ async function showDeviceQR(deviceId) {
         }
         
         const data = await response.json();
+        const device = devices.find(item => item.id === deviceId) || {};
         
         // Crear modal para mostrar el QR
         const modal = document.createElement('div');
@@ -1136,10 +1299,10 @@ async function showDeviceQR(deviceId) {
                 <div class="modal-body">
                     <div class="qr-container">
                         <div class="device-qr-info">
-                            <h4>${data.device.marca} ${data.device.nombre_catalogo}</h4>
+                            <h4>${device.marca || ''} ${device.nombre_catalogo || ''}</h4>
                         </div>
                         <div class="qr-code-container">
-                            <img src="${data.qr_code}" alt="Código QR" class="qr-code-image">
+                            <img src="${data.qr_svg_url}" alt="Código QR" class="qr-code-image">
                         </div>
                         <div class="qr-url-info">
                             <p><strong>URL del dispositivo:</strong></p>
@@ -1151,9 +1314,9 @@ async function showDeviceQR(deviceId) {
                             </div>
                         </div>
                         <div class="qr-actions">
-                            <button class="btn btn-primary" onclick="downloadQR('${data.qr_code}', '${data.device.marca}_${data.device.modelo_comercial}_QR')">
+                            <button class="btn btn-primary" onclick="downloadQR('${data.qr_png_url}', '${device.marca}_${device.modelo_comercial}_QR')">
                                 <i class="fas fa-download"></i> Descargar QR
-                            </button>                            <button class="btn btn-outline" onclick="openDeviceUrl(\'/static/public_device.html?uid=${data.device.uuid}\')">                                <i class="fas fa-external-link-alt"></i> Ver Página Pública
+                            </button>                            <button class="btn btn-outline" onclick="openDeviceUrl('${data.device_url}')">                                <i class="fas fa-external-link-alt"></i> Ver Página Pública
                             </button>
                         </div>
                     </div>
@@ -1192,10 +1355,10 @@ function copyToClipboard(inputId) {
     }
 }
 
-function downloadQR(qrDataUrl, filename) {
+function downloadQR(qrImageUrl, filename) {
     const link = document.createElement('a');
     link.download = `${filename}.png`;
-    link.href = qrDataUrl;
+    link.href = qrImageUrl;
     document.body.appendChild(link);
     link.click();
     document.body.removeChild(link);
@@ -1,5 +1,6 @@
 // Global variables
 let brands = [];
+let brandRecords = [];
 
 // Initialize brand selection page
 document.addEventListener('DOMContentLoaded', async function() {
@@ -49,13 +50,14 @@ async function loadBrands() {
     const noBrands = document.getElementById('noBrands');
     
     try {
-        const response = await fetch("/api/brands", {
+        // Una sola petición con los registros completos de todas las marcas
+        const response = await fetch("/api/brands?full=1", {
             credentials: 'include'
         });
         
         if (response.ok) {
-            const brandsData = await response.json();
-            brands = brandsData.sort();
+            brandRecords = await response.json();
+            brands = brandRecords.map(record => record.name);
             
             if (brands.length > 0) {
                 renderBrands();
@@ -76,33 +78,15 @@ async function loadBrands() {
 }
 
 // Renderizar marcas
-async function renderBrands() {
+function renderBrands() {
     const brandsContainer = document.getElementById('brandsContainer');
     
-    // Obtener información completa de cada marca incluyendo URL
-    const brandPromises = brands.map(async brand => {
-        try {
-            const response = await fetch(`/api/brands/${encodeURIComponent(brand)}/info`, {
-                credentials: 'include'
-            });
-            if (response.ok) {
-                const brandInfo = await response.json();
-                return { name: brand, url: brandInfo.url || null };
-            }
-        } catch (error) {
-            console.error(`Error loading info for brand ${brand}:`, error);
-        }
-        return { name: brand, url: null };
-    });
-    
-    const brandsWithInfo = await Promise.all(brandPromises);
-    
-    brandsContainer.innerHTML = brandsWithInfo.map(brandInfo => {
+    brandsContainer.innerHTML = brandRecords.map(brandInfo => {
         const brand = brandInfo.name;
         const brandUrl = brandInfo.url;
         const qrUrl = `${window.location.origin}/index.html?brand=${encodeURIComponent(brand)}`;
-        // Intentar múltiples formatos de imagen
-        const brandImageUrl = getBrandImageUrl(brand);
+        // Usar la imagen registrada; si no hay, intentar múltiples formatos
+        const brandImageUrl = brandInfo.image_url || getBrandImageUrl(brand);
         
         return `
             <div class="brand-card" onclick="selectBrand('${brand}')">
@@ -116,6 +100,7 @@ async function renderBrands() {
                     <i class="fas fa-qrcode"></i>
                 </button>
                 <div class="brand-name">${brand}</div>
+                <div class="brand-counts">${brandInfo.device_count} dispositivos · ${brandInfo.vigente_count} vigentes</div>
                 <div class="qr-container">
 	                <div class="qr-code" id="qr-${brand.replace(/[^a-zA-Z0-9]/g, '')}"></div>
 	                </div>
@@ -211,7 +196,7 @@ async function generateQRWithToken(brandName, elementId) {
             if (qrElement) {
                 // Crear imagen del QR
                 const img = document.createElement('img');
-                img.src = data.qr_code;
+                img.src = data.qr_svg_url;
                 img.alt = `QR Code for ${brandName}`;
                 img.style.maxWidth = '100%';
                 img.style.height = 'auto';
@@ -301,6 +286,11 @@ async function logout() {
     }
 }
 
+// URL de los QR de todos los dispositivos de la marca (hoja imprimible o ZIP)
+function brandLabelsUrl(brandName, format) {
+    return `/api/brands/${encodeURIComponent(brandName)}/qr-labels?format=${format}`;
+}
+
 // Función para mostrar el QR de una marca
 async function showBrandQR(brandName) {
     let qrCodeDataUrl = '';
@@ -314,7 +304,7 @@ async function showBrandQR(brandName) {
 
         if (response.ok) {
             const data = await response.json();
-            qrCodeDataUrl = data.qr_code;
+            qrCodeDataUrl = data.qr_png_url;
         } else {
             // 2. Fallback: generar QR sin token si la llamada al backend falla
             console.warn(`No se pudo obtener QR con token para ${brandName} para el modal, usando método tradicional.`);
@@ -358,6 +348,12 @@ async function showBrandQR(brandName) {
                             <button class="btn btn-outline" onclick="window.open('${brandUrl}', '_blank')">
                                 <i class="fas fa-external-link-alt"></i> Ver Panel
                             </button>
+                            <button class="btn btn-outline" onclick="window.open('${brandLabelsUrl(brandName, 'sheet')}', '_blank')">
+                                <i class="fas fa-print"></i> Hoja de etiquetas
+                            </button>
+                            <button class="btn btn-outline" onclick="window.location.href = '${brandLabelsUrl(brandName, 'zip')}'">
+                                <i class="fas fa-file-archive"></i> ZIP de QR
+                            </button>
                         </div>
                     </div>
                 </div>
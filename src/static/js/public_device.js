@@ -14,21 +14,16 @@ async function loadDeviceInfo() {
   }
 
   try {
-    // Agregar timestamp para evitar caché del navegador
-    const timestamp = new Date().getTime();
-    
     // Determinar el endpoint a usar
     const endpoint = deviceUid 
       ? `/api/device/by-uuid/${deviceUid}` 
       : `/api/device/${deviceId}`;
       
-    const response = await fetch(`${endpoint}?_t=${timestamp}`, {
+    // cache: "no-cache" reutiliza la copia del navegador, pero siempre la revalida
+    // con el servidor (ETag / Last-Modified); si no cambió, la respuesta es un 304 sin cuerpo
+    const response = await fetch(endpoint, {
       method: "GET",
-      headers: {
-        "Cache-Control": "no-cache, no-store, must-revalidate",
-        Pragma: "no-cache",
-        Expires: "0",
-      },
+      cache: "no-cache",
     });
 
     if (!response.ok) {
@@ -0,0 +1,169 @@
+"""
+Almacén de archivos direccionado por contenido.
+
+Cada contenido se guarda una sola vez en UPLOAD_FOLDER/blobs/<aa>/<bb>/<sha256>,
+sin importar cuántos dispositivos lo adjunten ni con qué nombre: DeviceFile
+guarda esa ruta en file_path y el nombre original en file_name (que es el que
+se usa al descargar). La tabla 'file_blob' cuenta cuántos DeviceFile apuntan a
+cada contenido:
+- store() / reference_existing() suman una referencia antes de crear el
+  DeviceFile, en la misma transacción, y solo después deciden si hace falta
+  escribir los bytes: mientras la transacción no termina, la fila de file_blob
+  está bloqueada y ninguna purga puede eliminar ese contenido.
+- Al eliminar un DeviceFile (también en cascada, al borrar un dispositivo o una
+  marca) se resta una, y tras el commit se elimina el archivo si ya no quedan
+  referencias. purge() borra la fila y aparta el archivo dentro de la misma
+  transacción, así que una subida concurrente o ve la fila (y la purga no
+  ocurre) o espera a que el archivo ya no esté y lo vuelve a escribir.
+"""
+
+import os
+import uuid
+from datetime import datetime
+
+from sqlalchemy import event, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+
+from src.models.user import db
+from src.models.device import DeviceFile
+from src.models.file_blob import FileBlob
+
+BLOB_FOLDER = 'blobs'
+
+
+class BlobStore:
+    def __init__(self, root=None):
+        self.root = root
+
+    def init_app(self, app):
+        self.root = app.config['UPLOAD_FOLDER']
+
+    @staticmethod
+    def relative_path(sha256):
+        """
+        Ruta del contenido relativa a UPLOAD_FOLDER (la que se guarda en
+        DeviceFile.file_path). Siempre con '/', también en Windows, para que la
+        base de datos y las rutas de X-Accel-Redirect no dependan del sistema.
+        """
+        return '/'.join((BLOB_FOLDER, sha256[:2], sha256[2:4], sha256))
+
+    @staticmethod
+    def is_blob_path(file_path):
+        return bool(file_path) and file_path.replace('\\', '/').startswith(BLOB_FOLDER + '/')
+
+    @staticmethod
+    def blob_path_condition(column):
+        """Equivalente SQL de is_blob_path para una columna de rutas"""
+        return or_(column.like(BLOB_FOLDER + '/%'), column.like(BLOB_FOLDER + '\\%', escape='|'))
+
+    @property
+    def staging_folder(self):
+        """Carpeta de los temporales de subida: mismo sistema de archivos que los blobs (rename atómico)"""
+        return os.path.join(self.root, BLOB_FOLDER)
+
+    def _add_reference(self, sha256, size=None):
+        """Sumar una referencia en la transacción de la sesión; False si el contenido no estaba registrado"""
+        blobs = FileBlob.__table__
+        condition = blobs.c.sha256 == sha256
+        if size is not None:
+            condition &= blobs.c.size == size
+        return db.session.execute(
+            blobs.update().where(condition).values(ref_count=blobs.c.ref_count + 1)
+        ).rowcount > 0
+
+    def store(self, incoming):
+        """
+        Guardar un archivo recibido y devolver su ruta relativa. La referencia se
+        toma en la transacción de la sesión (se confirma con el DeviceFile que la
+        usa); si el contenido ya existe, el temporal se descarta sin escribir nada.
+        """
+        relative_path = self.relative_path(incoming.sha256)
+        path = os.path.join(self.root, relative_path)
+        if not self._add_reference(incoming.sha256):
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(FileBlob.__table__.insert().values(
+                        sha256=incoming.sha256, size=incoming.size, ref_count=1, created_at=datetime.utcnow()
+                    ))
+            except IntegrityError:
+                # Otra subida del mismo contenido lo registró a la vez
+                self._add_reference(incoming.sha256)
+
+        if os.path.exists(path):
+            incoming.discard()
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            incoming.save(path)
+        return relative_path
+
+    def reference_existing(self, sha256, size):
+        """
+        Tomar una referencia a un contenido ya guardado (registro y archivo en disco)
+        para registrarlo sin recibir sus bytes. False si no está guardado.
+        """
+        if not self._add_reference(sha256, size):
+            return False
+        if not os.path.exists(os.path.join(self.root, self.relative_path(sha256))):
+            blobs = FileBlob.__table__
+            db.session.execute(
+                blobs.update().where(blobs.c.sha256 == sha256).values(ref_count=blobs.c.ref_count - 1)
+            )
+            return False
+        return True
+
+    def purge(self, sha256_values):
+        """Eliminar los contenidos sin referencias (registro y archivo) de la lista dada. Devuelve cuántos"""
+        purged = 0
+        for sha256 in sha256_values:
+            path = os.path.join(self.root, self.relative_path(sha256))
+            discarded_path = None
+            try:
+                with db.engine.begin() as connection:
+                    deleted = connection.execute(
+                        FileBlob.__table__.delete().where(FileBlob.sha256 == sha256, FileBlob.ref_count <= 0)
+                    ).rowcount
+                    # Con la fila bloqueada: el archivo se aparta antes de confirmar el borrado
+                    if deleted and os.path.exists(path):
+                        discarded_path = f"{path}.{uuid.uuid4().hex}.purged"
+                        os.replace(path, discarded_path)
+            except Exception as e:
+                # Sin confirmar el borrado el contenido sigue registrado: se devuelve a su sitio
+                if discarded_path:
+                    os.replace(discarded_path, path)
+                print(f"[BLOBS] No se pudo purgar {sha256}: {e}")
+                continue
+            purged += deleted
+            if discarded_path:
+                try:
+                    os.remove(discarded_path)
+                except OSError as e:
+                    print(f"[BLOBS] No se pudo eliminar {discarded_path}: {e}")
+        return purged
+
+
+blob_store = BlobStore()
+
+
+@event.listens_for(DeviceFile, 'after_delete')
+def remove_blob_reference(mapper, connection, device_file):
+    if not device_file.sha256 or not BlobStore.is_blob_path(device_file.file_path):
+        return
+    blobs = FileBlob.__table__
+    connection.execute(
+        blobs.update().where(blobs.c.sha256 == device_file.sha256).values(ref_count=blobs.c.ref_count - 1)
+    )
+    # El archivo se elimina solo si la transacción se confirma
+    object_session(device_file).info.setdefault('released_blobs', set()).add(device_file.sha256)
+
+
+@event.listens_for(Session, 'after_commit')
+def purge_released_blobs(session):
+    released = session.info.pop('released_blobs', None)
+    if released:
+        blob_store.purge(released)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_released_blobs(session):
+    session.info.pop('released_blobs', None)
@@ -0,0 +1,194 @@
+"""
+Subidas reanudables por partes.
+
+Cada subida en curso es una carpeta UPLOAD_FOLDER/.chunked/<id> con:
+- meta.json: dispositivo, tipo, nombre y tamaño total declarados al iniciarla.
+- data.part: los bytes recibidos hasta ahora, siempre contiguos desde el inicio.
+
+El estado vive solo en disco, así que una subida sobrevive a reinicios de los
+workers y cualquier worker puede recibir la parte siguiente. El offset confirmado
+es el tamaño de data.part: una parte repetida (reintento tras un corte) se acepta
+sin escribir lo que ya estaba, y una parte con un offset posterior se rechaza
+indicando desde dónde continuar. Las partes de una misma subida se escriben de
+una en una, con un lock exclusivo sobre data.part.
+
+Terminar la subida (complete() y el registro del DeviceFile) se hace dentro de
+finishing(), con un lock exclusivo sobre complete.lock, y finish() guarda el id
+del archivo creado en meta.json: un complete repetido (reintento del cliente
+tras un timeout) espera al primero y devuelve el mismo archivo. La carpeta de
+una subida terminada se elimina con las subidas abandonadas (purge_stale).
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from src.utils.uploads import UploadError, IncomingFile, CHUNK_SIZE
+from src.utils.file_lock import lock_file
+
+UPLOAD_ID_RE = re.compile(r'[0-9a-f]{32}')
+# Tamaño máximo de cada PUT (por debajo de MAX_CONTENT_LENGTH) y tamaño sugerido al cliente
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+SUGGESTED_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ChunkedUploadStore:
+    def __init__(self, directory=None, stale_after=24 * 3600):
+        self.directory = directory
+        self.stale_after = stale_after
+
+    def init_app(self, app):
+        self.directory = os.path.join(app.config['UPLOAD_FOLDER'], '.chunked')
+        self.stale_after = app.config.get('CHUNKED_UPLOAD_STALE_AFTER', self.stale_after)
+
+    def _folder(self, upload_id):
+        if not upload_id or not UPLOAD_ID_RE.fullmatch(upload_id):
+            raise UploadError('Subida no encontrada', 404)
+        return os.path.join(self.directory, upload_id)
+
+    def create(self, **meta):
+        """Registrar una subida nueva y devolver sus metadatos (incluye 'upload_id')"""
+        upload_id = uuid.uuid4().hex
+        folder = self._folder(upload_id)
+        os.makedirs(folder)
+        open(os.path.join(folder, 'data.part'), 'wb').close()
+        meta = dict(meta, upload_id=upload_id, created_at=time.time())
+        self._write_meta(folder, meta)
+        return meta
+
+    def _write_meta(self, folder, meta):
+        fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp_path, os.path.join(folder, 'meta.json'))
+
+    def _read_meta(self, folder):
+        with open(os.path.join(folder, 'meta.json'), encoding='utf-8') as meta_file:
+            return json.load(meta_file)
+
+    def load(self, upload_id):
+        """Metadatos de la subida con el offset confirmado ('offset')"""
+        folder = self._folder(upload_id)
+        try:
+            meta = self._read_meta(folder)
+            if 'file_id' in meta:
+                meta['offset'] = meta['size']  # Terminada: data.part ya pasó al almacén
+            else:
+                meta['offset'] = os.path.getsize(os.path.join(folder, 'data.part'))
+        except FileNotFoundError:
+            raise UploadError('Subida no encontrada', 404)
+        return meta
+
+    def write_chunk(self, upload_id, offset, stream):
+        """
+        Escribir una parte que empieza en 'offset' leyéndola de 'stream' por bloques.
+        Devuelve el nuevo offset confirmado.
+        """
+        meta = self.load(upload_id)
+        if 'file_id' in meta:
+            raise UploadError('La subida ya terminó', 409)
+        data_path = os.path.join(self._folder(upload_id), 'data.part')
+        try:
+            data_file = open(data_path, 'r+b')
+        except FileNotFoundError:
+            # complete() la terminó entre load() y la apertura
+            raise UploadError('La subida ya terminó', 409)
+        with data_file:
+            # Una parte a la vez por subida (un reintento del cliente puede llegar
+            # mientras la petición anterior sigue recibiendo): el offset confirmado
+            # se lee ya con el lock tomado
+            lock_file(data_file)
+            received = os.fstat(data_file.fileno()).st_size
+            if offset > received:
+                raise UploadError(f'Offset {offset} no válido: la subida continúa en {received}', 409)
+
+            skip = received - offset  # Bytes de la parte que ya se habían recibido
+            written = 0
+            data_file.seek(received)
+            while True:
+                block = stream.read(CHUNK_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > MAX_CHUNK_SIZE or offset + written > meta['size']:
+                    # Deshacer lo escrito por esta parte
+                    data_file.truncate(received)
+                    raise UploadError('La parte excede el tamaño declarado o el máximo por parte', 413)
+                if skip >= len(block):
+                    skip -= len(block)
+                    continue
+                data_file.write(block[skip:])
+                skip = 0
+        # Marca de actividad para la limpieza de subidas abandonadas
+        os.utime(os.path.join(self._folder(upload_id), 'meta.json'))
+        return max(received, offset + written)
+
+    @contextmanager
+    def finishing(self, upload_id):
+        """Lock exclusivo para terminar la subida: complete(), guardar el archivo y finish()"""
+        try:
+            lock_handle = open(os.path.join(self._folder(upload_id), 'complete.lock'), 'a+b')
+        except FileNotFoundError:
+            raise UploadError('Subida no encontrada', 404)
+        with lock_handle:
+            lock_file(lock_handle)
+            yield
+
+    def complete(self, upload_id):
+        """
+        Comprobar que se recibió todo y devolver (metadatos, IncomingFile) con el
+        SHA-256 del contenido, o (metadatos, None) si ya terminó (meta['file_id']).
+        Llamar dentro de finishing().
+        """
+        meta = self.load(upload_id)
+        if 'file_id' in meta:
+            return meta, None
+
+        data_path = os.path.join(self._folder(upload_id), 'data.part')
+        sha256 = hashlib.sha256()
+        with open(data_path, 'rb') as data_file:
+            # Con el lock de las partes: una parte que se esté escribiendo termina
+            # (o se deshace) antes de comprobar el tamaño y calcular el hash
+            lock_file(data_file)
+            received = os.fstat(data_file.fileno()).st_size
+            if received != meta['size']:
+                raise UploadError(f"Subida incompleta: recibidos {received} de {meta['size']} bytes", 409)
+            for block in iter(lambda: data_file.read(1024 * 1024), b''):
+                sha256.update(block)
+        return meta, IncomingFile(meta['file_name'], data_path, meta['size'], sha256.hexdigest())
+
+    def finish(self, upload_id, file_id):
+        """Guardar el id del DeviceFile creado; un complete() posterior lo devuelve"""
+        folder = self._folder(upload_id)
+        meta = self._read_meta(folder)
+        meta['file_id'] = file_id
+        self._write_meta(folder, meta)
+
+    def discard(self, upload_id):
+        shutil.rmtree(self._folder(upload_id), ignore_errors=True)
+
+    def purge_stale(self, now=None):
+        """Eliminar las subidas sin actividad desde hace más de stale_after segundos. Devuelve cuántas"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return 0
+        now = now or time.time()
+        purged = 0
+        for upload_id in os.listdir(self.directory):
+            folder = os.path.join(self.directory, upload_id)
+            try:
+                last_activity = os.path.getmtime(os.path.join(folder, 'meta.json'))
+            except FileNotFoundError:
+                last_activity = os.path.getmtime(folder)
+            if now - last_activity > self.stale_after:
+                shutil.rmtree(folder, ignore_errors=True)
+                purged += 1
+        return purged
+
+
+chunked_uploads = ChunkedUploadStore()
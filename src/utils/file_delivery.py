@@ -0,0 +1,99 @@
+"""
+Envío de archivos subidos en las descargas.
+
+La aplicación autoriza la descarga y decide las cabeceras; los bytes pueden
+enviarse de dos formas (DOWNLOAD_OFFLOAD):
+- '' (por defecto): el worker envía el archivo con send_file, con soporte de
+  Range (206) y peticiones condicionales (304).
+- 'x-accel' (nginx) o 'x-sendfile' (Apache mod_xsendfile, lighttpd): la
+  respuesta no lleva cuerpo, solo la cabecera que indica al servidor web qué
+  archivo enviar, así que el worker de gunicorn queda libre al instante. Range,
+  ETag y 304 los resuelve el servidor web sobre el archivo en disco; de la
+  respuesta de la aplicación conserva Content-Type, Content-Disposition y
+  Cache-Control.
+
+Para nginx, la ubicación interna debe apuntar a UPLOAD_FOLDER:
+
+    location /protected-uploads/ {
+        internal;
+        alias /ruta/a/src/static/uploads/;
+    }
+
+Caché: los archivos privados o con contraseña se envían con
+'Cache-Control: private, no-cache' (nunca en cachés compartidas y siempre
+revalidados, porque el permiso puede cambiar); los públicos con
+'public, max-age=DOWNLOAD_CACHE_MAX_AGE'. Los archivos del almacén por
+contenido usan su SHA-256 como ETag, igual en todos los workers.
+"""
+
+import os
+from urllib.parse import quote
+
+from flask import current_app, request
+from werkzeug.utils import send_file
+
+OFFLOAD_MODES = ('', 'x-accel', 'x-sendfile')
+
+
+class FileDelivery:
+    def __init__(self, root=None, mode='', accel_prefix='/protected-uploads/', max_age=3600):
+        self.root = root
+        self.mode = mode
+        self.accel_prefix = accel_prefix
+        self.max_age = max_age
+
+    def init_app(self, app):
+        self.root = app.config['UPLOAD_FOLDER']
+        self.mode = app.config.get('DOWNLOAD_OFFLOAD', self.mode)
+        if self.mode not in OFFLOAD_MODES:
+            raise ValueError(f"DOWNLOAD_OFFLOAD no válido: {self.mode!r} (opciones: 'x-accel', 'x-sendfile' o vacío)")
+        self.accel_prefix = app.config.get('DOWNLOAD_ACCEL_PREFIX', self.accel_prefix).rstrip('/') + '/'
+        self.max_age = app.config.get('DOWNLOAD_CACHE_MAX_AGE', self.max_age)
+
+    def resolve(self, file_path):
+        """Ruta absoluta de un archivo relativo a UPLOAD_FOLDER, o None si no existe o sale de la carpeta"""
+        if not file_path:
+            return None
+        root = os.path.abspath(self.root)
+        path = os.path.normpath(os.path.join(root, file_path.replace('\\', '/')))
+        try:
+            inside = os.path.commonpath([root, path]) == root
+        except ValueError:
+            inside = False  # Otra unidad en Windows
+        if not inside or not os.path.isfile(path):
+            return None
+        return path
+
+    def send(self, path, download_name=None, private=True, etag=None):
+        """
+        Respuesta de descarga (adjunto) del archivo en 'path' (ruta absoluta dentro
+        de UPLOAD_FOLDER, ver resolve()). etag: valor fijo para el ETag (por
+        ejemplo el SHA-256 del contenido); por defecto, el de Werkzeug.
+        """
+        offload = bool(self.mode)
+        response = send_file(
+            path,
+            request.environ,
+            as_attachment=True,
+            download_name=download_name or os.path.basename(path),
+            # Con offload el servidor web resuelve Range y las condicionales sobre el archivo
+            conditional=not offload,
+            etag=False if offload else (etag or True),
+            max_age=None if private else self.max_age,
+            use_x_sendfile=offload,
+            response_class=current_app.response_class
+        )
+
+        if self.mode == 'x-accel':
+            del response.headers['X-Sendfile']
+            relative_path = os.path.relpath(path, os.path.abspath(self.root)).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = self.accel_prefix + quote(relative_path)
+
+        if private:
+            response.cache_control.public = False
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+        return response
+
+
+file_delivery = FileDelivery()
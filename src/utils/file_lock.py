@@ -0,0 +1,41 @@
+"""
+Locks exclusivos entre procesos sobre un archivo abierto (fcntl en POSIX,
+msvcrt en Windows). El lock se libera al cerrar el archivo o al terminar el
+proceso, así que un worker que muere nunca lo deja tomado.
+"""
+
+import os
+import time
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+def lock_file(file, blocking=True):
+    """Tomar el lock exclusivo de 'file'. Con blocking=False devuelve False si lo tiene otro proceso"""
+    if os.name == 'nt':
+        file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.05)
+
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        return True
+    except BlockingIOError:
+        return False
+
+
+def unlock_file(file):
+    if os.name == 'nt':
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,121 @@
+"""
+Tareas de mantenimiento periódicas.
+
+Cada tarea se expone como comando de Flask (flask --app src.main <comando>),
+que es la forma recomendada de ejecutarlas (cron, systemd timers...).
+
+Opcionalmente (MAINTENANCE_BACKGROUND=1) se ejecutan en segundo plano cada
+cierto intervalo, en hilos daemon de un único proceso: el que consigue el lock
+de MAINTENANCE_LOCK_PATH. Si ese proceso termina, el lock se libera y lo toma
+el siguiente que arranque.
+"""
+
+import os
+import threading
+import time
+
+from flask import current_app
+
+from src.models.qr_token import QrToken
+from src.utils.qr_jobs import qr_render_queue
+from src.utils.chunked_uploads import chunked_uploads
+from src.utils.blob_store import blob_store
+from src.utils.uploads import purge_stale_temp_files
+from src.utils.storage_usage import reconcile_storage
+from src.utils.file_lock import lock_file
+
+# Segundos entre la carga de la aplicación y la primera ejecución en segundo plano
+INITIAL_DELAY = 60
+
+# Archivo con el lock del proceso que ejecuta las tareas en segundo plano (abierto mientras viva)
+_scheduler_lock = None
+
+
+def purge_qr_tokens():
+    """Eliminar tokens QR usados o expirados"""
+    deleted = QrToken.purge_invalid()
+    print(f"[MAINTENANCE] Tokens QR eliminados: {deleted}")
+    return deleted
+
+
+def purge_qr_jobs():
+    """Eliminar trabajos de pre-render de QR terminados o fallidos"""
+    deleted = qr_render_queue.purge_finished()
+    print(f"[MAINTENANCE] Trabajos de QR eliminados: {deleted}")
+    return deleted
+
+
+def purge_stale_uploads():
+    """Eliminar subidas por partes abandonadas (.chunked) y temporales de subidas interrumpidas (staging de blobs)"""
+    purged = chunked_uploads.purge_stale()
+    purged += purge_stale_temp_files(blob_store.staging_folder, chunked_uploads.stale_after)
+    print(f"[MAINTENANCE] Subidas abandonadas eliminadas: {purged}")
+    return purged
+
+
+def reconcile_storage_usage():
+    """Recalcular desde el disco el uso de almacenamiento por dispositivo y marca"""
+    summary = reconcile_storage(current_app.config['UPLOAD_FOLDER'])
+    print(f"[MAINTENANCE] Uso de almacenamiento recalculado: {summary}")
+    return summary
+
+
+# (nombre del comando, función, clave de configuración con el intervalo en segundos, intervalo por defecto)
+TASKS = [
+    ('purge-qr-tokens', purge_qr_tokens, 'QR_TOKEN_PURGE_INTERVAL', 6 * 3600),
+    ('purge-qr-jobs', purge_qr_jobs, 'QR_JOB_PURGE_INTERVAL', 6 * 3600),
+    ('purge-stale-uploads', purge_stale_uploads, 'UPLOAD_PURGE_INTERVAL', 3600),
+    # Solo a mano por defecto: recorre todos los archivos y bloquea las subidas mientras recuenta
+    ('reconcile-storage', reconcile_storage_usage, 'STORAGE_RECONCILE_INTERVAL', 0),
+]
+
+
+def register_maintenance(app):
+    """Registrar los comandos de mantenimiento y, si se pidió, arrancar las tareas periódicas"""
+    for name, task, interval_key, default_interval in TASKS:
+        app.cli.command(name, help=task.__doc__)(make_command(app, task))
+
+    if not app.config.get('MAINTENANCE_BACKGROUND') or not acquire_scheduler_lock(app):
+        return
+    print(f"[MAINTENANCE] Tareas en segundo plano en el proceso {os.getpid()}")
+    for name, task, interval_key, default_interval in TASKS:
+        interval = app.config.get(interval_key, default_interval)
+        if interval:
+            thread = threading.Thread(
+                target=run_periodically, args=(app, task, interval),
+                name=f"maintenance-{name}", daemon=True
+            )
+            thread.start()
+
+
+def acquire_scheduler_lock(app):
+    """¿Es este el proceso que ejecuta las tareas en segundo plano? (el primero que toma el lock)"""
+    global _scheduler_lock
+    if _scheduler_lock is not None:
+        return True
+    lock_path = app.config['MAINTENANCE_LOCK_PATH']
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    lock = open(lock_path, 'a+b')
+    if not lock_file(lock, blocking=False):
+        lock.close()
+        return False
+    _scheduler_lock = lock
+    return True
+
+
+def make_command(app, task):
+    def command():
+        with app.app_context():
+            task()
+    return command
+
+
+def run_periodically(app, task, interval):
+    time.sleep(INITIAL_DELAY)
+    while True:
+        try:
+            with app.app_context():
+                task()
+        except Exception as e:
+            print(f"[MAINTENANCE] Error en {task.__name__}: {e}")
+        time.sleep(interval)
@@ -1,5 +1,87 @@
 import sqlite3
 import os
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex
+from src.models.user import db
+from src.models.device import generate_short_code
+from src.models.device_doc import DeviceDoc
+from src.utils.public_cache import public_device_cache
+
+
+def backfill_device_doc_lookup_keys(cursor):
+    """
+    Rellena 'lookup_key' en las filas de 'device_doc'.
+    Las filas que normalizan a la misma clave se fusionan en la de menor id (la
+    que ya devolvía .first()): sus campos *_doc vacíos se completan con los de
+    las demás, que se eliminan. Si dos filas tienen valores distintos en un campo
+    se conserva el de la fila que se mostraba y se informa del descartado.
+    Devuelve cuántas filas se fusionaron.
+    """
+    doc_fields = DeviceDoc.SUMMARY_FIELDS
+    cursor.execute("PRAGMA table_info(device_doc)")
+    has_updated_at = 'updated_at' in [column[1] for column in cursor.fetchall()]
+    cursor.execute(
+        f"SELECT id, marca, nombre_catalogo, modelo_comercial, modelo_tecnico, {', '.join(doc_fields)} "
+        "FROM device_doc ORDER BY id"
+    )
+    rows_by_key = {}
+    for row in cursor.fetchall():
+        lookup_key = DeviceDoc.build_lookup_key(*row[1:5])
+        rows_by_key.setdefault(lookup_key, []).append((row[0], dict(zip(doc_fields, row[5:]))))
+
+    merged_rows = 0
+    for lookup_key, rows in rows_by_key.items():
+        kept_id, values = rows[0]
+        for doc_id, duplicate_values in rows[1:]:
+            for field, value in duplicate_values.items():
+                if value is None or not str(value).strip():
+                    continue
+                if values[field] is None or not str(values[field]).strip():
+                    values[field] = value
+                elif values[field] != value:
+                    print(f"[MIGRATION] device_doc id={doc_id}: se descarta {field}={value!r} "
+                          f"(id={kept_id} conserva {values[field]!r}).")
+            # Primero se elimina el duplicado: puede tener la clave que recibirá la fila conservada
+            cursor.execute("DELETE FROM device_doc WHERE id = ?", (doc_id,))
+            print(f"[MIGRATION] device_doc id={doc_id} duplica la clave de id={kept_id}; fusionado y eliminado.")
+            merged_rows += 1
+
+        assignments = ', '.join(f"{field} = ?" for field in doc_fields)
+        if has_updated_at and len(rows) > 1:
+            assignments += ", updated_at = CURRENT_TIMESTAMP"  # Cambia el ETag de las APIs públicas
+        cursor.execute(
+            f"UPDATE device_doc SET lookup_key = ?, {assignments} WHERE id = ?",
+            (lookup_key, *(values[field] for field in doc_fields), kept_id)
+        )
+    return merged_rows
+
+def create_missing_indexes(cursor):
+    """
+    Crea en una base de datos existente los índices declarados en los modelos
+    (db.create_all() no los añade a tablas que ya existen).
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing_indexes = {row[0] for row in cursor.fetchall()}
+    for table in db.metadata.sorted_tables:
+        cursor.execute(f"PRAGMA table_info({table.name})")
+        table_columns = {column[1] for column in cursor.fetchall()}
+        if not table_columns:
+            continue
+        for index in table.indexes:
+            if index.name in existing_indexes or not {column.name for column in index.columns} <= table_columns:
+                continue
+            print(f"[MIGRATION] Creando índice '{index.name}' en '{table.name}'...")
+            cursor.execute(str(CreateIndex(index, if_not_exists=True).compile(dialect=sqlite.dialect())))
+
+def has_unique_index(cursor, table, column):
+    """Indica si la columna ya tiene un índice único propio (de la restricción UNIQUE o creado aparte)"""
+    cursor.execute(f"PRAGMA index_list({table})")
+    for index in cursor.fetchall():
+        index_name, is_unique = index[1], index[2]
+        cursor.execute(f"PRAGMA index_info({index_name})")
+        if is_unique and [info[2] for info in cursor.fetchall()] == [column]:
+            return True
+    return False
 
 def run_migrations(app):
     """
@@ -31,6 +113,23 @@ def run_migrations(app):
             cursor.execute("ALTER TABLE device_file ADD COLUMN requires_password BOOLEAN DEFAULT 0")
             conn.commit()
             print("[MIGRATION] Columna 'requires_password' añadida con éxito.")
+
+        # --- Migración: Añadir 'sha256' a 'device_file' ---
+        if columns and 'sha256' not in columns:
+            print("[MIGRATION] Añadiendo columna 'sha256' a 'device_file'...")
+            cursor.execute("ALTER TABLE device_file ADD COLUMN sha256 VARCHAR(64)")
+            conn.commit()
+            print("[MIGRATION] Columna 'sha256' añadida con éxito.")
+        
+        # --- Migración: rutas del almacén por contenido guardadas con '\' (Windows) ---
+        if columns:
+            cursor.execute(
+                "UPDATE device_file SET file_path = REPLACE(file_path, '\\', '/') "
+                "WHERE file_path LIKE 'blobs\\%' ESCAPE '|'"
+            )
+            if cursor.rowcount:
+                print(f"[MIGRATION] Normalizadas {cursor.rowcount} rutas de 'blobs' a separador '/'.")
+            conn.commit()
         
         # --- Migración: Añadir 'fabricante' a 'device' (si no existe) ---
         cursor.execute("PRAGMA table_info(device)")
@@ -41,6 +140,66 @@ def run_migrations(app):
             conn.commit()
             print("[MIGRATION] Columna 'fabricante' añadida con éxito.")
 
+        # --- Migración: clave normalizada 'lookup_key' en 'device_doc' ---
+        cursor.execute("PRAGMA table_info(device_doc)")
+        doc_columns = [column[1] for column in cursor.fetchall()]
+        if doc_columns and 'lookup_key' not in doc_columns:
+            print("[MIGRATION] Añadiendo columna 'lookup_key' a 'device_doc'...")
+            cursor.execute("ALTER TABLE device_doc ADD COLUMN lookup_key VARCHAR(1100)")
+            merged_docs = backfill_device_doc_lookup_keys(cursor)
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_device_doc_lookup_key ON device_doc (lookup_key)")
+            conn.commit()
+            if merged_docs:
+                public_device_cache.clear()
+            print("[MIGRATION] Columna 'lookup_key' añadida e indexada con éxito.")
+        elif doc_columns:
+            # Bases migradas cuando los duplicados se dejaban sin clave (inalcanzables): se fusionan ahora
+            cursor.execute("SELECT COUNT(*) FROM device_doc WHERE lookup_key IS NULL")
+            if cursor.fetchone()[0]:
+                print("[MIGRATION] Rellenando 'lookup_key' de 'device_doc' en las filas sin clave...")
+                merged_docs = backfill_device_doc_lookup_keys(cursor)
+                conn.commit()
+                if merged_docs:
+                    public_device_cache.clear()
+                print("[MIGRATION] 'lookup_key' completada con éxito.")
+
+        # --- Migración: Añadir 'updated_at' a 'device_doc' ---
+        if doc_columns and 'updated_at' not in doc_columns:
+            print("[MIGRATION] Añadiendo columna 'updated_at' a 'device_doc'...")
+            cursor.execute("ALTER TABLE device_doc ADD COLUMN updated_at DATETIME")
+            cursor.execute("UPDATE device_doc SET updated_at = CURRENT_TIMESTAMP")
+            conn.commit()
+            print("[MIGRATION] Columna 'updated_at' añadida con éxito.")
+
+        # --- Migración: código corto 'short_code' en 'device' ---
+        if device_columns and 'short_code' not in device_columns:
+            print("[MIGRATION] Añadiendo columna 'short_code' a 'device'...")
+            cursor.execute("ALTER TABLE device ADD COLUMN short_code VARCHAR(16)")
+            cursor.execute("SELECT id FROM device")
+            for (device_id,) in cursor.fetchall():
+                cursor.execute("UPDATE device SET short_code = ? WHERE id = ?", (generate_short_code(), device_id))
+            conn.commit()
+            print("[MIGRATION] Columna 'short_code' añadida con éxito.")
+
+        # --- Migración: uso de almacenamiento 'storage_bytes' en 'device' (se calcula al iniciar, ver utils/storage_usage.py) ---
+        if device_columns and 'storage_bytes' not in device_columns:
+            print("[MIGRATION] Añadiendo columna 'storage_bytes' a 'device'...")
+            cursor.execute("ALTER TABLE device ADD COLUMN storage_bytes BIGINT NOT NULL DEFAULT 0")
+            conn.commit()
+            print("[MIGRATION] Columna 'storage_bytes' añadida con éxito.")
+
+        # --- Migración: índice único de 'device.uuid' (la columna se añadió sin la restricción) ---
+        if 'uuid' in device_columns and not has_unique_index(cursor, 'device', 'uuid'):
+            print("[MIGRATION] Creando índice único 'ix_device_uuid' en 'device'...")
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_device_uuid ON device (uuid)")
+            conn.commit()
+
+        # --- Migración: índices de los filtros más usados ---
+        create_missing_indexes(cursor)
+        # 'ix_qr_token_brand_lookup' (brand_name, ...) reemplaza al índice simple de brand_name
+        cursor.execute("DROP INDEX IF EXISTS ix_qr_token_brand_name")
+        conn.commit()
+
         conn.close()
     except Exception as e:
         print(f"[MIGRATION] Error durante la migración automática: {e}")
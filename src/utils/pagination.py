@@ -0,0 +1,52 @@
+"""
+Utilidades de paginación por cursor (keyset) para los listados de la API.
+"""
+
+import base64
+import json
+from datetime import date
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200  # Tope duro: el cliente nunca puede pedir más filas por página
+
+
+class InvalidCursor(ValueError):
+    """Cursor mal formado o que no corresponde al orden solicitado"""
+
+
+def parse_limit(raw_limit, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Interpretar el parámetro `limit` aplicando el tope del servidor"""
+    if raw_limit in (None, ''):
+        return default
+    try:
+        limit = int(raw_limit)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(order, value, row_id):
+    """Serializar la posición (valor de orden, id) en un token opaco"""
+    if isinstance(value, date):
+        value = value.isoformat()
+    payload = json.dumps([order, value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, order):
+    """Recuperar (valor de orden, id) desde un token generado por encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_order, value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise InvalidCursor('Cursor inválido')
+    if cursor_order != order or not isinstance(row_id, int):
+        raise InvalidCursor('Cursor inválido')
+    return value, row_id
+
+
+def keyset_filter(column, id_column, value, row_id):
+    """Condición WHERE para continuar después de la fila (value, row_id)"""
+    return or_(column > value, and_(column == value, id_column > row_id))
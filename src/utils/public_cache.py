@@ -0,0 +1,174 @@
+"""
+Caché del JSON público ya renderizado de cada dispositivo.
+
+Dos niveles:
+- Memoria (LRU por worker) para servir los escaneos sin tocar el ORM.
+- SQLite en disco compartido por todos los workers de gunicorn.
+
+Cada invalidación incrementa un contador de generación en SQLite. Los workers
+comparan ese contador antes de usar su memoria y la vacían si cambió, de modo
+que una invalidación hecha en un worker se ve en todos. Las escrituras solo se
+aceptan si la generación no cambió desde que se leyeron los datos, evitando
+guardar un JSON calculado antes de una modificación.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+# Versión del esquema de la caché; si cambia, las tablas se recrean (solo contienen datos derivados)
+CACHE_SCHEMA_VERSION = 2
+
+# Respuesta cacheada: cuerpo JSON y sus validadores HTTP (ETag / Last-Modified)
+CachedResponse = namedtuple('CachedResponse', ['payload', 'etag', 'last_modified'])
+
+
+class PublicDeviceCache:
+    def __init__(self, path=None, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._memory_generation = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app):
+        """Configurar la ruta de la base de datos de caché y crear sus tablas"""
+        self.path = app.config['PUBLIC_CACHE_PATH']
+        self.max_entries = app.config.get('PUBLIC_CACHE_MAX_ENTRIES', self.max_entries)
+        # Conexión temporal: las de trabajo se abren por hilo tras el fork de gunicorn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != CACHE_SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS public_device_cache")
+            conn.execute("DROP TABLE IF EXISTS cache_meta")
+            conn.execute(f"PRAGMA user_version = {CACHE_SCHEMA_VERSION}")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS public_device_cache (
+                cache_key TEXT PRIMARY KEY,
+                payload BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO cache_meta (key, value) VALUES ('generation', 0)")
+        conn.close()
+
+    def _connection(self):
+        # sqlite3 no permite compartir conexiones entre hilos: una por hilo
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _generation(self, conn):
+        row = conn.execute("SELECT value FROM cache_meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def _remember(self, key, entry, generation):
+        with self._lock:
+            if generation != self._memory_generation:
+                self._memory.clear()
+                self._memory_generation = generation
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        Devuelve (entry, generation). entry es un CachedResponse o None si no está
+        en caché; generation debe pasarse a set() al guardar el valor recalculado.
+        """
+        try:
+            conn = self._connection()
+            generation = self._generation(conn)
+
+            with self._lock:
+                if generation != self._memory_generation:
+                    self._memory.clear()
+                    self._memory_generation = generation
+                entry = self._memory.get(key)
+                if entry is not None:
+                    self._memory.move_to_end(key)
+                    return entry, generation
+
+            row = conn.execute(
+                "SELECT payload, etag, last_modified FROM public_device_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row:
+                entry = CachedResponse(
+                    bytes(row[0]),
+                    row[1],
+                    datetime.fromisoformat(row[2]) if row[2] else None
+                )
+                self._remember(key, entry, generation)
+                return entry, generation
+            return None, generation
+        except sqlite3.Error as e:
+            print(f"[PUBLIC CACHE] Error leyendo la caché: {e}")
+            return None, None
+
+    def set(self, key, entry, generation):
+        """Guardar el CachedResponse si nadie invalidó la caché desde get()"""
+        if generation is None:
+            return
+        try:
+            cursor = self._connection().execute(
+                """
+                INSERT OR REPLACE INTO public_device_cache (cache_key, payload, etag, last_modified, created_at)
+                SELECT ?, ?, ?, ?, ? WHERE (SELECT value FROM cache_meta WHERE key = 'generation') = ?
+                """,
+                (
+                    key,
+                    entry.payload,
+                    entry.etag,
+                    entry.last_modified.isoformat() if entry.last_modified else None,
+                    time.time(),
+                    generation
+                )
+            )
+            if cursor.rowcount:
+                self._remember(key, entry, generation)
+        except sqlite3.Error as e:
+            print(f"[PUBLIC CACHE] Error guardando en la caché: {e}")
+
+    def invalidate(self, *keys):
+        """Eliminar las claves indicadas en todos los workers"""
+        self._bump(keys)
+
+    def clear(self):
+        """Vaciar la caché completa en todos los workers"""
+        self._bump(None)
+
+    def _bump(self, keys):
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if keys is None:
+                    conn.execute("DELETE FROM public_device_cache")
+                else:
+                    conn.executemany(
+                        "DELETE FROM public_device_cache WHERE cache_key = ?", [(key,) for key in keys]
+                    )
+                conn.execute("UPDATE cache_meta SET value = value + 1 WHERE key = 'generation'")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            print(f"[PUBLIC CACHE] Error invalidando la caché: {e}")
+        finally:
+            with self._lock:
+                self._memory.clear()
+                self._memory_generation = None
+
+
+public_device_cache = PublicDeviceCache()
+
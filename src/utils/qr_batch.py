@@ -0,0 +1,97 @@
+"""
+Render de muchos códigos QR a la vez (ZIP y hoja de etiquetas por marca).
+
+Los QR que no están en qr_render_cache se reparten en un pool de procesos.
+Los resultados se entregan por lotes y en orden, de modo que la respuesta puede
+ir enviándose al cliente sin tener todas las imágenes en memoria.
+
+El pool es pequeño (QR_RENDER_PROCESSES, 2 por defecto, por cada worker de
+gunicorn) y sus procesos se arrancan con 'spawn': un fork de un worker que ya
+tiene hilos (cola de pre-render, mantenimiento) puede heredar un lock tomado y
+bloquearse. Se cierra al terminar el worker.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from src.utils.qr_cache import qr_render_cache, render_qr
+
+# QR consultados en la caché y enviados al pool de una vez
+BATCH_SIZE = 64
+# Con menos QR pendientes que esto no compensa enviarlos a otros procesos
+MIN_POOL_RENDERS = 8
+
+
+class QrBatchRenderer:
+    def __init__(self, processes=None):
+        self.processes = processes
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Número de procesos del pool (QR_RENDER_PROCESSES; 1 = renderizar en el propio worker)"""
+        self.processes = max(1, app.config.get('QR_RENDER_PROCESSES') or 2)
+
+    def _executor(self):
+        # El pool se crea en el proceso que lo usa (cada worker de gunicorn tiene el suyo)
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def shutdown(self):
+        """Cerrar el pool de este proceso (se llama al salir)"""
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _reset(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _render_missing(self, payloads, options):
+        render = partial(render_qr, **options)
+        if len(payloads) < MIN_POOL_RENDERS or self.processes == 1:
+            return [render(payload) for payload in payloads]
+        try:
+            chunksize = max(1, len(payloads) // (self.processes * 2))
+            return list(self._executor().map(render, payloads, chunksize=chunksize))
+        except BrokenProcessPool as e:
+            print(f"[QR BATCH] Pool de procesos caído, se renderiza en este proceso: {e}")
+            self._reset()
+            return [render(payload) for payload in payloads]
+
+    def render(self, payloads, **options):
+        """
+        Generador de (payload, bytes) en el mismo orden que `payloads`.
+        `options` son los argumentos de render_qr (error_correction, box_size, border, image_format).
+        """
+        payloads = list(payloads)
+        for start in range(0, len(payloads), BATCH_SIZE):
+            batch = payloads[start:start + BATCH_SIZE]
+            images = {payload: qr_render_cache.get(payload, **options) for payload in batch}
+
+            missing = [payload for payload, data in images.items() if data is None]
+            if missing:
+                for payload, data in zip(missing, self._render_missing(missing, options)):
+                    qr_render_cache.set(payload, data, **options)
+                    images[payload] = data
+
+            for payload in batch:
+                yield payload, images[payload]
+
+
+qr_batch_renderer = QrBatchRenderer()
+atexit.register(qr_batch_renderer.shutdown)
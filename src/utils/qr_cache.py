@@ -0,0 +1,270 @@
+"""
+Caché de imágenes QR ya renderizadas, direccionada por contenido.
+
+La clave es un hash de (contenido, corrección de errores, box_size, border,
+formato): el mismo QR siempre produce los mismos bytes, así que no hace falta
+invalidar nada. Dos niveles:
+- Memoria (LRU acotado por worker).
+- Disco en QR_CACHE_FOLDER (por defecto src/database/qr_cache, fuera de la
+  carpeta estática), compartido por todos los workers de gunicorn. Acotado a
+  QR_CACHE_MAX_BYTES: cada lectura renueva el mtime del archivo y, cuando un
+  worker ha escrito un 5% del límite desde la última revisión, se eliminan los
+  menos usados hasta bajar al 90%.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import qrcode
+
+# Tipo MIME de cada formato soportado (el nombre del formato es también la extensión)
+QR_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml'
+}
+
+# Niveles de corrección de errores aceptados en ?ec=
+ERROR_CORRECTION_LEVELS = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H
+}
+# Límites de los parámetros de render (tamaño de módulo y zona de silencio, en módulos)
+MAX_BOX_SIZE = 40
+MAX_BORDER = 20
+
+
+def parse_render_options(args):
+    """
+    Leer ?size=, ?border= y ?ec= de la petición.
+    Devuelve los argumentos de render_qr / get_or_render; ValueError si no son válidos.
+    """
+    options = {}
+    for name, key, maximum in (('size', 'box_size', MAX_BOX_SIZE), ('border', 'border', MAX_BORDER)):
+        raw_value = args.get(name)
+        if raw_value is None:
+            continue
+        try:
+            value = int(raw_value)
+        except ValueError:
+            raise ValueError(f"'{name}' debe ser un entero")
+        minimum = 1 if key == 'box_size' else 0
+        if not minimum <= value <= maximum:
+            raise ValueError(f"'{name}' debe estar entre {minimum} y {maximum}")
+        options[key] = value
+
+    level = args.get('ec')
+    if level is not None:
+        if level.upper() not in ERROR_CORRECTION_LEVELS:
+            raise ValueError("'ec' debe ser L, M, Q o H")
+        options['error_correction'] = ERROR_CORRECTION_LEVELS[level.upper()]
+
+    return options
+
+
+def render_qr(payload, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4, image_format='png'):
+    """Renderizar el QR y devolver los bytes de la imagen"""
+    if image_format not in QR_FORMATS:
+        raise ValueError(f"Formato de QR no soportado: {image_format}")
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    if image_format == 'svg':
+        return render_svg_path(qr.modules, box_size, border)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format='PNG')
+    return img_buffer.getvalue()
+
+
+def render_svg_path(modules, box_size, border):
+    """
+    SVG vectorial sin PIL: un único <path> con una tira por cada racha horizontal
+    de módulos oscuros, en coordenadas enteras de módulo (viewBox) y escalado a
+    box_size píxeles por módulo.
+    """
+    segments = []
+    for y, row in enumerate(modules):
+        x = 0
+        width = len(row)
+        while x < width:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < width and row[x]:
+                x += 1
+            segments.append(f"M{start + border} {y + border}h{x - start}v1h-{x - start}z")
+
+    dimension = len(modules) + 2 * border
+    pixels = dimension * box_size
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {dimension} {dimension}" shape-rendering="crispEdges">'
+        f'<rect width="{dimension}" height="{dimension}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(segments)}"/></svg>'
+    ).encode('utf-8')
+
+
+# Fracción del límite escrita por un worker que dispara una revisión del tamaño, y nivel al que se poda
+PRUNE_EVERY = 0.05
+PRUNE_TARGET = 0.9
+
+
+class QrRenderCache:
+    def __init__(self, directory=None, max_entries=256, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._written = 0
+
+    def init_app(self, app):
+        """Configurar la carpeta en disco y los límites de ambos niveles"""
+        self.directory = app.config['QR_CACHE_FOLDER']
+        self.max_entries = app.config.get('QR_CACHE_MAX_ENTRIES', self.max_entries)
+        self.max_bytes = app.config.get('QR_CACHE_MAX_BYTES', self.max_bytes)
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Ubicación anterior, servida públicamente bajo /static/uploads
+        legacy_directory = os.path.join(app.config['UPLOAD_FOLDER'], 'qr_cache')
+        if os.path.isdir(legacy_directory) and os.path.abspath(legacy_directory) != os.path.abspath(self.directory):
+            print(f"[QR CACHE] Eliminando la caché anterior en {legacy_directory}")
+            shutil.rmtree(legacy_directory, ignore_errors=True)
+
+    @staticmethod
+    def cache_key(payload, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4, image_format='png'):
+        """Clave de la caché (y ETag de la imagen) para estos parámetros de render"""
+        raw = '\x1f'.join(str(part) for part in (payload, error_correction, box_size, border, image_format))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key, image_format):
+        # Subcarpetas por prefijo para no acumular miles de archivos en un directorio
+        return os.path.join(self.directory, key[:2], f"{key}.{image_format}")
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, payload, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4, image_format='png'):
+        """Bytes de la imagen QR si ya está en memoria o en disco; None si hay que renderizarla"""
+        key = self.cache_key(payload, error_correction, box_size, border, image_format)
+
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+
+        if not self.directory:
+            return None
+        path = self._path(key, image_format)
+        try:
+            with open(path, 'rb') as cached_file:
+                data = cached_file.read()
+            os.utime(path)  # Uso reciente: la poda elimina primero los de mtime más antiguo
+            self._remember(key, data)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"[QR CACHE] Error leyendo {path}: {e}")
+            return None
+
+    def set(self, payload, data, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4, image_format='png'):
+        """Guardar una imagen ya renderizada en ambos niveles"""
+        key = self.cache_key(payload, error_correction, box_size, border, image_format)
+        self._remember(key, data)
+        if self.directory:
+            self._write(self._path(key, image_format), data)
+            self._written += len(data)
+            if self.max_bytes and self._written >= self.max_bytes * PRUNE_EVERY:
+                self.prune()
+
+    def get_or_render(self, payload, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4, image_format='png'):
+        """Bytes de la imagen QR: memoria, luego disco y, si no está, se renderiza y se guarda"""
+        data = self.get(payload, error_correction, box_size, border, image_format)
+        if data is None:
+            data = render_qr(payload, error_correction, box_size, border, image_format)
+            self.set(payload, data, error_correction, box_size, border, image_format)
+        return data
+
+    def prune(self):
+        """
+        Eliminar los archivos menos usados si la carpeta supera max_bytes.
+        Devuelve cuántos se eliminaron.
+        """
+        if not self._prune_lock.acquire(blocking=False):
+            return 0  # Otro hilo de este worker ya está podando
+        try:
+            self._written = 0
+            entries = []
+            total = 0
+            for folder, _, filenames in os.walk(self.directory):
+                for filename in filenames:
+                    path = os.path.join(folder, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return 0
+
+            removed = 0
+            target = self.max_bytes * PRUNE_TARGET
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass  # Ya la eliminó otro worker
+                except OSError as e:
+                    print(f"[QR CACHE] No se pudo eliminar {path}: {e}")
+                    continue
+                total -= size
+            print(f"[QR CACHE] Poda: {removed} imágenes eliminadas ({total} bytes en disco)")
+            return removed
+        finally:
+            self._prune_lock.release()
+
+    def _write(self, path, data):
+        # Escritura atómica: otro worker nunca ve un archivo a medio escribir
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    temp_file.write(data)
+                os.replace(temp_path, path)
+            except Exception:
+                os.unlink(temp_path)
+                raise
+        except OSError as e:
+            print(f"[QR CACHE] Error guardando {path}: {e}")
+
+
+qr_render_cache = QrRenderCache()
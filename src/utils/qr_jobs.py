@@ -0,0 +1,133 @@
+"""
+Cola en segundo plano para pre-renderizar los QR (PNG y SVG) de dispositivos y marcas.
+
+Los trabajos se guardan en la tabla 'qr_render_job' y se ejecutan en un pool de
+hilos dentro del propio proceso, sin broker externo. Al arrancar, cada proceso
+retoma los trabajos pendientes; un trabajo se reclama con un UPDATE condicional,
+así que aunque varios workers de gunicorn lo vean solo uno lo ejecuta.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+from src.models.user import db
+from src.models.qr_render_job import QrRenderJob
+from src.utils.qr_cache import qr_render_cache, QR_FORMATS
+from src.utils.qr_urls import device_public_url, brand_qr_url
+
+MAX_ATTEMPTS = 3
+# Un trabajo 'running' sin cambios en este tiempo se considera abandonado (worker reiniciado)
+STALE_AFTER = timedelta(minutes=10)
+# Antigüedad a partir de la cual se eliminan los trabajos terminados y los fallidos
+# (estos se conservan más tiempo para poder revisar el error)
+FINISHED_RETENTION = timedelta(days=1)
+FAILED_RETENTION = timedelta(days=7)
+
+
+class QrRenderQueue:
+    def __init__(self, threads=2):
+        self.app = None
+        self.threads = threads
+        self.enabled = True
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.threads = app.config.get('QR_JOB_THREADS', self.threads)
+        self.enabled = app.config.get('QR_PRERENDER', True)
+
+    def _pool(self):
+        # Los hilos no sobreviven a un fork: cada proceso crea su propio pool
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='qr-render')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def enqueue_device(self, device):
+        """Pre-renderizar el QR de un dispositivo (llamar con una petición activa, tras el commit)"""
+        self._enqueue('device', str(device.id), lambda: device_public_url(device.uuid, device.short_code))
+
+    def enqueue_brand(self, brand_name):
+        """Pre-renderizar el QR con token de una marca (llamar con una petición activa, tras el commit)"""
+        self._enqueue('brand', brand_name, lambda: brand_qr_url(brand_name)[2])
+
+    def _enqueue(self, kind, target, build_payload):
+        if not self.enabled:
+            return
+        # Un fallo de la cola nunca debe hacer fallar la petición que la usa
+        try:
+            job = QrRenderJob(kind=kind, target=target, payload=build_payload())
+            db.session.add(job)
+            db.session.commit()
+            self._pool().submit(self._run, job.id)
+        except Exception as e:
+            db.session.rollback()
+            print(f"[QR JOBS] No se pudo encolar el QR de {kind} '{target}': {e}")
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            claimed = QrRenderJob.query.filter_by(id=job_id, status='pending').update(
+                {'status': 'running', 'attempts': QrRenderJob.attempts + 1, 'updated_at': datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.session.commit()
+            if not claimed:
+                return
+
+            job = db.session.get(QrRenderJob, job_id)
+            try:
+                for image_format in QR_FORMATS:
+                    qr_render_cache.get_or_render(job.payload, image_format=image_format)
+                job.status = 'done'
+                job.error = None
+            except Exception as e:
+                job.status = 'pending' if job.attempts < MAX_ATTEMPTS else 'failed'
+                job.error = str(e)
+                print(f"[QR JOBS] Error renderizando el QR de {job.kind} '{job.target}' (intento {job.attempts}): {e}")
+            db.session.commit()
+
+            if job.status == 'pending':
+                self._pool().submit(self._run, job_id)
+
+    def resume_pending(self):
+        """Reencolar los trabajos pendientes o abandonados (al iniciar la aplicación)"""
+        if not self.enabled:
+            return
+        try:
+            QrRenderJob.query.filter(
+                QrRenderJob.status == 'running',
+                QrRenderJob.updated_at < datetime.utcnow() - STALE_AFTER
+            ).update({'status': 'pending'}, synchronize_session=False)
+            db.session.commit()
+
+            pending_ids = [job_id for (job_id,) in db.session.query(QrRenderJob.id).filter_by(status='pending')]
+            for job_id in pending_ids:
+                self._pool().submit(self._run, job_id)
+            if pending_ids:
+                print(f"[QR JOBS] Reanudados {len(pending_ids)} trabajos pendientes.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"[QR JOBS] No se pudieron reanudar los trabajos pendientes: {e}")
+
+    def purge_finished(self):
+        """
+        Eliminar los trabajos terminados hace más de FINISHED_RETENTION y los
+        fallidos hace más de FAILED_RETENTION. Devuelve cuántos se eliminaron.
+        """
+        now = datetime.utcnow()
+        deleted = QrRenderJob.query.filter(or_(
+            and_(QrRenderJob.status == 'done', QrRenderJob.updated_at < now - FINISHED_RETENTION),
+            and_(QrRenderJob.status == 'failed', QrRenderJob.updated_at < now - FAILED_RETENTION)
+        )).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+
+qr_render_queue = QrRenderQueue()
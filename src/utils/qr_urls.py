@@ -0,0 +1,35 @@
+"""
+URLs que codifican los QR de dispositivos y marcas.
+Necesitan una petición activa: la URL base es la del host que atiende la petición.
+"""
+
+from urllib.parse import urljoin
+
+from flask import request
+
+from src.models.qr_token import QrToken
+from src.utils.signed_tokens import signed_qr_tokens
+
+
+def device_public_url(device_uuid, short_code=None):
+    """
+    URL pública codificada en el QR de un dispositivo: el enlace corto /d/<código>
+    (QR de menor versión) o, si el dispositivo aún no tiene código, la página por UUID.
+    """
+    if short_code:
+        return urljoin(request.url_root, f"d/{short_code}")
+    return urljoin(request.url_root, f"public_device.html?uid={device_uuid}")
+
+
+def brand_qr_url(brand_name):
+    """
+    Token vigente de la marca (o uno nuevo), el token que viaja en la URL (firmado
+    si QR_SIGNED_TOKENS está activo) y la URL de acceso directo que codifica el QR.
+    """
+    # Buscar el token vigente más reciente o crear uno nuevo
+    qr_token = QrToken.get_or_create_brand_token(brand_name)
+    access_token = signed_qr_tokens.sign(qr_token) if signed_qr_tokens.enabled else qr_token.token
+
+    # Generar URL con token
+    base_url = request.url_root
+    return qr_token, access_token, f"{base_url}index.html?brand={brand_name}&token={access_token}"
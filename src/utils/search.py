@@ -0,0 +1,138 @@
+"""
+Índice de búsqueda de texto completo sobre el catálogo de dispositivos.
+
+- SQLite: tabla virtual FTS5 'device_fts' de contenido externo sobre 'device',
+  sincronizada por triggers en INSERT/UPDATE/DELETE (UPDATE solo de las
+  columnas indexadas).
+- PostgreSQL: columna generada 'search_vector' (tsvector) con índice GIN,
+  que la propia base de datos mantiene al insertar o actualizar.
+- Otros motores (o SQLite sin FTS5): búsqueda LIKE sin índice.
+"""
+
+import re
+
+from sqlalchemy import text, table, column, literal_column, func, or_
+
+# Columnas indexadas y su peso relativo en el ranking (mismo orden en FTS5)
+SEARCH_COLUMNS = (
+    ('marca', 10.0),
+    ('nombre_catalogo', 8.0),
+    ('modelo_comercial', 5.0),
+    ('modelo_tecnico', 5.0),
+    ('frecuencias', 2.0),
+    ('comentarios', 1.0)
+)
+
+# Solo cuando cambia una columna indexada: las actualizaciones de storage_bytes o
+# updated_at (cada subida o borrado de archivo) no reescriben la fila del índice
+SQLITE_FTS_UPDATE_TRIGGER = """
+    CREATE TRIGGER device_fts_au AFTER UPDATE OF {columns} ON device BEGIN
+        INSERT INTO device_fts (device_fts, rowid, marca, nombre_catalogo, modelo_comercial, modelo_tecnico, frecuencias, comentarios)
+        VALUES ('delete', old.id, old.marca, old.nombre_catalogo, old.modelo_comercial, old.modelo_tecnico, old.frecuencias, old.comentarios);
+        INSERT INTO device_fts (rowid, marca, nombre_catalogo, modelo_comercial, modelo_tecnico, frecuencias, comentarios)
+        VALUES (new.id, new.marca, new.nombre_catalogo, new.modelo_comercial, new.modelo_tecnico, new.frecuencias, new.comentarios);
+    END
+""".format(columns=', '.join(name for name, _ in SEARCH_COLUMNS))
+
+SQLITE_FTS_STATEMENTS = [
+    """
+    CREATE VIRTUAL TABLE device_fts USING fts5(
+        marca, nombre_catalogo, modelo_comercial, modelo_tecnico, frecuencias, comentarios,
+        content='device', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER device_fts_ai AFTER INSERT ON device BEGIN
+        INSERT INTO device_fts (rowid, marca, nombre_catalogo, modelo_comercial, modelo_tecnico, frecuencias, comentarios)
+        VALUES (new.id, new.marca, new.nombre_catalogo, new.modelo_comercial, new.modelo_tecnico, new.frecuencias, new.comentarios);
+    END
+    """,
+    """
+    CREATE TRIGGER device_fts_ad AFTER DELETE ON device BEGIN
+        INSERT INTO device_fts (device_fts, rowid, marca, nombre_catalogo, modelo_comercial, modelo_tecnico, frecuencias, comentarios)
+        VALUES ('delete', old.id, old.marca, old.nombre_catalogo, old.modelo_comercial, old.modelo_tecnico, old.frecuencias, old.comentarios);
+    END
+    """,
+    SQLITE_FTS_UPDATE_TRIGGER,
+    # Indexar las filas existentes y fijar los pesos de bm25 como ranking por defecto
+    "INSERT INTO device_fts (device_fts) VALUES ('rebuild')",
+    "INSERT INTO device_fts (device_fts, rank) VALUES ('rank', 'bm25({weights})')".format(
+        weights=', '.join(str(weight) for _, weight in SEARCH_COLUMNS)
+    )
+]
+
+POSTGRES_FTS_STATEMENTS = [
+    """
+    ALTER TABLE device ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(marca, '') || ' ' || coalesce(nombre_catalogo, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(modelo_comercial, '') || ' ' || coalesce(modelo_tecnico, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(frecuencias, '')), 'C') ||
+        setweight(to_tsvector('simple', coalesce(comentarios, '')), 'D')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_device_search_vector ON device USING GIN (search_vector)"
+]
+
+device_fts = table('device_fts', column('rowid'), column('rank'))
+
+
+def setup_search_index(app, db):
+    """Crear (si no existe) el índice de texto completo según el motor de base de datos"""
+    dialect = db.engine.dialect.name
+    app.config['SEARCH_BACKEND'] = 'like'
+
+    try:
+        with db.engine.begin() as conn:
+            if dialect == 'sqlite':
+                exists = conn.execute(
+                    text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'device_fts'")
+                ).first()
+                if not exists:
+                    print("[SEARCH] Creando índice FTS5 'device_fts'...")
+                    for statement in SQLITE_FTS_STATEMENTS:
+                        conn.execute(text(statement))
+                else:
+                    update_trigger = conn.execute(
+                        text("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'device_fts_au'")
+                    ).scalar()
+                    if not update_trigger or 'UPDATE OF' not in update_trigger.upper():
+                        print("[SEARCH] Limitando el trigger 'device_fts_au' a las columnas indexadas...")
+                        conn.execute(text("DROP TRIGGER IF EXISTS device_fts_au"))
+                        conn.execute(text(SQLITE_FTS_UPDATE_TRIGGER))
+                app.config['SEARCH_BACKEND'] = 'fts5'
+            elif dialect == 'postgresql':
+                for statement in POSTGRES_FTS_STATEMENTS:
+                    conn.execute(text(statement))
+                app.config['SEARCH_BACKEND'] = 'postgres'
+    except Exception as e:
+        print(f"[SEARCH] No se pudo crear el índice de texto completo, se usará LIKE: {e}")
+
+
+def search_terms(raw_query):
+    """Palabras de la consulta del usuario (se descartan operadores y signos)"""
+    return re.findall(r'\w+', raw_query or '')
+
+
+def apply_search(query, model, backend, terms):
+    """
+    Filtrar y ordenar por relevancia una consulta de dispositivos.
+    Todas las palabras deben aparecer (AND); cada una coincide por prefijo.
+    """
+    if backend == 'fts5':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return query.join(device_fts, device_fts.c.rowid == model.id).filter(
+            text('device_fts MATCH :match').bindparams(match=match)
+        ).order_by(device_fts.c.rank, model.id)
+
+    if backend == 'postgres':
+        vector = literal_column('device.search_vector')
+        tsquery = func.to_tsquery('simple', ' & '.join(f'{term}:*' for term in terms))
+        return query.filter(vector.op('@@')(tsquery)).order_by(
+            func.ts_rank(vector, tsquery).desc(), model.id
+        )
+
+    # Sin índice: cada palabra debe aparecer en alguna de las columnas
+    for term in terms:
+        pattern = f'%{term}%'
+        query = query.filter(or_(*[getattr(model, name).ilike(pattern) for name, _ in SEARCH_COLUMNS]))
+    return query.order_by(model.marca, model.id)
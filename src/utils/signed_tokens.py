@@ -0,0 +1,131 @@
+"""
+Tokens QR de marca firmados (modo opcional, QR_SIGNED_TOKENS).
+
+El token lleva el id de la fila QrToken y su expiración, firmados con HMAC-SHA256
+sobre (marca, id, expiración) con la clave secreta de la aplicación:
+
+    s1.<id>.<expiración unix>.<firma base64url>
+
+Se verifica en tiempo constante y sin consultar la base de datos. Para poder
+revocar tokens, cada worker mantiene en memoria el conjunto de ids de tokens de
+marca vigentes, que se recarga desde 'qr_token' cada QR_TOKEN_REFRESH_INTERVAL
+segundos: un id que no está en el conjunto se considera revocado (usado,
+expirado o eliminado junto con la marca).
+"""
+
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from datetime import datetime, timezone
+
+from src.models.qr_token import QrToken
+from src.models.user import db
+
+SIGNED_TOKEN_PREFIX = 's1'
+
+
+def _signature(secret, brand_name, token_id, expires_ts):
+    message = f"{brand_name}\x1f{token_id}\x1f{expires_ts}".encode('utf-8')
+    digest = hmac.new(secret.encode('utf-8'), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def _expires_ts(expires_at):
+    # Las fechas de QrToken se guardan en UTC sin zona horaria
+    return int(expires_at.replace(tzinfo=timezone.utc).timestamp()) if expires_at else 0
+
+
+def is_signed_token(token):
+    return bool(token) and token.startswith(SIGNED_TOKEN_PREFIX + '.')
+
+
+class SignedTokenRegistry:
+    def __init__(self, secret=None, refresh_interval=60):
+        self.secret = secret
+        self.refresh_interval = refresh_interval
+        self.enabled = False
+        self._valid_ids = set()
+        self._revoked_ids = set()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.secret = app.config['SECRET_KEY']
+        self.enabled = app.config.get('QR_SIGNED_TOKENS', False)
+        self.refresh_interval = app.config.get('QR_TOKEN_REFRESH_INTERVAL', self.refresh_interval)
+
+    def sign(self, qr_token):
+        """Token firmado para una fila QrToken de marca"""
+        expires_ts = _expires_ts(qr_token.expires_at)
+        signature = _signature(self.secret, qr_token.brand_name, qr_token.id, expires_ts)
+        with self._lock:
+            self._valid_ids.add(qr_token.id)
+            self._revoked_ids.discard(qr_token.id)
+        return f"{SIGNED_TOKEN_PREFIX}.{qr_token.id}.{expires_ts}.{signature}"
+
+    def verify(self, token, brand_name):
+        """
+        Devuelve el id del QrToken si la firma es válida para la marca, no ha
+        expirado y no está revocado; None en caso contrario.
+        """
+        try:
+            prefix, token_id, expires_ts, signature = token.split('.')
+            token_id, expires_ts = int(token_id), int(expires_ts)
+        except (AttributeError, ValueError):
+            return None
+        if prefix != SIGNED_TOKEN_PREFIX or brand_name is None:
+            return None
+
+        expected = _signature(self.secret, brand_name, token_id, expires_ts)
+        if not hmac.compare_digest(expected.encode('ascii'), signature.encode('ascii')):
+            return None
+        if expires_ts and expires_ts <= time.time():
+            return None
+
+        return token_id if self._is_active(token_id) else None
+
+    def _is_active(self, token_id):
+        with self._lock:
+            stale = self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval
+        if stale:
+            self.refresh()
+
+        with self._lock:
+            if token_id in self._valid_ids:
+                return True
+            if token_id in self._revoked_ids:
+                return False
+
+        # Token emitido por otro worker después de la última recarga: se consulta una vez
+        active = db.session.query(QrToken.id).filter(
+            QrToken.id == token_id, *self._active_filters()
+        ).first() is not None
+        with self._lock:
+            (self._valid_ids if active else self._revoked_ids).add(token_id)
+        return active
+
+    @staticmethod
+    def _active_filters():
+        return (
+            QrToken.token_type == 'brand',
+            QrToken.used == False,
+            db.or_(QrToken.expires_at.is_(None), QrToken.expires_at > datetime.utcnow())
+        )
+
+    def refresh(self):
+        """Recargar desde la base de datos los ids de tokens de marca vigentes"""
+        valid_ids = {row.id for row in db.session.query(QrToken.id).filter(*self._active_filters())}
+        with self._lock:
+            self._valid_ids = valid_ids
+            self._revoked_ids = set()
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Forzar la recarga en la próxima verificación (tras revocar tokens en este worker)"""
+        with self._lock:
+            self._loaded_at = None
+
+
+signed_qr_tokens = SignedTokenRegistry()
@@ -0,0 +1,202 @@
+"""
+Uso de almacenamiento por dispositivo y por marca.
+
+Los agregados se mantienen en la misma transacción que los cambios que los
+afectan, con eventos del ORM:
+- DeviceFile insertado / eliminado (también en cascada): suma o resta su
+  file_size en device.storage_bytes y en brand_storage de su marca.
+- Device que cambia de marca (editar el dispositivo o renombrar la marca): sus
+  bytes y archivos pasan de una marca a la otra.
+Así la cuota de un dispositivo se comprueba leyendo una columna, sin cargar sus
+archivos. Cuenta un DeviceFile si tiene file_path (las URLs externas no ocupan
+espacio); el contenido compartido en el almacén por contenido cuenta en cada
+dispositivo que lo adjunta.
+
+reconcile_storage() recalcula todo desde el disco por si los agregados se
+desvían (archivos borrados a mano, cambios hechos fuera del ORM). Se ejecuta a
+mano (flask --app src.main reconcile-storage) y una vez al arrancar sobre bases
+de datos anteriores a brand_storage.
+"""
+
+import os
+from datetime import datetime
+
+from sqlalchemy import event, func, select, inspect, text
+
+from src.models.user import db
+from src.models.device import Device, DeviceFile
+from src.models.brand_storage import BrandStorage
+from src.models.file_blob import FileBlob
+from src.utils.blob_store import blob_store, BlobStore
+
+
+def counted_size(device_file):
+    """Bytes con los que cuenta un DeviceFile (None si no ocupa espacio)"""
+    if not device_file.file_path:
+        return None
+    return device_file.file_size or 0
+
+
+def add_brand_usage(connection, brand_name, size, files):
+    brands = BrandStorage.__table__
+    updated = connection.execute(
+        brands.update().where(brands.c.brand_name == brand_name).values(
+            storage_bytes=brands.c.storage_bytes + size,
+            file_count=brands.c.file_count + files,
+            updated_at=datetime.utcnow()
+        )
+    ).rowcount
+    if not updated:
+        connection.execute(brands.insert().values(
+            brand_name=brand_name, storage_bytes=size, file_count=files, updated_at=datetime.utcnow()
+        ))
+
+
+def add_device_usage(connection, device_id, size, files):
+    devices = Device.__table__
+    connection.execute(
+        devices.update().where(devices.c.id == device_id).values(storage_bytes=devices.c.storage_bytes + size)
+    )
+    brand_name = connection.execute(select(devices.c.marca).where(devices.c.id == device_id)).scalar()
+    if brand_name is not None:
+        add_brand_usage(connection, brand_name, size, files)
+
+
+@event.listens_for(DeviceFile, 'after_insert')
+def count_inserted_file(mapper, connection, device_file):
+    size = counted_size(device_file)
+    if size is not None:
+        add_device_usage(connection, device_file.device_id, size, 1)
+
+
+@event.listens_for(DeviceFile, 'after_delete')
+def count_deleted_file(mapper, connection, device_file):
+    size = counted_size(device_file)
+    if size is not None:
+        add_device_usage(connection, device_file.device_id, -size, -1)
+
+
+@event.listens_for(Device, 'after_update')
+def move_brand_usage(mapper, connection, device):
+    history = inspect(device).attrs.marca.history
+    if not history.deleted or not history.added or history.deleted[0] == history.added[0]:
+        return
+    files = DeviceFile.__table__
+    size, count = connection.execute(
+        select(func.coalesce(func.sum(files.c.file_size), 0), func.count(files.c.id))
+        .where(files.c.device_id == device.id, files.c.file_path.isnot(None))
+    ).one()
+    if count:
+        add_brand_usage(connection, history.deleted[0], -size, -count)
+        add_brand_usage(connection, history.added[0], size, count)
+
+
+def brand_usage():
+    """Uso por marca, de mayor a menor"""
+    return [
+        brand.to_dict() for brand in
+        BrandStorage.query.filter(BrandStorage.file_count > 0)
+        .order_by(BrandStorage.storage_bytes.desc(), BrandStorage.brand_name)
+    ]
+
+
+def device_usage(brand_name, limit=100):
+    """Dispositivos de una marca que más espacio ocupan"""
+    rows = db.session.query(Device.id, Device.nombre_catalogo, Device.storage_bytes).filter(
+        Device.marca == brand_name, Device.storage_bytes > 0
+    ).order_by(Device.storage_bytes.desc(), Device.id).limit(limit)
+    return [{'id': row.id, 'nombre_catalogo': row.nombre_catalogo, 'storage_bytes': row.storage_bytes} for row in rows]
+
+
+def total_usage():
+    """Bytes adjuntos en total y bytes realmente guardados en el almacén por contenido (deduplicados)"""
+    attached = db.session.query(func.coalesce(func.sum(BrandStorage.storage_bytes), 0)).scalar()
+    stored = db.session.query(func.coalesce(func.sum(FileBlob.size), 0)).scalar()
+    return {'storage_bytes': attached, 'blob_bytes': stored}
+
+
+def lock_storage_tables():
+    """
+    Bloquear las escrituras de archivos hasta el final de la transacción. En
+    SQLite basta con la primera escritura (bloquea toda la base de datos); en
+    PostgreSQL se bloquean las tablas para que los recuentos y las subidas
+    concurrentes no se intercalen.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(
+            "LOCK TABLE device_file, file_blob, device, brand_storage IN SHARE ROW EXCLUSIVE MODE"
+        ))
+
+
+def reconcile_storage(upload_folder, purge_blobs=True):
+    """
+    Recalcular los agregados desde el disco: corrige file_size con el tamaño real
+    de cada archivo, recuenta las referencias de cada contenido y reescribe
+    device.storage_bytes y brand_storage. Con purge_blobs, elimina después los
+    contenidos sin referencias (purge() vuelve a comprobarlo con la fila
+    bloqueada, así que una subida concurrente nunca pierde su contenido).
+    Devuelve un resumen.
+    """
+    corrected = missing = 0
+    for device_file in DeviceFile.query.filter(DeviceFile.file_path.isnot(None)).yield_per(500):
+        # Rutas guardadas en Windows con barras invertidas: '/' sirve en cualquier sistema
+        path = os.path.join(upload_folder, device_file.file_path.replace('\\', '/'))
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            missing += 1
+            print(f"[STORAGE] Archivo no encontrado para DeviceFile {device_file.id}: {device_file.file_path}")
+            continue
+        if device_file.file_size != size:
+            device_file.file_size = size
+            corrected += 1
+    db.session.flush()
+
+    # Desde aquí hasta el commit ninguna subida ni borrado puede intercalarse
+    lock_storage_tables()
+    files = DeviceFile.__table__
+    devices = Device.__table__
+    stored_files = files.c.file_path.isnot(None)
+
+    blobs = FileBlob.__table__
+    db.session.execute(blobs.update().values(ref_count=(
+        select(func.count(files.c.id))
+        .where(files.c.sha256 == blobs.c.sha256, BlobStore.blob_path_condition(files.c.file_path))
+        .scalar_subquery()
+    )))
+
+    db.session.execute(devices.update().values(storage_bytes=(
+        select(func.coalesce(func.sum(files.c.file_size), 0))
+        .where(files.c.device_id == devices.c.id, stored_files).scalar_subquery()
+    )))
+
+    db.session.execute(BrandStorage.__table__.delete())
+    totals = db.session.execute(
+        select(devices.c.marca, func.coalesce(func.sum(files.c.file_size), 0), func.count(files.c.id))
+        .select_from(files.join(devices, files.c.device_id == devices.c.id))
+        .where(stored_files).group_by(devices.c.marca)
+    ).all()
+    for brand_name, size, count in totals:
+        db.session.add(BrandStorage(brand_name=brand_name, storage_bytes=size, file_count=count))
+
+    unreferenced = [sha256 for (sha256,) in db.session.query(FileBlob.sha256).filter(FileBlob.ref_count <= 0)]
+    db.session.commit()
+
+    # Contenidos que ya no usa ningún DeviceFile
+    purged = blob_store.purge(unreferenced) if purge_blobs else 0
+
+    return {
+        'corrected_sizes': corrected,
+        'missing_files': missing,
+        'brands': len(totals),
+        'unreferenced_blobs': len(unreferenced),
+        'purged_blobs': purged
+    }
+
+
+def backfill_storage_usage(upload_folder):
+    """Calcular los agregados la primera vez (bases de datos anteriores a brand_storage)"""
+    if BrandStorage.query.first() is None and DeviceFile.query.filter(DeviceFile.file_path.isnot(None)).first():
+        print("[STORAGE] Calculando el uso de almacenamiento por dispositivo y marca...")
+        # Sin purgar contenidos: al arrancar solo se calculan los agregados
+        print(f"[STORAGE] {reconcile_storage(upload_folder, purge_blobs=False)}")
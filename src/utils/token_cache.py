@@ -0,0 +1,88 @@
+"""
+Caché en memoria (por worker) de la validación de tokens QR de marca.
+
+Cada escaneo de un QR de marca llama a /api/auth/validate-qr-token con el mismo
+(token, marca). El resultado se guarda con un TTL en un LRU acotado:
+- Positivo: id del QrToken y su expiración (se descarta en cuanto expira).
+- Negativo: el mensaje de error, con un TTL más corto. Los negativos van en un
+  LRU aparte para que una ráfaga de tokens inventados no desaloje a los válidos.
+
+En el worker que revoca un token (delete_brand, mark_as_used) la invalidación es
+inmediata; en el resto el TTL acota cuánto tiempo puede seguir aceptándose.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+# Resultado de validar un (token, marca): error es None si el token es válido
+TokenValidation = namedtuple('TokenValidation', ['token_id', 'brand_name', 'expires_at', 'error'])
+
+
+class QrTokenValidationCache:
+    def __init__(self, ttl=300, negative_ttl=60, max_entries=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._valid = OrderedDict()
+        self._invalid = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('QR_TOKEN_CACHE_TTL', self.ttl)
+        self.negative_ttl = app.config.get('QR_TOKEN_CACHE_NEGATIVE_TTL', self.negative_ttl)
+        self.max_entries = app.config.get('QR_TOKEN_CACHE_MAX_ENTRIES', self.max_entries)
+
+    def get(self, token, brand_name):
+        """TokenValidation guardada para (token, marca), o None si hay que consultar la base de datos"""
+        key = (token, brand_name)
+        now = time.monotonic()
+        with self._lock:
+            for entries in (self._valid, self._invalid):
+                entry = entries.get(key)
+                if entry is None:
+                    continue
+                stored_at, result = entry
+                ttl = self.ttl if result.error is None else self.negative_ttl
+                expired = result.expires_at is not None and result.expires_at <= datetime.utcnow()
+                if now - stored_at > ttl or (result.error is None and expired):
+                    del entries[key]
+                    return None
+                entries.move_to_end(key)
+                return result
+        return None
+
+    def set(self, token, brand_name, result):
+        """Guardar el resultado de la validación y devolverlo"""
+        ttl = self.ttl if result.error is None else self.negative_ttl
+        if not ttl:
+            return result
+        entries = self._valid if result.error is None else self._invalid
+        with self._lock:
+            entries[(token, brand_name)] = (time.monotonic(), result)
+            entries.move_to_end((token, brand_name))
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return result
+
+    def invalidate_token(self, token):
+        """Olvidar un token (por ejemplo, al marcarlo como usado)"""
+        with self._lock:
+            for entries in (self._valid, self._invalid):
+                for key in [key for key in entries if key[0] == token]:
+                    del entries[key]
+
+    def invalidate_brand(self, brand_name):
+        """Olvidar los tokens válidos de una marca (al eliminarla)"""
+        with self._lock:
+            for key in [key for key, (_, result) in self._valid.items() if result.brand_name == brand_name]:
+                del self._valid[key]
+
+    def clear(self):
+        with self._lock:
+            self._valid.clear()
+            self._invalid.clear()
+
+
+qr_token_cache = QrTokenValidationCache()
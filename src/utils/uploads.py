@@ -0,0 +1,169 @@
+"""
+Recepción de archivos subidos en streaming.
+
+El cuerpo multipart se lee por bloques sin pasar por request.form/request.files:
+los campos de texto se guardan en memoria y el archivo se escribe directamente
+en un temporal de la carpeta de destino mientras se calculan su tamaño y su
+SHA-256. Si supera el límite se aborta en ese mismo bloque, y al terminar se
+mueve a su nombre definitivo con un rename atómico (misma carpeta, mismo
+sistema de archivos), así que nunca queda un archivo a medio escribir.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+
+from flask import request
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+CHUNK_SIZE = 64 * 1024
+# Tamaño máximo de los campos de texto del formulario (el mismo que usa Werkzeug por defecto)
+MAX_FIELD_SIZE = 500 * 1024
+
+
+class UploadError(Exception):
+    """Subida rechazada; el mensaje y el código se devuelven tal cual al cliente"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class IncomingFile:
+    """Archivo ya recibido en un temporal, con su tamaño y su SHA-256"""
+    def __init__(self, filename, temp_path, size, sha256):
+        self.filename = filename
+        self.temp_path = temp_path
+        self.size = size
+        self.sha256 = sha256
+
+    def save(self, path):
+        """Mover el temporal a su ruta definitiva (rename atómico)"""
+        os.replace(self.temp_path, path)
+        self.temp_path = None
+
+    def discard(self):
+        if self.temp_path and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.temp_path = None
+
+
+class HashingWriter:
+    """Escribe en un temporal calculando tamaño y SHA-256; aborta al superar el límite"""
+    def __init__(self, directory, limit=None, limit_message=None):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.part')
+        self.file = os.fdopen(fd, 'wb')
+        self.limit = limit
+        self.limit_message = limit_message or 'Archivo muy grande'
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            raise UploadError(self.limit_message)
+        self.hash.update(data)
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def receive_multipart_upload(prepare_file, file_field='file'):
+    """
+    Leer el formulario multipart de la petición actual en streaming.
+
+    prepare_file(fields, filename) se llama al empezar el archivo, con los campos
+    recibidos hasta ese momento, y devuelve (carpeta del temporal, límite en
+    bytes, mensaje si se supera) o None para descartar el archivo; puede lanzar
+    UploadError para rechazar la subida antes de leer el archivo. Devuelve (campos, IncomingFile o None si no se envió archivo).
+    """
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise UploadError('Se esperaba un formulario multipart/form-data')
+
+    decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=MAX_FIELD_SIZE)
+    fields = {}
+    incoming = None
+    writer = None
+    part = None
+    buffer = []
+
+    try:
+        while True:
+            chunk = request.stream.read(CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    part, buffer = event, []
+                elif isinstance(event, File):
+                    part = event
+                    if event.name == file_field and event.filename and incoming is None and writer is None:
+                        target = prepare_file(fields, event.filename)
+                        if target is not None:
+                            writer = HashingWriter(*target)
+                elif isinstance(event, Data):
+                    if isinstance(part, Field):
+                        buffer.append(event.data)
+                        if sum(len(data) for data in buffer) > MAX_FIELD_SIZE:
+                            raise UploadError(f"Campo '{part.name}' demasiado grande", 413)
+                        if not event.more_data:
+                            fields[part.name] = b''.join(buffer).decode('utf-8', 'replace')
+                    elif writer is not None and part.name == file_field:
+                        writer.write(event.data)
+                        if not event.more_data:
+                            writer.close()
+                            incoming = IncomingFile(part.filename, writer.path, writer.size, writer.hash.hexdigest())
+                            writer = None
+                    # Los demás archivos del formulario se descartan sin guardarlos
+                event = decoder.next_event()
+            if not chunk or isinstance(event, Epilogue):
+                break
+    except BaseException as e:
+        if writer is not None:
+            writer.abort()
+        if incoming is not None:
+            incoming.discard()
+        if isinstance(e, ValueError):
+            raise UploadError(f'Formulario mal formado: {e}')
+        raise
+
+    if writer is not None:
+        # El cuerpo terminó antes que el archivo
+        writer.abort()
+        raise UploadError('Subida incompleta')
+    return fields, incoming
+
+
+def purge_stale_temp_files(directory, older_than):
+    """
+    Eliminar de 'directory' (sin entrar en subcarpetas) los temporales de subidas
+    interrumpidas (worker reiniciado a mitad de una subida) con más de
+    older_than segundos. Devuelve cuántos se eliminaron.
+    """
+    purged = 0
+    now = time.time()
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not (entry.name.startswith('.upload-') and entry.name.endswith('.part')):
+            continue
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > older_than:
+                os.remove(entry.path)
+                purged += 1
+        except FileNotFoundError:
+            pass
+    return purged